@@ -0,0 +1,104 @@
+"""
+Benchmark of the display downsampling (preview tap) at 1152x1024.
+
+For Bayer, RGB and gray frames, times Downsampler (superpixel debayer and area
+averaging of Bayer frames, per-channel decimation of the others, into a
+preallocated slot) against the previous stride slicing (frame[::ds, ::ds], copied
+into the slot), and reports the memory allocated per frame (tracemalloc). Bayer
+frames are made by mosaicing a known color image, so the color error of the
+preview is reported too; stride slicing shows one photosite color. Exits with 1 if a Downsampler case exceeds BUDGET_US.
+
+Usage:
+python -m campy.bench.downsample [--numFrames 500] [--width 1152] [--height 1024]
+"""
+
+import sys
+import time
+import json
+import argparse
+import tracemalloc
+import numpy as np
+from campy.display.downsample import Downsampler, BAYER_PATTERNS, BUDGET_US
+
+def TestImage(height, width):
+	# Smooth color gradients, 3 channels
+	y, x = np.mgrid[0:height, 0:width]
+	image = np.stack([255*x/width, 255*y/height, 255*(1 - x/width)], axis=2)
+	return image.astype('uint8')
+
+def Mosaic(image, pixelFormat):
+	# Bayer frame sampling image at the photosites of pixelFormat
+	frame = np.empty(image.shape[:2], dtype='uint8')
+	for c, sites in enumerate(BAYER_PATTERNS[pixelFormat]):
+		for dy, dx in sites:
+			frame[dy::2, dx::2] = image[dy::2, dx::2, c]
+	return frame
+
+def TimePerFrame(fn, numFrames):
+	fn()
+	timeStart = time.perf_counter()
+	for _ in range(numFrames):
+		fn()
+	return 1e6*(time.perf_counter() - timeStart)/numFrames
+
+def BytesPerFrame(fn, numFrames):
+	fn()
+	tracemalloc.start()
+	before = tracemalloc.get_traced_memory()[0]
+	for _ in range(numFrames):
+		fn()
+	current, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	return {"retained": (current - before)/numFrames, "peak": peak - before}
+
+def ColorError(preview, image, step):
+	# Mean absolute difference to the reference image averaged over step x step blocks
+	h, w = preview.shape[:2]
+	reference = image[:h*step, :w*step].reshape(h, step, w, step, 3).mean(axis=(1, 3))
+	if preview.ndim == 2:
+		preview = preview[:, :, None]
+	return float(np.abs(preview[:, :, :3].astype(float) - reference).mean())
+
+def Main():
+	parser = argparse.ArgumentParser(description="Campy display downsampling benchmark")
+	parser.add_argument("--numFrames", type=int, default=500, help="Frames per case.")
+	parser.add_argument("--width", type=int, default=1152, help="Frame width.")
+	parser.add_argument("--height", type=int, default=1024, help="Frame height.")
+	args = parser.parse_args()
+
+	image = TestImage(args.height, args.width)
+	frames = {"bayer_rggb8": Mosaic(image, "bayer_rggb8"),
+			"bayer_bggr8": Mosaic(image, "bayer_bggr8"),
+			"rgb24": image,
+			"gray": np.ascontiguousarray(image[:, :, 1])}
+
+	results = {}
+	overBudget = []
+	for pixelFormat, frame in frames.items():
+		for ds in (2, 4):
+			name = "{} ds={}".format(pixelFormat, ds)
+			downsample = Downsampler(frame.shape, pixelFormat, ds)
+			slot = np.empty(frame[::ds, ::ds].shape, dtype='uint8')
+			stride = lambda: np.copyto(slot, frame[::ds, ::ds])
+			tap = lambda: downsample(frame)
+			results[name] = {
+				"stride": {"us": round(TimePerFrame(stride, args.numFrames), 1)},
+				"downsampler": {"us": round(TimePerFrame(tap, args.numFrames), 1),
+								"bytesPerFrame": BytesPerFrame(tap, args.numFrames),
+								"shape": downsample.shape}}
+			if pixelFormat != "gray":
+				step = downsample.step
+				results[name]["downsampler"]["colorError"] = round(ColorError(downsample(frame), image, step), 2)
+				results[name]["stride"]["colorError"] = round(ColorError(frame[::step, ::step], image, step), 2)
+			if results[name]["downsampler"]["us"] > BUDGET_US:
+				overBudget.append(name)
+			print(name, results[name])
+
+	results["budgetUs"] = BUDGET_US
+	results["overBudget"] = overBudget
+	print(json.dumps(results, indent=1))
+	if overBudget:
+		sys.exit(1)
+
+if __name__ == '__main__':
+	Main()
@@ -0,0 +1,255 @@
+"""
+Encoder benchmark for the OpenWriter codec paths.
+
+Frames are sent through campipe.OpenWriter, so every case uses the exact ffmpeg
+arguments campy records with (EncoderParams: CPU libx264/libx265, nvidia, amd,
+intel). Cases cover each encoder, preset (encoderPreset), input pixel format and
+resolution. For every case the benchmark reports sustained fps (frames sent as
+fast as possible, including ffmpeg finishing the file), CPU use of the writer
+and ffmpeg (100% = one core), peak ffmpeg RSS and output bitrate at the
+configured frameRate.
+
+Encoders that ffmpeg does not list, or that fail a short probe encode (e.g. no
+such GPU), are skipped. Frames are synthetic (a moving gradient with noise) or
+taken from an emu video (--emuVideo), cropped/tiled to each resolution.
+Results are printed as JSON (--output to save them); progress goes to stderr.
+
+Usage:
+campy-bench-encode [--gpuMakes cpu nvidia] [--codecs h264 h265] [--presets fast faster]
+		[--pixelFormats rgb24 bayer_bggr8] [--resolutions 1152x1024 1920x1200] [--numFrames 500]
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+import contextlib
+import numpy as np
+from imageio_ffmpeg import get_ffmpeg_exe
+from campy.writer import campipe
+from campy.writer.buffers import FrameShape
+from campy.writer.pipewriter import OpenPipeWriter, MacroBlockParams
+
+try:
+	import psutil
+except ImportError:
+	psutil = None
+
+try:
+	import resource
+except ImportError:
+	resource = None
+
+PIXEL_FORMATS = ["rgb24", "bayer_bggr8", "bayer_rggb8", "bgr8"]
+RESOLUTIONS = ["640x512", "1152x1024", "1920x1200"]
+GPU_MAKES = ["cpu", "nvidia", "amd", "intel"]
+
+def BenchParams(folder, gpuMake, codec, preset, pixelFormat, resolution, args):
+	# cam_params as seen by OpenWriter
+	width, height = [int(x) for x in resolution.split('x')]
+	return {"n_cam": 0,
+			"cameraName": "bench",
+			"cameraMake": "bench",
+			"videoFolder": folder,
+			"videoFilename": "bench.mp4",
+			"frameWidth": width,
+			"frameHeight": height,
+			"frameRate": args.frameRate,
+			"pixelFormatInput": pixelFormat,
+			"pixelFormatOutput": args.pixelFormatOutput,
+			"codec": codec,
+			"quality": args.quality,
+			"gpuID": -1 if gpuMake == "cpu" else args.gpuID,
+			"gpuMake": "nvidia" if gpuMake == "cpu" else gpuMake,
+			"encoderPreset": preset,
+			"ffmpegLogLevel": "error",
+			"writerBackend": args.writerBackend,
+			"writerBatchFrames": 1,
+			"outputContainer": "mp4",
+			"frameTimestamps": False,}
+
+def ListEncoders():
+	# Encoder names compiled into the ffmpeg campy uses
+	out = subprocess.run([get_ffmpeg_exe(), '-hide_banner', '-encoders'],
+						capture_output=True, text=True).stdout
+	encoders = set()
+	for line in out.splitlines():
+		parts = line.split()
+		if len(parts) > 1 and len(parts[0]) == 6 and parts[0][0] == 'V':
+			encoders.add(parts[1])
+	return encoders
+
+def ProbeEncoder(cam_params, folder):
+	# Encodes a few frames with the case's exact arguments; False if ffmpeg fails.
+	# Messages of a failing probe go to stderr, stdout only carries the JSON results.
+	codec, pix_fmt_out, gpu_params = campipe.EncoderParams(cam_params)
+	cam_params = dict(cam_params, frameWidth=256, frameHeight=256, ffmpegLogLevel="quiet")
+	with contextlib.redirect_stdout(sys.stderr):
+		writer = OpenPipeWriter(cam_params, os.path.join(folder, 'probe.mp4'), codec, pix_fmt_out,
+								MacroBlockParams(cam_params) + gpu_params)
+		frame = np.zeros(FrameShape(cam_params), dtype='uint8')
+		try:
+			for i in range(5):
+				writer.send(frame)
+		except OSError:
+			pass
+		return writer.close() == 0
+
+def SyntheticFrames(shape, numFrames=16):
+	# Moving gradient plus noise: compressible, but not trivially so
+	rng = np.random.default_rng(0)
+	y, x = np.mgrid[0:shape[0], 0:shape[1]]
+	frames = []
+	for i in range(numFrames):
+		frame = ((x + y + 8*i) % 256).astype('uint8')
+		frame = frame + rng.integers(0, 16, frame.shape, dtype='uint8')
+		if len(shape) > 2:
+			frame = np.repeat(frame[:, :, None], shape[2], axis=2)
+		frames.append(frame)
+	return frames
+
+def EmuFrames(path, shape, numFrames=16):
+	# Frames of an emu video, tiled/cropped to shape; single channel for Bayer and gray
+	import imageio
+	reader = imageio.get_reader(path)
+	frames = []
+	for i, im in enumerate(reader):
+		if i >= numFrames:
+			break
+		im = np.asarray(im, dtype='uint8')
+		if len(shape) == 2:
+			im = im[:, :, 0] if im.ndim == 3 else im
+		else:
+			im = im if im.ndim == 3 else np.repeat(im[:, :, None], 3, axis=2)
+			im = im[:, :, :shape[2]]
+			if im.shape[2] < shape[2]:
+				im = np.concatenate([im, np.full(im.shape[:2] + (shape[2]-im.shape[2],), 255, 'uint8')], 2)
+		reps = (-(-shape[0]//im.shape[0]), -(-shape[1]//im.shape[1])) + (1,)*(im.ndim-2)
+		frames.append(np.ascontiguousarray(np.tile(im, reps)[:shape[0], :shape[1]]))
+	reader.close()
+	return frames
+
+class Monitor():
+	# Samples CPU time and RSS of the benchmark process and its ffmpeg children
+	def __init__(self):
+		self.proc = psutil.Process() if psutil is not None else None
+		self.children = {}
+		self.peakRss = 0
+
+	def Sample(self):
+		if self.proc is None:
+			return
+		try:
+			for child in self.proc.children(recursive=True):
+				self.children[child.pid] = child
+				with child.oneshot():
+					self.peakRss = max(self.peakRss, child.memory_info().rss)
+					child.cpuTime = sum(child.cpu_times()[:2])
+		except psutil.Error:
+			pass
+
+	def CpuTime(self):
+		# Own CPU time plus that of finished and sampled children
+		t = os.times()
+		cpu = t.user + t.system + t.children_user + t.children_system
+		if psutil is not None and not hasattr(os, 'fork'):
+			# Windows does not report the CPU time of finished children
+			cpu += sum(getattr(c, 'cpuTime', 0) for c in self.children.values())
+		return cpu
+
+def RunCase(cam_params, frames, numFrames):
+	monitor = Monitor()
+	with contextlib.redirect_stdout(sys.stderr):
+		writer = campipe.OpenWriter(cam_params)
+	_, full_file_name = campipe.WriterFileName(cam_params)
+
+	cpuStart = monitor.CpuTime()
+	timeStart = time.perf_counter()
+	for i in range(numFrames):
+		writer.send(frames[i % len(frames)])
+		if i % 50 == 0:
+			monitor.Sample()
+	writer.close()
+	wallTime = time.perf_counter() - timeStart
+	cpuTime = monitor.CpuTime() - cpuStart
+
+	peakRss = monitor.peakRss
+	if peakRss == 0 and resource is not None:
+		# Peak over all children so far (kB on Linux)
+		peakRss = 1024*resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+
+	size = os.path.getsize(full_file_name) if os.path.isfile(full_file_name) else 0
+	os.remove(full_file_name)
+	return {"fps": round(numFrames/wallTime, 1),
+			"realTime": numFrames/wallTime >= cam_params["frameRate"],
+			"cpuPercent": round(100*cpuTime/wallTime, 1),
+			"peakRssMB": round(peakRss/2**20, 1),
+			"bitrateMbps": round(8*size/(numFrames/cam_params["frameRate"])/1e6, 2),}
+
+def Main():
+	parser = argparse.ArgumentParser(description="Campy encoder benchmark")
+	parser.add_argument("--gpuMakes", nargs='+', default=GPU_MAKES, help="'cpu', 'nvidia', 'amd', 'intel'.")
+	parser.add_argument("--codecs", nargs='+', default=["h264", "h265"], help="Campy codecs.")
+	parser.add_argument("--presets", nargs='+', default=[""], help="encoderPreset values. '' = campy default.")
+	parser.add_argument("--pixelFormats", nargs='+', default=PIXEL_FORMATS, help="pixelFormatInput values.")
+	parser.add_argument("--resolutions", nargs='+', default=RESOLUTIONS, help="WxH.")
+	parser.add_argument("--pixelFormatOutput", default="rgb0", help="pixelFormatOutput, as in the config.")
+	parser.add_argument("--quality", default="21", help="Campy quality setting.")
+	parser.add_argument("--frameRate", type=float, default=100, help="Target frame rate (for realTime and bitrate).")
+	parser.add_argument("--gpuID", type=int, default=0, help="GPU for the hardware encoders.")
+	parser.add_argument("--writerBackend", default="imageio", help="'imageio' or 'pipe'.")
+	parser.add_argument("--numFrames", type=int, default=500, help="Frames per case.")
+	parser.add_argument("--emuVideo", default=None, help="Video to take frames from instead of synthetic frames.")
+	parser.add_argument("--output", default=None, help="JSON file to save results to.")
+	args = parser.parse_args()
+
+	folder = tempfile.mkdtemp(prefix='campy-bench-')
+	available = ListEncoders()
+	results = []
+	try:
+		for gpuMake in args.gpuMakes:
+			for codec in args.codecs:
+				probed = {}
+				for preset in args.presets:
+					for pixelFormat in args.pixelFormats:
+						for resolution in args.resolutions:
+							cam_params = BenchParams(folder, gpuMake, codec, preset, pixelFormat, resolution, args)
+							case = {"gpuMake": gpuMake, "codec": codec, "preset": preset,
+									"pixelFormatInput": pixelFormat, "resolution": resolution}
+							encoder = campipe.EncoderParams(cam_params)[0]
+							case["encoder"] = encoder
+
+							# Skip encoders ffmpeg does not have, or that fail on this machine
+							key = (preset, pixelFormat)
+							if key not in probed:
+								probed[key] = encoder in available and ProbeEncoder(cam_params, folder)
+							if not probed[key]:
+								case["skipped"] = "{} not available".format(encoder)
+								print(case, file=sys.stderr)
+								results.append(case)
+								continue
+
+							shape = FrameShape(cam_params)
+							if args.emuVideo:
+								frames = EmuFrames(args.emuVideo, shape)
+							else:
+								frames = SyntheticFrames(shape)
+							case.update(RunCase(cam_params, frames, args.numFrames))
+							print(case, file=sys.stderr)
+							results.append(case)
+	finally:
+		shutil.rmtree(folder, ignore_errors=True)
+
+	out = {"ffmpeg": get_ffmpeg_exe(), "numFrames": args.numFrames, "frameRate": args.frameRate,
+			"writerBackend": args.writerBackend, "results": results}
+	if args.output:
+		with open(args.output, 'w') as f:
+			json.dump(out, f, indent=1)
+	print(json.dumps(out, indent=1))
+
+if __name__ == '__main__':
+	Main()
@@ -0,0 +1,133 @@
+"""
+Benchmark of the per-frame bookkeeping in the grab loop.
+
+Compares the previous grabdata dict of Python lists (frame number and timestamp,
+and the same with all six FrameLog fields) with FrameLog, the memory-mapped
+structured array the grabbers now append to, and with two other ways of filling
+a preallocated numpy structured array: a record tuple (arr[i] = (...)) and one
+view per field. Reports the time per frame and the memory each frame keeps:
+Python heap (tracemalloc) for the lists and numpy arrays, heap and file bytes
+for FrameLog. Memory is extrapolated to a session of --sessionSec at
+--frameRate. memoryReduction is the memory per frame of the six-field lists over
+that of FrameLog (heap and file).
+
+Usage:
+python -m campy.bench.grabdata [--numFrames 1000000] [--sessionSec 14400] [--frameRate 150]
+"""
+
+import os
+import gc
+import time
+import json
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+from campy.writer.framelog import FrameLog, RECORD
+
+def ListsTwoFields(numFrames):
+	grabdata = {'timeStamp': [], 'frameNumber': []}
+	timeFirstGrab = time.perf_counter()
+	for cnt in range(1, numFrames+1):
+		grabtime = time.perf_counter() - timeFirstGrab
+		grabdata['timeStamp'].append(grabtime)
+		grabdata['frameNumber'].append(cnt)
+	return grabdata
+
+def ListsSixFields(numFrames):
+	keys = ('frameNumber', 'frameNumberThisTrial', 'queueDepth', 'timeStamp', 'hostTimeStamp', 'frameID')
+	grabdata = {key: [] for key in keys}
+	timeFirstGrab = time.perf_counter()
+	for cnt in range(1, numFrames+1):
+		grabtime = time.perf_counter() - timeFirstGrab
+		grabdata['frameNumber'].append(cnt)
+		grabdata['frameNumberThisTrial'].append(cnt)
+		grabdata['queueDepth'].append(cnt % 8)
+		grabdata['timeStamp'].append(grabtime)
+		grabdata['hostTimeStamp'].append(time.time())
+		grabdata['frameID'].append(cnt + 1000000)
+	return grabdata
+
+def RecordTuples(numFrames):
+	records = np.zeros(numFrames, dtype=RECORD)
+	timeFirstGrab = time.perf_counter()
+	for cnt in range(1, numFrames+1):
+		grabtime = time.perf_counter() - timeFirstGrab
+		records[cnt-1] = (cnt, cnt, cnt % 8, grabtime, time.time(), cnt + 1000000)
+	return records
+
+def FieldViews(numFrames):
+	records = np.zeros(numFrames, dtype=RECORD)
+	frameNumber, frameNumberThisTrial, queueDepth, timeStamp, hostTimeStamp, frameID = (
+		records[name] for name in RECORD.names)
+	timeFirstGrab = time.perf_counter()
+	for cnt in range(1, numFrames+1):
+		grabtime = time.perf_counter() - timeFirstGrab
+		i = cnt - 1
+		frameNumber[i] = cnt
+		frameNumberThisTrial[i] = cnt
+		queueDepth[i] = cnt % 8
+		timeStamp[i] = grabtime
+		hostTimeStamp[i] = time.time()
+		frameID[i] = cnt + 1000000
+	return records
+
+def FrameLogSixFields(numFrames, path):
+	frameLog = FrameLog(path)
+	timeFirstGrab = time.perf_counter()
+	for cnt in range(1, numFrames+1):
+		grabtime = time.perf_counter() - timeFirstGrab
+		frameLog.Append(cnt, grabtime, cnt, time.time(), cnt + 1000000, cnt % 8)
+	return frameLog
+
+def Run(name, fn, numFrames, *args):
+	gc.collect()
+	tracemalloc.start()
+	timeStart = time.perf_counter()
+	result = fn(numFrames, *args)
+	elapsed = time.perf_counter() - timeStart
+	heapBytes = tracemalloc.get_traced_memory()[0]
+	tracemalloc.stop()
+
+	# Timing again without tracemalloc, which slows allocations down
+	if isinstance(result, FrameLog):
+		result.Close()
+	del result
+	gc.collect()
+	timeStart = time.perf_counter()
+	result = fn(numFrames, *args)
+	elapsed = time.perf_counter() - timeStart
+	fileBytes = os.path.getsize(args[0]) if args else 0
+	if isinstance(result, FrameLog):
+		result.Close()
+	return {"nsPerFrame": round(1e9*elapsed/numFrames, 1),
+			"heapBytesPerFrame": round(heapBytes/numFrames, 1),
+			"fileBytesPerFrame": round(fileBytes/numFrames, 1)}
+
+def Main():
+	parser = argparse.ArgumentParser(description="Campy grab loop bookkeeping benchmark")
+	parser.add_argument("--numFrames", type=int, default=1000000, help="Frames appended per case.")
+	parser.add_argument("--sessionSec", type=float, default=14400, help="Session length for the memory estimate.")
+	parser.add_argument("--frameRate", type=float, default=150, help="Frame rate for the memory estimate.")
+	args = parser.parse_args()
+
+	sessionFrames = args.sessionSec*args.frameRate
+	results = {}
+	with tempfile.TemporaryDirectory() as folder_name:
+		cases = [("lists, 2 fields", ListsTwoFields, ()),
+				("lists, 6 fields", ListsSixFields, ()),
+				("numpy record tuples", RecordTuples, ()),
+				("numpy field views", FieldViews, ()),
+				("FrameLog, 6 fields", FrameLogSixFields, (os.path.join(folder_name, "frametimes.log"),)),]
+		for name, fn, fnArgs in cases:
+			results[name] = Run(name, fn, args.numFrames, *fnArgs)
+			results[name]["sessionHeapMB"] = round(results[name]["heapBytesPerFrame"]*sessionFrames/1e6, 1)
+			print(name, results[name])
+	results["recordBytes"] = RECORD.itemsize
+	lists, frameLog = results["lists, 6 fields"], results["FrameLog, 6 fields"]
+	results["memoryReduction"] = round(lists["heapBytesPerFrame"]/
+		(frameLog["heapBytesPerFrame"] + frameLog["fileBytesPerFrame"]), 1)
+	print(json.dumps(results, indent=1))
+
+if __name__ == '__main__':
+	Main()
@@ -0,0 +1,81 @@
+"""
+Benchmark of the ffmpeg writer backends on synthetic frames.
+
+Sends the same frames through imageio_ffmpeg.write_frames (writerBackend 'imageio')
+and through PipeWriter (writerBackend 'pipe', with and without batching). ffmpeg
+copies the frames to the null muxer by default, so the numbers reflect the cost of
+getting frames into ffmpeg rather than encoding. Reports sustained fps and the
+writer's CPU time per frame, i.e. fps per core of the Python process.
+
+Usage:
+python -m campy.bench.pipewriter [--width 640] [--height 512] [--numFrames 5000] [--batchFrames 8]
+"""
+
+import time
+import json
+import argparse
+import numpy as np
+from imageio_ffmpeg import write_frames
+from campy.writer.pipewriter import OpenPipeWriter
+
+def BenchParams(args):
+	return {"frameWidth": args.width,
+			"frameHeight": args.height,
+			"frameRate": 100,
+			"pixelFormatInput": args.pixelFormat,
+			"ffmpegLogLevel": "error",
+			"writerBatchFrames": 1,}
+
+def OpenBenchWriter(backend, cam_params, codec, batchFrames):
+	output_params = ['-f', 'null']
+	if backend == "imageio":
+		writer = write_frames('-', [cam_params["frameWidth"], cam_params["frameHeight"]],
+						fps=cam_params["frameRate"], quality=None, codec=codec,
+						pix_fmt_in=cam_params["pixelFormatInput"], pix_fmt_out=cam_params["pixelFormatInput"],
+						macro_block_size=1, ffmpeg_log_level=cam_params["ffmpegLogLevel"],
+						input_params=['-an'], output_params=output_params)
+		writer.send(None)
+		return writer
+	cam_params = dict(cam_params, writerBatchFrames=batchFrames)
+	return OpenPipeWriter(cam_params, '-', codec, cam_params["pixelFormatInput"], output_params)
+
+def RunWriter(backend, cam_params, frames, numFrames, codec, batchFrames=1):
+	writer = OpenBenchWriter(backend, cam_params, codec, batchFrames)
+	cpuStart = time.process_time()
+	timeStart = time.perf_counter()
+	for i in range(numFrames):
+		writer.send(frames[i % len(frames)])
+	cpuTime = time.process_time() - cpuStart
+	writer.close()
+	wallTime = time.perf_counter() - timeStart
+	return {"fps": round(numFrames/wallTime, 1),
+			"cpuUsPerFrame": round(1e6*cpuTime/numFrames, 1),
+			"fpsPerCore": round(numFrames/max(cpuTime, 1e-9), 1)}
+
+def Main():
+	parser = argparse.ArgumentParser(description="Campy ffmpeg writer backend benchmark")
+	parser.add_argument("--width", type=int, default=640, help="Frame width in pixels.")
+	parser.add_argument("--height", type=int, default=512, help="Frame height in pixels.")
+	parser.add_argument("--pixelFormat", default="gray", help="Input pixel format, e.g. 'gray' or 'rgb24'.")
+	parser.add_argument("--numFrames", type=int, default=5000, help="Frames written per backend.")
+	parser.add_argument("--batchFrames", type=int, default=8, help="Frames per pipe write for the batched case.")
+	parser.add_argument("--codec", default="rawvideo", help="ffmpeg encoder, e.g. 'rawvideo' or 'libx264'.")
+	args = parser.parse_args()
+
+	cam_params = BenchParams(args)
+	channels = {"rgb24": 3, "bgr24": 3}.get(args.pixelFormat, 1)
+	shape = (args.height, args.width, channels) if channels > 1 else (args.height, args.width)
+	rng = np.random.default_rng(0)
+	frames = [rng.integers(0, 256, shape, dtype='uint8') for i in range(8)]
+
+	cases = [("imageio write_frames", "imageio", 1),
+			("PipeWriter", "pipe", 1),
+			("PipeWriter, batch {}".format(args.batchFrames), "pipe", args.batchFrames),]
+	results = {}
+	for name, backend, batchFrames in cases:
+		results[name] = RunWriter(backend, cam_params, frames, args.numFrames, args.codec, batchFrames)
+		print(name, results[name])
+	print(json.dumps(results, indent=1))
+
+if __name__ == '__main__':
+	Main()
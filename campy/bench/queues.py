@@ -0,0 +1,99 @@
+"""
+Benchmark of the writer/display queue consumers.
+
+Compares the old sleep-polling loops (deque + time.sleep(0.0001) for the writer,
+time.sleep(0.01) for the display) with the blocking FrameRing and BlockingDeque.
+Reports consumer CPU use while the queue is idle and wake-up latency from
+append() to the consumer receiving the item.
+
+Usage:
+python -m campy.bench.queues [--idleTime 5] [--numFrames 500]
+"""
+
+import time
+import json
+import argparse
+import threading
+import numpy as np
+from collections import deque
+from campy.writer.buffers import FrameRing, BlockingDeque
+
+def PollingConsumer(queue, sleepTime, stop, received):
+	# Same structure as the previous WriteFrames/DisplayFrames loops
+	while not stop.is_set():
+		if queue:
+			queue.popleft()
+			received.append(time.perf_counter())
+		else:
+			time.sleep(sleepTime)
+
+def BlockingConsumer(queue, stop, received):
+	while not stop.is_set():
+		item = queue.get(timeout=0.5)
+		if item is not None:
+			received.append(time.perf_counter())
+
+def MakeQueue(kind):
+	if kind == "ring":
+		return FrameRing(8, (16,16))
+	elif kind == "blocking":
+		return BlockingDeque(2)
+	return deque()
+
+def RunConsumer(kind, sleepTime, idleTime, numFrames, interval):
+	queue = MakeQueue(kind)
+	stop = threading.Event()
+	received = []
+	if kind == "polling":
+		args = (queue, sleepTime, stop, received)
+		thread = threading.Thread(target=PollingConsumer, args=args, daemon=True)
+	else:
+		thread = threading.Thread(target=BlockingConsumer, args=(queue, stop, received), daemon=True)
+	thread.start()
+
+	# Idle: nothing is appended, only the consumer runs
+	time.sleep(0.1)
+	cpuStart = time.process_time()
+	time.sleep(idleTime)
+	idleCpu = (time.process_time() - cpuStart)/idleTime
+
+	# Wake-up latency: append one frame at a time, well spaced
+	frame = np.zeros((16,16), dtype='uint8')
+	sent = []
+	for i in range(numFrames):
+		sent.append(time.perf_counter())
+		queue.append(frame)
+		time.sleep(interval)
+	time.sleep(0.1)
+	stop.set()
+	thread.join()
+
+	latency = 1e6*(np.array(received[:len(sent)]) - np.array(sent[:len(received)]))
+	if kind == "ring":
+		queue.Close()
+		queue.Unlink()
+	return {"idleCpuPercent": round(100*idleCpu, 2),
+			"latencyMedianUs": round(float(np.median(latency)), 1),
+			"latencyP99Us": round(float(np.percentile(latency, 99)), 1),
+			"latencyMaxUs": round(float(np.max(latency)), 1),
+			"received": len(received)}
+
+def Main():
+	parser = argparse.ArgumentParser(description="Campy queue consumer benchmark")
+	parser.add_argument("--idleTime", type=float, default=5, help="Idle measurement time in seconds.")
+	parser.add_argument("--numFrames", type=int, default=500, help="Frames sent for latency.")
+	parser.add_argument("--interval", type=float, default=0.002, help="Seconds between frames.")
+	args = parser.parse_args()
+
+	cases = [("writer, polling 0.1 ms (old)", "polling", 0.0001),
+			("writer, FrameRing.get (new)", "ring", None),
+			("display, polling 10 ms (old)", "polling", 0.01),
+			("display, BlockingDeque.get (new)", "blocking", None),]
+	results = {}
+	for name, kind, sleepTime in cases:
+		results[name] = RunConsumer(kind, sleepTime, args.idleTime, args.numFrames, args.interval)
+		print(name, results[name])
+	print(json.dumps(results, indent=1))
+
+if __name__ == '__main__':
+	Main()
@@ -0,0 +1,155 @@
+"""
+Benchmark of campy-acquire startup with emulated cameras (cameraMake 'emu').
+
+Launches campy-acquire on an emu config and measures the time from launch until
+every camera process has printed "ready to ..." (ready to trigger; "ready to
+emulate" for emu), and until the recording has ended. Without --config, a config
+and short source videos for --numCams cameras are generated in a temporary folder.
+
+Also reports the time to import campy.campy in a fresh interpreter and which
+camera, display and video backends (PySpin, simple_pyspin, pypylon, matplotlib,
+imageio) that import loads. Camera processes load only the backend of their
+cameraMake.
+
+Usage:
+python -m campy.bench.startup [--numCams 2] [--repeats 5] [--config ./configs/config_1emu_cpu.yaml]
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+import numpy as np
+import yaml
+from imageio_ffmpeg import write_frames
+
+BACKENDS = ("PySpin", "simple_pyspin", "pypylon", "matplotlib", "imageio")
+READY = "ready to"
+
+IMPORT_SCRIPT = """
+import sys, time, json
+timeStart = time.perf_counter()
+import campy.campy
+elapsed = time.perf_counter() - timeStart
+loaded = sorted(m for m in sys.modules if m.split('.')[0] in {})
+print(json.dumps({{"importSec": elapsed, "loaded": loaded}}))
+""".format(repr(BACKENDS))
+
+def AcquireCommand():
+	# campy-acquire if installed, else the same entry point through this interpreter
+	exe = shutil.which("campy-acquire")
+	if exe is not None:
+		return [exe]
+	return [sys.executable, "-c", "from campy.campy import Main; Main()"]
+
+def MakeEmuConfig(folder_name, numCams, frameRate, recTimeInSec, width=320, height=240):
+	# Source videos are read by the emulated cameras from <videoFolder>/<cameraName>/
+	cameraNames = ["Camera{}".format(n + 1) for n in range(numCams)]
+	frame = np.zeros((height, width, 3), dtype='uint8')
+	for cameraName in cameraNames:
+		os.makedirs(os.path.join(folder_name, cameraName))
+		writer = write_frames(os.path.join(folder_name, cameraName, "src.mp4"), (width, height),
+							fps=frameRate, quality=None, output_params=['-crf', '35'])
+		writer.send(None)
+		for i in range(int(frameRate*recTimeInSec)):
+			frame[:] = i % 256
+			writer.send(frame)
+		writer.close()
+
+	config = {"videoFolder": folder_name,
+			"videoFilename": "src.mp4",
+			"frameRate": frameRate,
+			"recTimeInSec": recTimeInSec,
+			"cameraMake": "emu",
+			"numCams": numCams,
+			"cameraNames": cameraNames,
+			"gpuID": -1,
+			"pixelFormatInput": "rgb24",
+			"pixelFormatOutput": "rgb0",
+			"codec": "h264",
+			"quality": "23",
+			"displayFrameRate": 0,
+			"ffmpegLogLevel": "quiet"}
+	config_path = os.path.join(folder_name, "config.yaml")
+	with open(config_path, 'w') as f:
+		yaml.safe_dump(config, f)
+	return config_path, config
+
+def TimeStartup(command, numCams, timeout):
+	# Seconds from launch until all cameras are ready, and until campy-acquire exits
+	env = dict(os.environ, PYTHONUNBUFFERED="1")
+	timeStart = time.perf_counter()
+	proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env,
+							universal_newlines=True)
+	readySec = None
+	numReady = 0
+	lines = []
+	for line in proc.stdout:
+		lines.append(line)
+		if READY in line:
+			numReady += 1
+			if numReady == numCams:
+				readySec = time.perf_counter() - timeStart
+	try:
+		proc.wait(timeout=timeout)
+	except subprocess.TimeoutExpired:
+		proc.kill()
+		proc.wait()
+	exitSec = time.perf_counter() - timeStart
+	if readySec is None or proc.returncode != 0:
+		raise RuntimeError("campy-acquire failed (exit code {}):\n{}".format(proc.returncode, "".join(lines)))
+	return readySec, exitSec
+
+def TimeImport():
+	out = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT], stdout=subprocess.PIPE, check=True,
+						universal_newlines=True).stdout
+	return json.loads(out.strip().splitlines()[-1])
+
+def Summary(values):
+	return {"min": round(min(values), 3), "median": round(statistics.median(values), 3)}
+
+def Main():
+	parser = argparse.ArgumentParser(description="Campy startup benchmark with emulated cameras")
+	parser.add_argument("--config", help="Emu config to launch. Default: generated for --numCams cameras.")
+	parser.add_argument("--numCams", type=int, default=2, help="Emulated cameras of the generated config.")
+	parser.add_argument("--frameRate", type=float, default=100, help="Frame rate of the generated config.")
+	parser.add_argument("--recTimeInSec", type=int, default=1, help="Recording time of the generated config.")
+	parser.add_argument("--repeats", type=int, default=5, help="Launches to time.")
+	parser.add_argument("--timeout", type=float, default=120, help="Seconds to wait for one launch.")
+	args = parser.parse_args()
+
+	results = {"command": AcquireCommand()}
+	imports = [TimeImport() for _ in range(args.repeats)]
+	results["importSec"] = Summary([result["importSec"] for result in imports])
+	results["backendsLoadedByImport"] = imports[0]["loaded"]
+	print("import campy.campy", results["importSec"], "loads", results["backendsLoadedByImport"])
+
+	with tempfile.TemporaryDirectory() as folder_name:
+		if args.config:
+			config_path = args.config
+			with open(config_path) as f:
+				config = yaml.safe_load(f)
+		else:
+			config_path, config = MakeEmuConfig(folder_name, args.numCams, args.frameRate, args.recTimeInSec)
+		if config.get("cameraMake") != "emu":
+			parser.error("{} is not an emu config.".format(config_path))
+
+		readySec, exitSec = [], []
+		for i in range(args.repeats):
+			ready, done = TimeStartup(results["command"] + [config_path], config["numCams"], args.timeout)
+			readySec.append(ready)
+			exitSec.append(done)
+			print("launch {}: ready after {:.3f} s, exited after {:.3f} s".format(i + 1, ready, done))
+
+	results["numCams"] = config["numCams"]
+	results["readySec"] = Summary(readySec)
+	results["exitSec"] = Summary(exitSec)
+	print(json.dumps(results, indent=1))
+
+if __name__ == '__main__':
+	Main()
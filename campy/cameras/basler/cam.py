@@ -11,6 +11,7 @@
 import numpy as np
 from collections import deque
 import csv
+from campy.writer.framelog import OpenFrameLog
 
 def OpenCamera(cam_params, bufferSize=500, validation=False):
 	n_cam = cam_params["n_cam"]
@@ -47,10 +48,9 @@ def GrabFrames(cam_params, camera, writeQueue, dispQueue, stopQueue):
 	cnt = 0
 	timeout = 0
 
-	# Create dictionary for appending frame number and timestamp information
+	# Frame numbers, timestamps and queue depths are streamed to frametimes.log
 	grabdata = {}
-	grabdata['timeStamp'] = []
-	grabdata['frameNumber'] = []
+	grabdata['frameLog'] = OpenFrameLog(cam_params)
 
 	numImagesToGrab = cam_params['recTimeInSec']*cam_params['frameRate']
 	chunkLengthInFrames = int(round(cam_params["chunkLengthInSec"]*cam_params['frameRate']))
@@ -72,23 +72,24 @@ def GrabFrames(cam_params, camera, writeQueue, dispQueue, stopQueue):
 
 	while(camera.IsGrabbing()):
 		if stopQueue or cnt >= numImagesToGrab:
+			grabdata.update(writeQueue.Stats())
 			CloseCamera(cam_params, camera, grabdata)
 			writeQueue.append('STOP')
 			break
 		try:
 			# Grab image from camera buffer if available
 			grabResult = camera.RetrieveResult(timeout, pylon.TimeoutHandling_ThrowException)
-
-			# Append numpy array to writeQueue for writer to append to file
-			writeQueue.append(grabResult.Array)
+			hostTime = time.time()
 
 			if cnt == 0:
 				timeFirstGrab = grabResult.TimeStamp
 			grabtime = (grabResult.TimeStamp - timeFirstGrab)/1e9
-			grabdata['timeStamp'].append(grabtime)
+
+			# Append numpy array to writeQueue for writer to append to file
+			writeQueue.append(grabResult.Array, grabtime)
 
 			cnt += 1
-			grabdata['frameNumber'].append(cnt) # first frame = 1
+			grabdata['frameLog'].Append(cnt, grabtime, cnt, hostTime, grabResult.BlockID, len(writeQueue)) # first frame = 1
 
 			if cnt % frameRatio == 0:
 				if sys.platform == 'win32' and cam_params['cameraMake'] == 'basler':
@@ -98,8 +99,8 @@ def GrabFrames(cam_params, camera, writeQueue, dispQueue, stopQueue):
 					except Exception as e:
 						logging.error('Caught exception: {}'.format(e))
 				else:
-					dispQueue.append(grabResult.Array[::cam_params["displayDownsample"],
-													::cam_params["displayDownsample"]])
+					# Full frame; the display slot downsamples it (display/downsample.py)
+					dispQueue.append(grabResult.Array)
 			grabResult.Release()
 
 			if cnt % chunkLengthInFrames == 0:
@@ -121,6 +122,10 @@ def CloseCamera(cam_params, camera, grabdata):
 			try:
 				SaveMetadata(cam_params,grabdata)
 				time.sleep(1)
+				if cam_params.get("keepCameraOpen"):
+					# campy-daemon: open and configured for the next recording
+					camera.StopGrabbing()
+					break
 				camera.Close()
 				camera.StopGrabbing()
 				break
@@ -133,22 +138,29 @@ def SaveMetadata(cam_params, grabdata):
 	n_cam = cam_params["n_cam"]
 	full_folder_name = os.path.join(cam_params["videoFolder"], cam_params["cameraName"])
 
-	# Save frame numbers and timestamps in numpy array
-	frame_count = grabdata['frameNumber'][-1]
-	time_count = grabdata['timeStamp'][-1]
+	# Save frame numbers and timestamps in numpy array, from the frame log
+	frameLog = grabdata['frameLog']
+	frameLog.Flush()
+	frame_count = int(frameLog.Last()['frameNumber'])
+	time_count = float(frameLog.Last()['timeStamp'])
 	fps_count = int(round(frame_count/time_count))
 	print('Camera {} saved {} frames at {} fps.'.format(n_cam+1, frame_count, fps_count))
 	try:
 		npy_filename = os.path.join(full_folder_name, 'frametimes.npy')
-		x = np.array([grabdata['frameNumber'], grabdata['timeStamp']])
+		x = frameLog.FrameTimes()
 		np.save(npy_filename,x)
 	except:
 		pass
+	frameLog.Close()
 
 	# Save other recording metadata in csv file
 	meta = cam_params
-	meta['totalFrames'] = grabdata['frameNumber'][-1]
-	meta['totalTime'] = grabdata['timeStamp'][-1]
+	meta['totalFrames'] = frame_count
+	meta['totalTime'] = time_count
+	# Frames dropped or spilled to disk between grabber and writer
+	for key in ('droppedFrames', 'spilledFrames'):
+		if key in grabdata:
+			meta[key] = grabdata[key]
 	keys = meta.keys()
 	vals = meta.values()
 	
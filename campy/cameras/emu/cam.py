@@ -9,6 +9,8 @@
 import numpy as np
 from collections import deque
 import csv
+from campy.writer.framelog import OpenFrameLog
+from campy.utils.log import GetLogger, FrameIntervals
 import imageio
 
 NFRAMES_PER_FILE = 100
@@ -35,10 +37,9 @@ def OpenCamera(cam_params, bufferSize=500, validation=False):
 def GrabFrames(cam_params, camera, writeQueue, dispQueue, stopQueue):
 	n_cam = cam_params["n_cam"]
 
-	# Create dictionary for appending frame number and timestamp information
+	# Frame numbers, timestamps and queue depths are streamed to frametimes.log
 	grabdata = {}
-	grabdata['timeStamp'] = []
-	grabdata['frameNumber'] = []
+	grabdata['frameLog'] = OpenFrameLog(cam_params)
 
 	numImagesToGrab = cam_params['recTimeInSec']*cam_params['frameRate']
 	chunkLengthInFrames = int(round(cam_params["chunkLengthInSec"]*cam_params['frameRate']))
@@ -51,14 +52,18 @@ def GrabFrames(cam_params, camera, writeQueue, dispQueue, stopQueue):
 		frameRatio = cam_params['frameRate']
 	print(cam_params["cameraName"], "ready to emulate.")
 
+	# Frame intervals are logged once per second, off this thread
+	logger = GetLogger(cam_params["cameraName"])
+	intervals = FrameIntervals(logger, cam_params["cameraName"])
+
 	cnt = 0
 	while(True):
-		print(cnt, numImagesToGrab)
 		# -- split files based on num frames
 		if cnt%NFRAMES_PER_FILE==0 and cnt>0:
-			print("Splitting file")
+			logger.info("Splitting file after %d of %d frames", cnt, numImagesToGrab)
 			writeQueue.append('NEWFILE')
 		if stopQueue or cnt >= numImagesToGrab:
+			grabdata.update(writeQueue.Stats())
 			CloseCamera(cam_params, camera, grabdata)
 			writeQueue.append('STOP')
 			break
@@ -66,22 +71,23 @@ def GrabFrames(cam_params, camera, writeQueue, dispQueue, stopQueue):
 			timeStart = time.perf_counter()
 			# Grab image from camera buffer if available
 			grabResult = camera.get_data(cnt).astype("uint8")
-
-			# Append numpy array to writeQueue for writer to append to file
-			writeQueue.append(grabResult)
+			hostTime = time.time()
 
 			if cnt == 0:
 				timeFirstGrab = time.perf_counter()
 			grabtime = (time.perf_counter() - timeFirstGrab)
-			grabdata['timeStamp'].append(grabtime)
+			intervals.Add(grabtime)
+
+			# Append numpy array to writeQueue for writer to append to file
+			writeQueue.append(grabResult, grabtime)
 
 			cnt += 1
-			grabdata['frameNumber'].append(cnt) # first frame = 1
+			grabdata['frameLog'].Append(cnt, grabtime, (cnt-1) % NFRAMES_PER_FILE + 1, hostTime, cnt-1,
+										len(writeQueue)) # first frame = 1
 
 			if cnt % frameRatio == 0:
-				dispQueue.append(grabResult[::cam_params["displayDownsample"],
-											::cam_params["displayDownsample"],
-											:])
+				# Full frame; the display slot downsamples it (display/downsample.py)
+				dispQueue.append(grabResult)
 			if cnt % chunkLengthInFrames == 0:
 				fps_count = int(round(cnt/grabtime))
 				print('Camera %i collected %i frames at %i fps.' % (n_cam,cnt,fps_count))
@@ -113,22 +119,29 @@ def SaveMetadata(cam_params, grabdata):
 	n_cam = cam_params["n_cam"]
 	full_folder_name = os.path.join(cam_params["videoFolder"], cam_params["cameraName"])
 
-	# Save frame numbers and timestamps in numpy array
-	frame_count = grabdata['frameNumber'][-1]
-	time_count = grabdata['timeStamp'][-1]
+	# Save frame numbers and timestamps in numpy array, from the frame log
+	frameLog = grabdata['frameLog']
+	frameLog.Flush()
+	frame_count = int(frameLog.Last()['frameNumber'])
+	time_count = float(frameLog.Last()['timeStamp'])
 	fps_count = int(round(frame_count/time_count))
 	print('Camera {} saved {} frames at {} fps.'.format(n_cam+1, frame_count, fps_count))
 	try:
 		npy_filename = os.path.join(full_folder_name, 'frametimes.npy')
-		x = np.array([grabdata['frameNumber'], grabdata['timeStamp']])
+		x = frameLog.FrameTimes()
 		np.save(npy_filename,x)
 	except:
 		pass
+	frameLog.Close()
 
 	# Save other recording metadata in csv file
 	meta = cam_params
-	meta['totalFrames'] = grabdata['frameNumber'][-1]
-	meta['totalTime'] = grabdata['timeStamp'][-1]
+	meta['totalFrames'] = frame_count
+	meta['totalTime'] = time_count
+	# Frames dropped or spilled to disk between grabber and writer
+	for key in ('droppedFrames', 'spilledFrames'):
+		if key in grabdata:
+			meta[key] = grabdata[key]
 	keys = meta.keys()
 	vals = meta.values()
 	
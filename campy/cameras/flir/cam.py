@@ -8,6 +8,8 @@
 import csv
 from simple_pyspin import Camera, list_cameras
 import yaml
+from campy.writer.framelog import OpenFrameLog
+from campy.utils.log import GetLogger, FrameIntervals
 
 DEBUG = False
 TRIGGERMODE = "Off" # "Off" % TODO make this param, i..e, camrera params.
@@ -173,8 +175,11 @@ def GrabFrames(cam_params, camera, writeQueue, dispQueue, stopQueue):
     # grabdata["grabtime_firstframe"] = []
     grabdata = ResetGrabdata(cam_params, filenum=0)
 
+    # Per-frame events are aggregated or rate limited, and written off this thread
+    logger = GetLogger(cam_params["cameraName"], rateLimit=1.0)
+    intervals = FrameIntervals(GetLogger(cam_params["cameraName"]), cam_params["cameraName"])
+
     chunkLengthInSec = cam_params["chunkLengthInSec"]
-    ds = cam_params["displayDownsample"]
     displayFrameRate = cam_params["displayFrameRate"]
     frameRate = cam_params['frameRate']
     frameRatio = int(round(frameRate/displayFrameRate))
@@ -187,6 +192,9 @@ def GrabFrames(cam_params, camera, writeQueue, dispQueue, stopQueue):
     else:
         timeout = None # then wait indefinitely
 
+    # Stopped by the previous recording of campy-daemon
+    if not camera.running:
+        camera.start()
     print(cam_params["cameraName"], "ready to trigger.")
 
     while(camera.running):
@@ -197,6 +205,7 @@ def GrabFrames(cam_params, camera, writeQueue, dispQueue, stopQueue):
             writeQueue.append('STOP')
             # TODO: make option for this to end when long gap (inter trial interval).
             # TODO: make sure after this STOP, keeps going, with new file.
+            grabdata.update(writeQueue.Stats())
             CloseCamera(cam_params, camera, grabdata)
             break
 
@@ -204,6 +213,7 @@ def GrabFrames(cam_params, camera, writeQueue, dispQueue, stopQueue):
         # image_result = camera.get_image(wait=True)
         # img = camera.get_array(timeout = 20) # msec
         img, tstamp = camera.get_array(timeout = cam_params['trialITI'], get_timestamp=True) # msec
+        hostTime = time.time()
         # # image_result = camera.get_image(timeout = 20)
         # image_result = camera.get_image()
         # if not image_result.IsIncomplete():
@@ -229,28 +239,25 @@ def GrabFrames(cam_params, camera, writeQueue, dispQueue, stopQueue):
             # grabtime2 = (time.time_ns() - timeFirstGrab2)/1e9
             grabtime = (tstamp - timeFirstGrab)/1e9
 
-            if len(grabdata['timeStamp'])>0:
-                # then this is not first trial.
-                inter_frame_time = 1000*(grabtime-grabdata['timeStamp'][-1])
-                print("grabtime, inter_frame_time", grabtime, inter_frame_time)
-                
-                # uncomment this and above to compare two methods for getting time.
-                # print(grabtime, grabtime2, (grabtime2-grabtime)*1000)
+            # grabtime, inter_frame_time: min/mean/max once per second
+            intervals.Add(grabtime)
+
+            # uncomment this and above to compare two methods for getting time.
+            # print(grabtime, grabtime2, (grabtime2-grabtime)*1000)
 
             # split file? This useful for trial-based recordings. (one video per trial)
             # (each trial separated by a long duration)
-            grabdata['timeStamp'].append(grabtime)
 
             # Append numpy array to writeQueue for writer to append to file
             if not NOSAVE:
-                writeQueue.append(img)
+                writeQueue.append(img, grabtime)
             framenum_thistrial += 1
             cnt += 1
-            grabdata["frameNumberThisTrial"].append(framenum_thistrial)
-            grabdata['frameNumber'].append(cnt) # first frame = 1
+            grabdata['frameLog'].Append(cnt, grabtime, framenum_thistrial, hostTime, -1, len(writeQueue)) # first frame = 1
 
             if cnt % frameRatio == 0:
-                dispQueue.append(img[::ds,::ds])
+                # Full frame; the display slot downsamples it (display/downsample.py)
+                dispQueue.append(img)
 
             # Release grab object
             # image_result.Release()
@@ -263,7 +270,8 @@ def GrabFrames(cam_params, camera, writeQueue, dispQueue, stopQueue):
             if cam_params["trialStructure"]:
                 if framenum_thistrial>0:
                     # Then this signals ed of a trial
-                    print("ITI, filenum ended: ", grabdata["filenum"])
+                    logger.info("ITI, filenum ended: %d", grabdata["filenum"])
+                    intervals.Break()
                     # Save this fil;e.
                     # time.sleep(0.02) # so not overlap with trial?
 
@@ -272,6 +280,7 @@ def GrabFrames(cam_params, camera, writeQueue, dispQueue, stopQueue):
 
                     # TODO: save grabdata
                     # TODO: reset grabdata (for a new file).
+                    grabdata.update(writeQueue.Stats())
                     SaveMetadata(cam_params, grabdata)
 
                     # update framenum and filenum (for next file)
@@ -280,10 +289,10 @@ def GrabFrames(cam_params, camera, writeQueue, dispQueue, stopQueue):
                     grabdata = ResetGrabdata(cam_params, grabdata["filenum"]+1)
                 else:
                     # do nothing, have already saved previous trila
-                    print("Ready for triggers.")
+                    logger.info("Ready for triggers.")
             else:
                 # time.sleep(0.0001)
-                print("Waiting for frames")
+                logger.info("Waiting for frames")
 
 
 
@@ -302,11 +311,11 @@ def GrabFrames(cam_params, camera, writeQueue, dispQueue, stopQueue):
 
 def ResetGrabdata(cam_params, filenum):
     grabdata = {}
-    grabdata['timeStamp'] = []
-    grabdata['frameNumber'] = []
+    # per-frame grab data (frame numbers, timestamps, queue depth), streamed to frametimes[-t<filenum>].log
+    suffix = f"-t{filenum}" if cam_params["trialStructure"] else ""
+    grabdata['frameLog'] = OpenFrameLog(cam_params, suffix)
     # grabdata['newfile'] = []
     grabdata["grabtime_firstframe"] = []
-    grabdata["frameNumberThisTrial"] = []
     grabdata["filenum"] = filenum
     return grabdata
 
@@ -319,12 +328,16 @@ def SaveMetadata(cam_params, grabdata):
 
     full_folder_name = os.path.join(cam_params["videoFolder"], cam_params["cameraName"])
 
+    frameLog = grabdata['frameLog']
+    frameLog.Flush()
+    frametimes = frameLog.FrameTimes()
+
     meta = cam_params
-    meta['timeStamp'] = grabdata['timeStamp'] # time since first frame first trial
-    meta['frameNumber'] = grabdata['frameNumber'] # counting from rec onset.
+    meta['timeStamp'] = frametimes[1].tolist() # time since first frame first trial
+    meta['frameNumber'] = frametimes[0].astype(int).tolist() # counting from rec onset.
 
-    frame_count = grabdata['frameNumber'][-1]
-    time_count = grabdata['timeStamp'][-1]
+    frame_count = meta['frameNumber'][-1]
+    time_count = meta['timeStamp'][-1]
     fps_count = int(round(frame_count/time_count))
     print('Camera {} saved {} frames at {} fps.'.format(n_cam+1, frame_count, fps_count)) # TODO, this fps only accurate if one long file.
 
@@ -336,17 +349,21 @@ def SaveMetadata(cam_params, grabdata):
 
     try:
         npy_filename = os.path.join(full_folder_name, f"frametimes{suffix}.npy")
-        x = np.array([meta['frameNumber'], meta['timeStamp']])
-        np.save(npy_filename,x)
+        np.save(npy_filename,frametimes)
         print(f"Saved numpy at: {npy_filename}")
     except Exception as err:
         print(err)
         pass
+    frameLog.Close()
 
     csv_filename = os.path.join(full_folder_name, f"metadata{suffix}.csv")
     meta = cam_params
-    meta['totalFrames'] = grabdata['frameNumber'][-1]
-    meta['totalTime'] = grabdata['timeStamp'][-1]
+    meta['totalFrames'] = frame_count
+    meta['totalTime'] = time_count
+    # Frames dropped or spilled to disk between grabber and writer (since rec onset)
+    for key in ('droppedFrames', 'spilledFrames'):
+        if key in grabdata:
+            meta[key] = grabdata[key]
     # for k in ['newfile']:
     #     meta[k] = grabdata[k]
     meta["grabtime_firstframe"] = grabdata["grabtime_firstframe"]
@@ -377,6 +394,9 @@ def CloseCamera(cam_params, camera, grabdata):
                 SaveMetadata(cam_params,grabdata)
                 time.sleep(1)
                 camera.stop()
+                if cam_params.get("keepCameraOpen"):
+                    # campy-daemon: open and configured for the next recording
+                    break
                 camera.close()
                 # camera.EndAcquisition()     
                 # camera.DeInit()
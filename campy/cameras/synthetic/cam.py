@@ -0,0 +1,202 @@
+"""
+Synthetic cameras: load generator for the writer and encoder stack, no hardware
+or source videos needed.
+
+Frames of frameWidth x frameHeight in pixelFormatInput are taken in turn from
+syntheticPatterns frames precomputed in memory when the camera opens:
+
+	gradient 	diagonal color bands moving across the frame (typical content)
+	noise 		random pixels (worst case for the encoder)
+
+Each frame carries its frame ID as a barcode in the top left corner
+(campy.utils.barcode), stamped into the pattern before the frame is queued.
+The frame ring copies the frame, so the patterns are reused as they are.
+
+Frames are produced on a camera clock at exactly frameRate: frame k is
+delivered at k/frameRate after the first one (sleep, then a short spin), with
+that time as its timestamp. When the writer holds the grabber up past the
+time of the next frames, those frames are lost, as on a camera whose buffer
+is full: the frame ID skips them (frameID in the frame log, and the barcode)
+and skippedFrames in metadata.csv counts them.
+"""
+
+import os
+import time
+import logging
+import numpy as np
+import csv
+from campy.writer.buffers import FrameShape
+from campy.writer.framelog import OpenFrameLog
+from campy.utils.log import GetLogger, FrameIntervals
+from campy.utils import barcode
+
+PATTERNS = ("gradient", "noise")
+SPIN_SEC = 0.001 # spin instead of sleeping this close to a frame time
+
+class SyntheticCamera():
+	def __init__(self, shape, pattern="gradient", numPatterns=8, seed=0):
+		if pattern not in PATTERNS:
+			raise ValueError('Unknown syntheticPattern {}. Patterns: {}.'.format(pattern, ", ".join(PATTERNS)))
+		self.shape = tuple(shape)
+		barcode.Layout(self.shape) # frame large enough for the barcode
+		if pattern == "noise":
+			rng = np.random.default_rng(seed)
+			self.patterns = [rng.integers(0, 256, self.shape, dtype=np.uint8) for _ in range(numPatterns)]
+		else:
+			self.patterns = [Gradient(self.shape, i/numPatterns) for i in range(numPatterns)]
+
+	def Frame(self, frameID):
+		# Pattern of frameID with its barcode; valid until the pattern comes round again
+		return barcode.Stamp(self.patterns[frameID % len(self.patterns)], frameID)
+
+	def close(self):
+		self.patterns = []
+
+def Gradient(shape, phase):
+	# Diagonal bands shifted by phase (fraction of a band); channels out of phase
+	y, x = np.ogrid[0:shape[0], 0:shape[1]]
+	bands = (x + y)*(256/max(shape[:2])) + 256*phase
+	if len(shape) == 2:
+		return (bands % 256).astype(np.uint8)
+	offsets = np.arange(shape[2])*(256/3)
+	return ((bands[:, :, None] + offsets) % 256).astype(np.uint8)
+
+def OpenCamera(cam_params, bufferSize=500, validation=False):
+	n_cam = cam_params["n_cam"]
+	camera_name = cam_params["cameraName"]
+
+	# Patterns in the configured frame size and pixel format
+	camera = SyntheticCamera(FrameShape(cam_params), cam_params["syntheticPattern"],
+							cam_params["syntheticPatterns"], seed=n_cam)
+	cam_params['cameraModel'] = 'synthetic'
+	print("Started", camera_name, "synthetic", cam_params["syntheticPattern"], "frames.")
+	return camera, cam_params
+
+def WaitUntil(timeFrame):
+	remaining = timeFrame - time.perf_counter()
+	if remaining > SPIN_SEC:
+		time.sleep(remaining - SPIN_SEC)
+	while time.perf_counter() < timeFrame:
+		pass
+
+def GrabFrames(cam_params, camera, writeQueue, dispQueue, stopQueue):
+	n_cam = cam_params["n_cam"]
+
+	# Frame numbers, timestamps and queue depths are streamed to frametimes.log
+	grabdata = {}
+	grabdata['frameLog'] = OpenFrameLog(cam_params)
+	grabdata['skippedFrames'] = 0
+
+	numImagesToGrab = cam_params['recTimeInSec']*cam_params['frameRate']
+	chunkLengthInFrames = int(round(cam_params["chunkLengthInSec"]*cam_params['frameRate']))
+
+	if cam_params["displayFrameRate"] <= 0:
+		frameRatio = float('inf')
+	elif cam_params["displayFrameRate"] > 0 and cam_params["displayFrameRate"] <= cam_params['frameRate']:
+		frameRatio = int(round(cam_params['frameRate']/cam_params["displayFrameRate"]))
+	else:
+		frameRatio = cam_params['frameRate']
+	print(cam_params["cameraName"], "ready to generate.")
+
+	# Frame intervals are logged once per second, off this thread
+	logger = GetLogger(cam_params["cameraName"])
+	intervals = FrameIntervals(logger, cam_params["cameraName"])
+
+	period = 1/cam_params["frameRate"]
+	cnt = 0
+	frameID = 0
+	timeFirstFrame = time.perf_counter()
+	while(True):
+		if stopQueue or frameID >= numImagesToGrab:
+			grabdata.update(writeQueue.Stats())
+			CloseCamera(cam_params, camera, grabdata)
+			writeQueue.append('STOP')
+			break
+		try:
+			# Frame time on the camera clock
+			grabtime = frameID*period
+			WaitUntil(timeFirstFrame + grabtime)
+			hostTime = time.time()
+			intervals.Add(time.perf_counter() - timeFirstFrame)
+			frame = camera.Frame(frameID)
+
+			# Append numpy array to writeQueue for writer to append to file
+			writeQueue.append(frame, grabtime)
+
+			cnt += 1
+			grabdata['frameLog'].Append(cnt, grabtime, cnt, hostTime, frameID, len(writeQueue)) # first frame = 1
+
+			if cnt % frameRatio == 0:
+				# Full frame; the display slot downsamples it (display/downsample.py)
+				dispQueue.append(frame)
+			if cnt % chunkLengthInFrames == 0:
+				fps_count = int(round(cnt/(time.perf_counter() - timeFirstFrame)))
+				print('Camera %i collected %i frames at %i fps.' % (n_cam,cnt,fps_count))
+
+			# Frames whose time passed while this one was queued are lost, up to the
+			# end of the recording
+			frameID += 1
+			skipped = int((time.perf_counter() - timeFirstFrame)/period) - frameID
+			skipped = min(skipped, int(numImagesToGrab) - frameID)
+			if skipped > 0:
+				frameID += skipped
+				grabdata['skippedFrames'] += skipped
+
+		except Exception as e:
+			logging.error('Caught exception: {}'.format(e))
+			frameID += 1
+
+def CloseCamera(cam_params, camera, grabdata):
+	n_cam = cam_params["n_cam"]
+
+	print('Closing camera {}... Please wait.'.format(n_cam+1))
+	# Nothing to close; campy-daemon closes the camera (close) when it quits
+	while(True):
+		try:
+			try:
+				SaveMetadata(cam_params,grabdata)
+				break
+			except:
+				time.sleep(0.1)
+		except KeyboardInterrupt:
+			break
+
+def SaveMetadata(cam_params, grabdata):
+	n_cam = cam_params["n_cam"]
+	full_folder_name = os.path.join(cam_params["videoFolder"], cam_params["cameraName"])
+
+	# Save frame numbers and timestamps in numpy array, from the frame log
+	frameLog = grabdata['frameLog']
+	frameLog.Flush()
+	last = frameLog.Last()
+	frame_count = int(last['frameNumber']) if last is not None else 0
+	time_count = float(last['timeStamp']) if last is not None else 0.0
+	fps_count = int(round(frame_count/time_count)) if time_count > 0 else 0
+	print('Camera {} saved {} frames at {} fps.'.format(n_cam+1, frame_count, fps_count))
+	if grabdata['skippedFrames']:
+		print('Camera {} skipped {} frames while the writer held it up.'.format(n_cam+1, grabdata['skippedFrames']))
+	try:
+		npy_filename = os.path.join(full_folder_name, 'frametimes.npy')
+		x = frameLog.FrameTimes()
+		np.save(npy_filename,x)
+	except:
+		pass
+	frameLog.Close()
+
+	# Save other recording metadata in csv file
+	meta = cam_params
+	meta['totalFrames'] = frame_count
+	meta['totalTime'] = time_count
+	# Frames dropped or spilled to disk between grabber and writer, and lost by the camera
+	for key in ('droppedFrames', 'spilledFrames', 'skippedFrames'):
+		if key in grabdata:
+			meta[key] = grabdata[key]
+
+	csv_filename = os.path.join(full_folder_name, 'metadata.csv')
+	try:
+		with open(csv_filename, 'w', newline='') as f:
+			w = csv.writer(f, delimiter=',', quoting=csv.QUOTE_ALL)
+			for row in meta.items():
+				w.writerow(row)
+	except:
+		pass
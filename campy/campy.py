@@ -15,20 +15,19 @@
 campy-acquire ./configs/config.yaml
 """
 
-import PySpin
-
 import numpy as np
 import os
 import time
-import sys
 import threading, queue
 from collections import deque
 import multiprocessing as mp
 from campy import CampyParams
-from campy.writer import campipe
-from campy.display import display
+from campy.writer import campipe, buffers, transcode, adaptive
+from campy.utils import log
 import argparse
 import ast
+import copy
+import importlib
 import yaml
 import logging
 
@@ -59,7 +58,8 @@ def OptParams(params, cam_params, opt_params_dict):
 
 def CreateCamParams(params, n_cam):
 	# Insert camera-specific metadata from parameters into cam_params dictionary
-	cam_params = params
+	# (a copy: params stays valid for the other cameras)
+	cam_params = copy.deepcopy(params)
 	cam_params["n_cam"] = n_cam
 	cam_params["cameraName"] = params["cameraNames"][n_cam]
 	cam_params["baseFolder"] = os.getcwd()
@@ -81,11 +81,50 @@ def CreateCamParams(params, n_cam):
 						"quality": "21",
 						"chunkLengthInSec": 30,
 						"displayFrameRate": 10,
-						"displayDownsample": 2,}
+						"displayDownsample": 2,
+						"writeBufferSize": 100,
+						"fileRotation": "reopen",
+						"writeBufferPolicy": "block",
+						"spillFolder": "",
+						"spillBufferSize": 1000,
+						"writerSpill": False,
+						"writerSpillThreshold": 0,
+						"writerBackend": "imageio",
+						"writerBatchFrames": 1,
+						"encoderPreset": "",
+						"rawKeep": False,
+						"numEncoders": 1,
+						"encoderBlockFrames": 0,
+						"adaptiveEncoding": False,
+						"adaptiveThreshold": 0.5,
+						"encoderTelemetry": True,
+						"encoderStallTimeout": 3.0,
+						"outputContainer": "mp4",
+						"fragmentDuration": 1.0,
+						"frameTimestamps": False,
+						"frameLogFlushFrames": 100,
+						"logLevel": "info",
+						"daemonPort": 5555,
+						"displayMosaic": False,
+						"previewPort": 0,
+						"previewHost": "127.0.0.1",
+						"previewWorkers": 2,
+						"syntheticPattern": "gradient",
+						"syntheticPatterns": 8,}
 
 	cam_params = OptParams(params, cam_params, opt_params_dict)
 	return cam_params
 
+def ImportCamera(cameraMake):
+	# Camera module of cameraMake; its SDK is imported only by the process that calls this
+	if cameraMake not in ("basler", "flir", "emu", "synthetic"):
+		raise ValueError('Unknown cameraMake {}.'.format(cameraMake))
+	return importlib.import_module("campy.cameras.{}.cam".format(cameraMake))
+
+def ResolveCamParams(params):
+	# Fully resolved cam_params of every camera, to hand to the camera processes
+	return [CreateCamParams(params, n_cam) for n_cam in range(params["numCams"])]
+
 
 
 def AcquireSingleThread(n_cam, params):
@@ -94,6 +133,7 @@ def AcquireSingleThread(n_cam, params):
 
 	# Load camera parameters from config
 	cam_params = CreateCamParams(params, n_cam)
+	log.SetupLogging(cam_params["logLevel"])
 
 	# Import the correct camera module for your camera
 	if cam_params["cameraMake"] == "basler":
@@ -106,9 +146,12 @@ def AcquireSingleThread(n_cam, params):
 		# errors.
 	elif cam_params["cameraMake"] == "emu":
 		from campy.cameras.emu import cam
+	elif cam_params["cameraMake"] == "synthetic":
+		from campy.cameras.synthetic import cam
 
 	# Open camera n_cam
 	if cam_params["cameraMake"] == "flir":
+		import PySpin
 		if False:
 			# TODO: note that if use this, then get error:
 			# libc++abi.dylib: terminating with uncaught exception of type Spinnaker::Exception: Spinnaker: Can't clear a camera because something still holds a reference to the camera [-1004]
@@ -148,15 +191,16 @@ def AcquireSingleThread(n_cam, params):
 		camera, cam_params = cam.OpenCamera(cam_params)
 
 	# Initialize queues for video writer
-	writeQueue = deque()
+	writeQueue = buffers.OpenFrameRing(cam_params)
 	stopQueue = deque([], 1)
 
 	# Start image window display queue ('consumer' thread)
-	dispQueue = deque([], 2)
+	dispQueue = buffers.BlockingDeque(2)
 
 
 	if False:
 		# TODO: check if thgis works.
+		from campy.display import display
 		threading.Thread(
 			target=display.DisplayFrames,
 			daemon=True,
@@ -185,26 +229,25 @@ def AcquireSingleThread(n_cam, params):
 	# Start video file writer (main 'consumer' thread)
 	campipe.WriteFrames(cam_params, writeQueue, stopQueue)
 
+	# Free the shared frame buffer
+	writeQueue.Close()
+	writeQueue.Unlink()
 
-def AcquireOneCamera(n_cam):
-	# Initializes metadata dictionary for this camera stream
-	# and inserts important configuration details
 
-	# Load camera parameters from config
-	cam_params = CreateCamParams(params, n_cam)
+def AcquireOneCamera(cam_params):
+	# Entry point of a camera process. cam_params is resolved by the parent
+	# (ResolveCamParams), so the child reads no config and no command line.
+	n_cam = cam_params["n_cam"]
+	log.SetupLogging(cam_params["logLevel"])
 
 	# Import the correct camera module for your camera
-	if cam_params["cameraMake"] == "basler":
-		from campy.cameras.basler import cam
-	elif cam_params["cameraMake"] == "flir":
-		from campy.cameras.flir import cam
-	elif cam_params["cameraMake"] == "emu":
-		from campy.cameras.emu import cam
+	cam = ImportCamera(cam_params["cameraMake"])
 
 	if False:
 		# Old version before switch to simple_pyspin
 		# Open camera n_cam
 		if cam_params["cameraMake"] == "flir":
+			import PySpin
 			# Initialize camera
 			system = PySpin.System.GetInstance()
 			cam_list = system.GetCameras()
@@ -221,12 +264,20 @@ def AcquireOneCamera(n_cam):
 		camera, cam_params = cam.OpenCamera(cam_params)
 
 	# Initialize queues for video writer
-	writeQueue = deque()
+	writeQueue = buffers.OpenFrameRing(cam_params)
 	stopQueue = deque([], 1)
 
 	# Start image window display queue ('consumer' thread)
-	dispQueue = deque([], 2)
+	if "displaySlot" in cam_params:
+		# Latest display frame for the display and preview processes (see display/mosaic.py)
+		from campy.display.downsample import DisplayDownsampler
+		downsample = DisplayDownsampler(cam_params)
+		dispQueue = buffers.LatestFrame(cam_params["displaySlot"], downsample.shape, downsample=downsample)
+	else:
+		dispQueue = buffers.BlockingDeque(2)
 	if False:
+		# Imported here: display forces the Qt5Agg matplotlib backend
+		from campy.display import display
 		threading.Thread(
 			target=display.DisplayFrames,
 			daemon=True,
@@ -247,6 +298,13 @@ def AcquireOneCamera(n_cam):
 	# Start video file writer (main 'consumer' thread)
 	campipe.WriteFrames(cam_params, writeQueue, stopQueue)
 
+	# Free the shared frame buffer
+	writeQueue.Close()
+	writeQueue.Unlink()
+	if isinstance(dispQueue, buffers.LatestFrame):
+		dispQueue.Close()
+		dispQueue.Unlink()
+
 def ParseClargs(parser):
 	parser.add_argument(
 		"config", metavar="config", help="Campy configuration .yaml file.",
@@ -319,7 +377,8 @@ def ParseClargs(parser):
 		"--cameraMake", 
 		dest="cameraMake", 
 		type=ast.literal_eval,
-		help="Company that produced the camera. Currently supported: 'basler, flir, emu'.",
+		help="Company that produced the camera. Currently supported: 'basler, flir, emu, synthetic'. "
+			"'synthetic' generates barcoded frames in memory at any size, format and rate (load tests).",
 	)
 	parser.add_argument(
 		"--pixelFormatInput",
@@ -386,6 +445,206 @@ def ParseClargs(parser):
 		type=int,
 		help="Downsampling factor for displaying images.",
 	)
+	parser.add_argument(
+		"--displayMosaic",
+		dest="displayMosaic",
+		type=ast.literal_eval,
+		help="Show all cameras tiled in one window, drawn by a separate display process at displayFrameRate. "
+			"The camera processes only copy every display frame to shared memory.",
+	)
+	parser.add_argument(
+		"--previewPort",
+		dest="previewPort",
+		type=int,
+		help="Serve MJPEG streams of all cameras (at displayFrameRate) and stats.json on this HTTP port "
+			"for headless rigs; 0 (default) for no preview server.",
+	)
+	parser.add_argument(
+		"--previewHost",
+		dest="previewHost",
+		help="Address the preview server listens on: 127.0.0.1 (default), a LAN address, or 0.0.0.0 for all.",
+	)
+	parser.add_argument(
+		"--previewWorkers",
+		dest="previewWorkers",
+		type=int,
+		help="JPEG encoder processes of the preview server, run at low priority.",
+	)
+	parser.add_argument(
+		"--syntheticPattern",
+		dest="syntheticPattern",
+		help="Frames of cameraMake 'synthetic': 'gradient' (moving color bands) or 'noise' (worst case for the encoder).",
+	)
+	parser.add_argument(
+		"--syntheticPatterns",
+		dest="syntheticPatterns",
+		type=int,
+		help="Number of frames precomputed per synthetic camera, used in turn.",
+	)
+	parser.add_argument(
+		"--encoderPreset",
+		dest="encoderPreset",
+		help="ffmpeg preset replacing the default ('fast') of the CPU and nvidia encoders, e.g. 'faster' or 'llhp'. "
+			"See campy-bench-encode.",
+	)
+	parser.add_argument(
+		"--writeBufferSize",
+		dest="writeBufferSize",
+		type=int,
+		help="Number of preallocated frame slots between the grabber and the video writer.",
+	)
+	parser.add_argument(
+		"--writeBufferPolicy",
+		dest="writeBufferPolicy",
+		type=ast.literal_eval,
+		help="What to do with a new frame when the write buffer is full: 'block' (wait for the writer), "
+			"'dropOldest', 'dropNewest' or 'spill' (to a scratch file on disk). "
+			"Dropped frames remain in frametimes but are missing from the video.",
+	)
+	parser.add_argument(
+		"--spillFolder",
+		dest="spillFolder",
+		help="Folder for the spill scratch file, preferably on fast local storage. Defaults to the camera folder.",
+	)
+	parser.add_argument(
+		"--spillBufferSize",
+		dest="spillBufferSize",
+		type=int,
+		help="Maximum number of frames held in the spill scratch file.",
+	)
+	parser.add_argument(
+		"--writerSpill",
+		dest="writerSpill",
+		type=ast.literal_eval,
+		help="Writer-side spill stage: frames waiting for a lagging encoder move to a scratch file in spillFolder, "
+			"so the grabber always finds free slots. Spill depth and drain rate are saved in spillstats.csv.",
+	)
+	parser.add_argument(
+		"--writerSpillThreshold",
+		dest="writerSpillThreshold",
+		type=int,
+		help="Frames waiting in RAM before the writer starts spilling. 0 = half of writeBufferSize.",
+	)
+	parser.add_argument(
+		"--writerBackend",
+		dest="writerBackend",
+		type=ast.literal_eval,
+		help="'imageio' (imageio-ffmpeg write_frames), 'pipe' (campy writes frame buffers straight to the ffmpeg pipe) "
+			"or 'raw' (uncompressed .raw.npy files, transcoded in the background).",
+	)
+	parser.add_argument(
+		"--outputContainer",
+		dest="outputContainer",
+		type=ast.literal_eval,
+		help="'mp4', 'fmp4' (fragmented MP4) or 'mkv'. With 'fmp4' and 'mkv', a file cut short by a crash "
+			"is readable up to its last fragment; repair it with campy-recover.",
+	)
+	parser.add_argument(
+		"--fragmentDuration",
+		dest="fragmentDuration",
+		type=float,
+		help="Seconds of video per fragment (fmp4) or cluster (mkv). Shorter loses less in a crash, at more I/O overhead.",
+	)
+	parser.add_argument(
+		"--frameTimestamps",
+		dest="frameTimestamps",
+		type=ast.literal_eval,
+		help="Encode every frame at its camera timestamp (variable frame rate), so that the video itself "
+			"carries the exact frame times. Not supported with writerBackend 'raw' or numEncoders > 1.",
+	)
+	parser.add_argument(
+		"--logLevel",
+		dest="logLevel",
+		help="Level of campy's log messages: 'debug', 'info' (default), 'warning' or 'error'. "
+			"Messages are written by a background thread; per-frame events are aggregated once per second.",
+	)
+	parser.add_argument(
+		"--daemonPort",
+		dest="daemonPort",
+		type=int,
+		help="Local TCP port on which campy-daemon accepts commands (campy-control).",
+	)
+	parser.add_argument(
+		"--frameLogFlushFrames",
+		dest="frameLogFlushFrames",
+		type=int,
+		help="Frames between updates of the streaming frame log (frametimes.log), which can be read while "
+			"recording and survives a crash. A crash loses at most this many frame times.",
+	)
+	parser.add_argument(
+		"--encoderTelemetry",
+		dest="encoderTelemetry",
+		type=ast.literal_eval,
+		help="Parse ffmpeg progress (frames, fps, bitrate, speed) and watch for dead or stalled encoders, "
+			"which are restarted into a new file (-r<n>). writerBackend 'pipe' and fileRotation 'segment' only.",
+	)
+	parser.add_argument(
+		"--encoderStallTimeout",
+		dest="encoderStallTimeout",
+		type=float,
+		help="Seconds the writer may be blocked on an encoder that reports no progress before it is restarted "
+			"(at least 2 s). 0 = never. Encoders that cannot be restarted (numEncoders > 1, fileRotation "
+			"'segment') are only reported.",
+	)
+	parser.add_argument(
+		"--adaptiveEncoding",
+		dest="adaptiveEncoding",
+		type=ast.literal_eval,
+		help="Encode the next file with a faster preset, no B-frames and finally a higher crf/qp while the writer "
+			"falls behind, and return to the configured settings when it catches up. Logged in encoding.csv and "
+			"each trial's <video>.json. Needs a recording split into files (emu, flir with trialStructure).",
+	)
+	parser.add_argument(
+		"--adaptiveThreshold",
+		dest="adaptiveThreshold",
+		type=float,
+		help="Write queue backlog, as a fraction of writeBufferSize, that makes adaptiveEncoding degrade the next file.",
+	)
+	parser.add_argument(
+		"--numEncoders",
+		dest="numEncoders",
+		type=int,
+		help="Parallel ffmpeg encoders per camera, for cameras faster than one encoder. "
+			"Trials are encoded in blocks of encoderBlockFrames frames and joined losslessly.",
+	)
+	parser.add_argument(
+		"--encoderBlockFrames",
+		dest="encoderBlockFrames",
+		type=int,
+		help="Frames per block with numEncoders > 1. 0 = half a second. numEncoders+1 blocks are held in RAM.",
+	)
+	parser.add_argument(
+		"--rawKeep",
+		dest="rawKeep",
+		type=ast.literal_eval,
+		help="Keep .raw.npy files of writerBackend 'raw' after they have been transcoded.",
+	)
+	parser.add_argument(
+		"--transcodeWorkers",
+		dest="transcodeWorkers",
+		type=int,
+		help="Background ffmpeg processes transcoding raw files (writerBackend 'raw').",
+	)
+	parser.add_argument(
+		"--transcodeMaxLoad",
+		dest="transcodeMaxLoad",
+		type=float,
+		help="Raw files are transcoded during acquisition only while the system load is below this fraction of all cores.",
+	)
+	parser.add_argument(
+		"--writerBatchFrames",
+		dest="writerBatchFrames",
+		type=int,
+		help="Frames copied into one ffmpeg pipe write with writerBackend 'pipe'. Helps small frames only. 1 = no batching.",
+	)
+	parser.add_argument(
+		"--fileRotation",
+		dest="fileRotation",
+		type=ast.literal_eval,
+		help="How the writer starts a new file per trial. 'reopen': close and spawn a new ffmpeg. "
+			"'standby': keep the next file's ffmpeg initialized in advance (one extra encoder session per camera). "
+			"'segment': one ffmpeg per camera writes all trials, split into files at trial starts.",
+	)
 	parser.add_argument(
 		"--trialStructure",
 		dest="trialStructure",
@@ -426,29 +685,56 @@ def CombineConfigAndClargs(clargs):
 			params[param] = value
 	return params
 
-def Main():
+def Acquire(params):
+	# Records with all cameras of params (a loaded config), one process per camera.
+	# Can be called from other programs; guard the caller with `if __name__ == '__main__'`.
 	# Optionally, user can manually set path to find ffmpeg binary.
-	if params["ffmpegPath"]:
+	if params.get("ffmpegPath"):
 		os.environ["IMAGEIO_FFMPEG_EXE"] = params["ffmpegPath"]
 
-	if sys.platform == "win32":
-		pool = mp.Pool(processes=params['numCams'])
-		pool.map(AcquireOneCamera, range(0,params['numCams']))
+	# Options that cannot work for this recording are rejected before any camera opens
+	cam_params_list = ResolveCamParams(params)
+	for cam_params in cam_params_list:
+		adaptive.CheckAdaptiveEncoding(cam_params)
+
+	# Background transcoding for cameras recording raw frames
+	transcoder = transcode.StartTranscoder(params)
+
+	# Optionally, one display process shows all cameras and a preview server streams them
+	displayProcess = previewServer = None
+	if cam_params_list[0]["displayFrameRate"] > 0 and (
+			cam_params_list[0]["displayMosaic"] or cam_params_list[0]["previewPort"]):
+		from campy.display.mosaic import AssignDisplaySlots
+		AssignDisplaySlots(cam_params_list, os.getpid())
+		if cam_params_list[0]["displayMosaic"]:
+			from campy.display.mosaic import DisplayProcess
+			displayProcess = DisplayProcess(cam_params_list)
+		if cam_params_list[0]["previewPort"]:
+			from campy.display.preview import PreviewServer
+			previewServer = PreviewServer(cam_params_list)
+
+	# spawn on every platform: children start clean, without this process's threads
+	ctx = mp.get_context("spawn")
+	with ctx.Pool(processes=params['numCams']) as pool:
+		pool.map(AcquireOneCamera, cam_params_list, chunksize=1)
+
+	if displayProcess is not None:
+		displayProcess.Stop()
+	if previewServer is not None:
+		previewServer.Stop()
+
+	if transcoder is not None:
+		print('Transcoding raw files. Please wait...')
+		transcoder.Finish()
 
-	elif sys.platform == "linux" or sys.platform == "linux2":
-		ctx = mp.get_context("spawn")  # for linux compatibility
-		pool = ctx.Pool(processes=params['numCams'])
-		p = pool.map_async(AcquireOneCamera, range(0,params['numCams']))
-		p.get()
-	else:
-		print("not win32 or linux...")
-		ctx = mp.get_context("spawn")  # for linux compatibility
-		pool = ctx.Pool(processes=params['numCams'])
-		p = pool.map_async(AcquireOneCamera, range(0,params['numCams']))
-		p.get()
-
-parser = argparse.ArgumentParser(
-		description="Campy CLI", formatter_class=argparse.ArgumentDefaultsHelpFormatter,
-		)
-params = ParseClargs(parser)
-params = CombineConfigAndClargs(params)
+def Main():
+	# Command line and config are parsed here, once; camera processes receive cam_params
+	parser = argparse.ArgumentParser(
+			description="Campy CLI", formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+			)
+	params = ParseClargs(parser)
+	params = CombineConfigAndClargs(params)
+	Acquire(params)
+
+if __name__ == '__main__':
+	Main()
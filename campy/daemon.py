@@ -0,0 +1,355 @@
+"""
+Acquisition daemon: cameras stay open and configured between recordings.
+
+campy-acquire enumerates, opens and configures every camera (settings file,
+FLIR YAML nodes) and spawns ffmpeg before the first frame, which takes seconds.
+campy-daemon does that once. It starts one process per camera that opens the
+camera and then waits for commands, which the daemon accepts as JSON lines on a
+local TCP socket (127.0.0.1:daemonPort):
+
+	session 	prepare the next recording: frame buffer allocated and ffmpeg
+				spawned, so that start only has to start grabbing. Takes config
+				keys to change for this recording, e.g. a new videoFolder
+	start 		start recording (prepares the session first if needed)
+	stop 		stop recording; recTimeInSec still ends a recording by itself
+	status 		state of every camera and its last recording, including
+				firstFrameSec: time from start until the first frame was written
+	quit 		stop recording, close the cameras and exit
+
+A session is recorded once; send a new session (e.g. with a new videoFolder)
+before the next start, so that a recording never overwrites the previous one.
+Camera keys (CAMERA_KEYS) are applied when the daemon starts and cannot change
+per session.
+
+Usage:
+campy-daemon ./configs/config.yaml
+campy-control session --set videoFolder=./session2 recTimeInSec=60
+campy-control start
+campy-control stop
+"""
+
+import os
+import sys
+import ast
+import json
+import time
+import signal
+import socket
+import argparse
+import threading
+import socketserver
+import multiprocessing as mp
+from collections import deque
+from campy.writer import campipe, buffers
+from campy.utils import log
+
+# Set when the camera is opened; a session cannot change them
+CAMERA_KEYS = ("cameraMake", "cameraSelection", "cameraSettings", "cameraSettingsDir", "cameraNames",
+			"numCams", "frameWidth", "frameHeight", "triggerMode", "daemonPort",
+			"syntheticPattern", "syntheticPatterns")
+COMMANDS = ("session", "start", "stop", "status", "quit")
+HOST = "127.0.0.1"
+
+class FirstFrameProbe():
+	# Passes frames on to the writers and notes when the first one was written
+	def __init__(self, writer):
+		self.writer = writer
+		self.firstFrameTime = None
+		self.numFrames = 0
+
+	def send(self, frame, *timestamp):
+		self.writer.send(frame, *timestamp)
+		if self.firstFrameTime is None:
+			self.firstFrameTime = time.perf_counter()
+		self.numFrames += 1
+
+	def __getattr__(self, name):
+		# NewFile, Telemetry, close, filenum, ...
+		return getattr(self.writer, name)
+
+class CameraWorker():
+	# Runs in the camera process: holds the open camera and one recording at a time
+	def __init__(self, cam_params):
+		from campy.campy import ImportCamera
+		self.cam = ImportCamera(cam_params["cameraMake"])
+		opened = dict(cam_params, keepCameraOpen=True)
+		self.camera, opened = self.cam.OpenCamera(opened)
+		# Keys set by OpenCamera (frame size, serial number, ...) apply to every session
+		self.opened = {key: value for key, value in opened.items()
+					if key not in cam_params or cam_params[key] != value}
+		self.cam_params = cam_params
+		self.recorded = False
+		self.prepared = None
+		self.stopQueue = None
+		self.thread = None
+		self.last = None
+
+	def State(self):
+		if self.thread is not None and self.thread.is_alive():
+			return "recording"
+		return "ready" if self.prepared is not None else "idle"
+
+	def Status(self):
+		return {"ok": True, "camera": self.cam_params["cameraName"], "state": self.State(),
+				"videoFolder": self.cam_params["videoFolder"], "lastRecording": self.last}
+
+	def Session(self, cam_params):
+		if self.State() == "recording":
+			raise RuntimeError("Cannot start a session while recording.")
+		self.Discard()
+		self.cam_params = cam_params
+		self.recorded = False
+		self.Prepare()
+
+	def Prepare(self):
+		# Frame buffer and encoders of the next recording, opened in advance
+		cam_params = dict(self.cam_params, **self.opened)
+		writeQueue = buffers.OpenFrameRing(cam_params)
+		writer = FirstFrameProbe(campipe.OpenWriters(cam_params))
+		self.prepared = (cam_params, writeQueue, writer)
+
+	def Discard(self):
+		# Closes a prepared recording that was not started
+		if self.prepared is None:
+			return
+		cam_params, writeQueue, writer = self.prepared
+		self.prepared = None
+		writer.close()
+		writeQueue.Close()
+		writeQueue.Unlink()
+
+	def Start(self):
+		timeStart = time.perf_counter()
+		if self.State() == "recording":
+			raise RuntimeError("Already recording.")
+		if self.prepared is None:
+			if self.recorded:
+				raise RuntimeError("This session has been recorded. Send a new session first.")
+			self.Prepare()
+		cam_params, writeQueue, writer = self.prepared
+		self.prepared = None
+		self.recorded = True
+		self.stopQueue = deque([], 1)
+		self.thread = threading.Thread(target=self.Record, daemon=True,
+									args=(cam_params, writeQueue, writer, self.stopQueue, timeStart))
+		self.thread.start()
+
+	def Record(self, cam_params, writeQueue, writer, stopQueue, timeStart):
+		dispQueue = buffers.BlockingDeque(2)
+		threading.Thread(
+			target = self.cam.GrabFrames,
+			daemon=True,
+			args = (cam_params,
+					self.camera,
+					writeQueue,
+					dispQueue,
+					stopQueue),
+			).start()
+		try:
+			campipe.WriteFrames(cam_params, writeQueue, stopQueue, writer)
+		finally:
+			writeQueue.Close()
+			writeQueue.Unlink()
+			firstFrameSec = None
+			if writer.firstFrameTime is not None:
+				firstFrameSec = round(writer.firstFrameTime - timeStart, 6)
+			self.last = {"videoFolder": cam_params["videoFolder"], "numFrames": writer.numFrames,
+						"firstFrameSec": firstFrameSec}
+
+	def Stop(self):
+		if self.State() == "recording":
+			self.stopQueue.append('STOP')
+			self.thread.join()
+
+	def Quit(self):
+		self.Stop()
+		self.Discard()
+		# InstantCamera (basler) has Close(); simple_pyspin and the emu reader close()
+		close = getattr(self.camera, "close", None) or getattr(self.camera, "Close", None)
+		if close is not None:
+			close()
+
+	def Handle(self, cmd, cam_params=None):
+		if cmd == "session":
+			self.Session(cam_params)
+		elif cmd == "start":
+			self.Start()
+		elif cmd == "stop":
+			self.Stop()
+		elif cmd == "quit":
+			self.Quit()
+		return self.Status()
+
+def RunCamera(cam_params, conn):
+	# Camera process: opens the camera, then executes the commands from the daemon.
+	# Ctrl+C goes to the daemon, which stops the recordings in order.
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+	log.SetupLogging(cam_params["logLevel"])
+	try:
+		worker = CameraWorker(cam_params)
+	except Exception as err:
+		conn.send({"ok": False, "camera": cam_params["cameraName"], "error": repr(err)})
+		return
+	conn.send(worker.Status())
+	while True:
+		try:
+			cmd, payload = conn.recv()
+		except EOFError:
+			worker.Quit() # daemon is gone
+			break
+		try:
+			reply = worker.Handle(cmd, payload)
+		except Exception as err:
+			reply = dict(worker.Status(), ok=False, error=str(err))
+		conn.send(reply)
+		if cmd == "quit":
+			break
+
+class Daemon():
+	def __init__(self, params):
+		from campy.campy import ResolveCamParams
+		self.params = params
+		# Config keys and defaults; a session changes some of them relative to the config
+		self.known = set(ResolveCamParams(params)[0])
+		self.lock = threading.Lock()
+		ctx = mp.get_context("spawn")
+		self.cameras = []
+		self.cameraNames = []
+		for cam_params in ResolveCamParams(params):
+			conn, child = ctx.Pipe()
+			proc = ctx.Process(target=RunCamera, args=(cam_params, child), daemon=True)
+			proc.start()
+			self.cameras.append((proc, conn))
+			self.cameraNames.append(cam_params["cameraName"])
+		# Cameras open concurrently
+		replies = [self.Receive(i) for i in range(len(self.cameras))]
+		failed = [reply for reply in replies if not reply["ok"]]
+		if failed:
+			self.Command("quit")
+			raise RuntimeError("Cameras failed to open: {}".format(failed))
+
+	def Receive(self, i):
+		# Reply of camera process i
+		try:
+			return self.cameras[i][1].recv()
+		except (EOFError, OSError):
+			return self.Exited(i)
+
+	def Exited(self, i):
+		return {"ok": False, "camera": self.cameraNames[i], "error": "Camera process exited."}
+
+	def SessionParams(self, overrides):
+		from campy.campy import ResolveCamParams
+		fixed = [key for key in overrides if key in CAMERA_KEYS]
+		if fixed:
+			raise ValueError("{} cannot change per session; restart campy-daemon.".format(", ".join(fixed)))
+		unknown = [key for key in overrides if key not in self.known]
+		if unknown:
+			raise ValueError("Unrecognized keys: {}.".format(", ".join(unknown)))
+		return ResolveCamParams(dict(self.params, **overrides))
+
+	def Command(self, cmd, overrides=None):
+		# Sends cmd to all camera processes; returns the combined reply
+		if cmd not in COMMANDS:
+			return {"ok": False, "error": "Unknown command {}. Commands: {}.".format(cmd, ", ".join(COMMANDS))}
+		with self.lock:
+			timeStart = time.perf_counter()
+			try:
+				payloads = self.SessionParams(overrides or {}) if cmd == "session" else [None]*len(self.cameras)
+			except ValueError as err:
+				return {"ok": False, "error": str(err)}
+			# A camera process that has exited gets no command and replies with an error
+			sent = []
+			for (proc, conn), payload in zip(self.cameras, payloads):
+				try:
+					conn.send((cmd, payload))
+					sent.append(True)
+				except OSError:
+					sent.append(False)
+			replies = [self.Receive(i) if sent[i] else self.Exited(i) for i in range(len(self.cameras))]
+			if cmd == "quit":
+				for proc, conn in self.cameras:
+					proc.join()
+			return {"ok": all(reply["ok"] for reply in replies),
+					"commandSec": round(time.perf_counter() - timeStart, 6),
+					"cameras": replies}
+
+class CommandHandler(socketserver.StreamRequestHandler):
+	# One JSON command per line: {"cmd": "session", "params": {"videoFolder": "..."}}
+	def handle(self):
+		for line in self.rfile:
+			try:
+				request = json.loads(line)
+				if not isinstance(request, dict) or not isinstance(request.get("params") or {}, dict):
+					raise ValueError('expected {"cmd": ..., "params": {...}}')
+			except ValueError as err:
+				request = {}
+				reply = {"ok": False, "error": "Invalid request: {}".format(err)}
+			else:
+				reply = self.server.daemon.Command(request.get("cmd"), request.get("params"))
+			self.wfile.write((json.dumps(reply) + "\n").encode())
+			if request.get("cmd") == "quit":
+				threading.Thread(target=self.server.shutdown, daemon=True).start()
+				return
+
+class CommandServer(socketserver.ThreadingTCPServer):
+	daemon_threads = True
+	allow_reuse_address = True
+
+	def __init__(self, daemon, port):
+		self.daemon = daemon
+		super().__init__((HOST, port), CommandHandler)
+
+def SendCommand(cmd, params=None, port=5555, timeout=None):
+	# Sends one command to a running campy-daemon and returns its reply
+	with socket.create_connection((HOST, port), timeout=timeout) as sock:
+		sock.sendall((json.dumps({"cmd": cmd, "params": params or {}}) + "\n").encode())
+		return json.loads(sock.makefile().readline())
+
+def Main():
+	from campy.campy import ParseClargs, CombineConfigAndClargs, ResolveCamParams
+	parser = argparse.ArgumentParser(
+			description="Campy acquisition daemon", formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+			)
+	params = CombineConfigAndClargs(ParseClargs(parser))
+	if params.get("ffmpegPath"):
+		os.environ["IMAGEIO_FFMPEG_EXE"] = params["ffmpegPath"]
+	port = ResolveCamParams(params)[0]["daemonPort"]
+
+	daemon = Daemon(params)
+	with CommandServer(daemon, port) as server:
+		print("campy-daemon: {} cameras ready, listening on {}:{}.".format(params["numCams"], HOST, port))
+		try:
+			server.serve_forever()
+		except KeyboardInterrupt:
+			daemon.Command("quit")
+	print("campy-daemon: closed.")
+
+def ParseValue(value):
+	# Same as the config: Python literals, else a string
+	try:
+		return ast.literal_eval(value)
+	except (ValueError, SyntaxError):
+		return value
+
+def ControlMain():
+	parser = argparse.ArgumentParser(description="Send a command to campy-daemon")
+	parser.add_argument("cmd", choices=COMMANDS, help="Command.")
+	parser.add_argument("--set", nargs='*', default=[], metavar="KEY=VALUE",
+						help="Config keys to change for the session, e.g. videoFolder=./session2.")
+	parser.add_argument("--port", type=int, default=5555, help="daemonPort of the daemon.")
+	args = parser.parse_args()
+
+	params = {}
+	for item in args.set:
+		key, sep, value = item.partition("=")
+		if not sep:
+			parser.error("--set takes KEY=VALUE, not {}.".format(item))
+		params[key] = ParseValue(value)
+	reply = SendCommand(args.cmd, params, args.port)
+	print(json.dumps(reply, indent=1))
+	if not reply["ok"]:
+		sys.exit(1)
+
+if __name__ == '__main__':
+	Main()
@@ -2,7 +2,6 @@
 
 """
 import sys
-import time
 import logging
 import numpy as np
 
@@ -38,16 +37,15 @@ def DisplayFrames(cam_params, dispQueue):
 		figure, imageWindow = draw_figure(n_cam+1)
 		while(True):
 			try:
-				if dispQueue:
-					img = dispQueue.popleft()
-					try:
+				# Block until a frame arrives, keep the window responsive in between
+				img = dispQueue.get(timeout=0.1)
+				try:
+					if img is not None:
 						imageWindow.set_data(img)
 						figure.canvas.draw()
-						figure.canvas.flush_events()
-					except Exception as e:
-						logging.error('Caught exception: {}'.format(e))
-				else:
-					time.sleep(0.01)
+					figure.canvas.flush_events()
+				except Exception as e:
+					logging.error('Caught exception: {}'.format(e))
 			except KeyboardInterrupt:
 				break
 		plt.close(figure)
\ No newline at end of file
@@ -0,0 +1,146 @@
+"""
+Live display of all cameras in one window, drawn by a separate process.
+
+With displayMosaic (or the preview server, display/preview.py), each camera
+process hands its display frames (every frameRate/displayFrameRate-th frame) to
+a LatestFrame shared-memory slot instead of a display queue. The grab thread
+only downsamples the frame into the slot (display/downsample.py); nothing in the
+camera process draws.
+
+One display process (DisplayMosaic) reads the latest frame of every camera at
+displayFrameRate and copies it into its tile of a preallocated mosaic image.
+The figure is drawn once; after that, only the image artist is redrawn and
+blitted onto the saved background, and only when a camera had a new frame.
+Closing the window ends the display, not the recording.
+"""
+
+import math
+import time
+import numpy as np
+import multiprocessing as mp
+from campy.writer.buffers import LatestFrame
+from campy.display.downsample import DisplayShape
+
+ATTACH_INTERVAL = 0.5 # sec between attempts to find slots of cameras still opening
+
+def SlotName(n_cam, token):
+	# Short (macOS allows 31 characters), unique per recording
+	return "campy{}_{}".format(token, n_cam)
+
+def AssignDisplaySlots(cam_params_list, token):
+	# Each camera process creates its slot; the display and preview processes read them
+	for cam_params in cam_params_list:
+		cam_params["displaySlot"] = SlotName(cam_params["n_cam"], token)
+	return [cam_params["displaySlot"] for cam_params in cam_params_list]
+
+def MosaicLayout(shapes):
+	# (rows, columns, tile height, tile width) of a near-square grid
+	cols = int(math.ceil(math.sqrt(len(shapes))))
+	rows = int(math.ceil(len(shapes)/cols))
+	height = max(shape[0] for shape in shapes)
+	width = max(shape[1] for shape in shapes)
+	return rows, cols, height, width
+
+class Mosaic():
+	def __init__(self, shapes):
+		self.shapes = [tuple(shape) for shape in shapes]
+		self.rows, self.cols, self.height, self.width = MosaicLayout(shapes)
+		self.image = np.zeros((self.rows*self.height, self.cols*self.width, 3), dtype='uint8')
+		self.tiles = []
+		for i, shape in enumerate(shapes):
+			r, c = divmod(i, self.cols)
+			top, left = r*self.height, c*self.width
+			self.tiles.append(self.image[top:top+shape[0], left:left+shape[1]])
+
+	def Update(self, slots):
+		# Copies new frames into their tiles; True if any tile changed
+		changed = False
+		for slot, tile in zip(slots, self.tiles):
+			if slot is not None and slot.Read(tile):
+				changed = True
+		return changed
+
+def AttachSlots(slots, names):
+	for i, name in enumerate(names):
+		if slots[i] is None:
+			try:
+				slot = LatestFrame(name)
+			except FileNotFoundError:
+				continue # camera not open yet
+			if 0 in slot.shape:
+				slot.Close() # created, shape not written yet
+				continue
+			slots[i] = slot
+	return slots
+
+def SlotShapes(slots, shapes):
+	# Shapes of the attached slots, else the shapes expected from the config
+	return [slot.shape if slot is not None else tuple(shape) for slot, shape in zip(slots, shapes)]
+
+def DisplayMosaic(names, shapes, displayFrameRate, stopEvent, title="campy"):
+	# Display process: runs until stopEvent is set or the window is closed.
+	# shapes: display frame shapes expected from the config, until the cameras report theirs
+	try:
+		import matplotlib as mpl
+		import matplotlib.pyplot as plt
+	except ImportError:
+		print('displayMosaic needs matplotlib; recording without display.')
+		return
+
+	slots = AttachSlots([None]*len(names), names)
+	mosaic = Mosaic(SlotShapes(slots, shapes))
+	timeAttach = time.perf_counter()
+
+	mpl.rcParams['toolbar'] = 'None'
+	figure = plt.figure(title)
+	ax = figure.add_axes([0, 0, 1, 1], frameon=False)
+	ax.set_axis_off()
+	image = ax.imshow(mosaic.image, interpolation='none', animated=True)
+	plt.show(block=False)
+
+	# Background without the image, saved again whenever the window is redrawn (resize)
+	background = [None]
+	def SaveBackground(event):
+		background[0] = figure.canvas.copy_from_bbox(figure.bbox)
+		ax.draw_artist(image)
+	figure.canvas.mpl_connect('draw_event', SaveBackground)
+	figure.canvas.draw()
+
+	interval = 1/displayFrameRate
+	while not stopEvent.wait(interval) and plt.fignum_exists(figure.number):
+		if None in slots and time.perf_counter() - timeAttach > ATTACH_INTERVAL:
+			AttachSlots(slots, names)
+			timeAttach = time.perf_counter()
+			if SlotShapes(slots, shapes) != mosaic.shapes:
+				# A camera opened with another frame size: new layout, full redraw (once)
+				mosaic = Mosaic(SlotShapes(slots, shapes))
+				image.set_data(mosaic.image)
+				image.set_extent((-0.5, mosaic.image.shape[1] - 0.5, mosaic.image.shape[0] - 0.5, -0.5))
+				figure.canvas.draw()
+		if mosaic.Update(slots) and background[0] is not None:
+			figure.canvas.restore_region(background[0])
+			image.set_data(mosaic.image)
+			ax.draw_artist(image)
+			figure.canvas.blit(figure.bbox)
+		figure.canvas.flush_events()
+
+	plt.close(figure)
+	for slot in slots:
+		if slot is not None:
+			slot.Close()
+
+class DisplayProcess():
+	# Display process of a recording (slots assigned by AssignDisplaySlots)
+	def __init__(self, cam_params_list):
+		names = [cam_params["displaySlot"] for cam_params in cam_params_list]
+		shapes = [DisplayShape(cam_params) for cam_params in cam_params_list]
+		displayFrameRate = max(cam_params["displayFrameRate"] for cam_params in cam_params_list)
+		ctx = mp.get_context("spawn")
+		self.stopEvent = ctx.Event()
+		self.proc = ctx.Process(target=DisplayMosaic, daemon=True,
+								args=(names, shapes, displayFrameRate, self.stopEvent))
+		self.proc.start()
+
+	def Stop(self):
+		self.stopEvent.set()
+		self.proc.join()
@@ -0,0 +1,258 @@
+"""
+Preview server for headless rigs: MJPEG streams and stats over HTTP.
+
+With previewPort, campy-acquire serves the display frames of every camera on
+previewHost:previewPort (127.0.0.1 by default; a LAN address or 0.0.0.0 to
+watch from another machine):
+
+	/ 				page with the stream of every camera
+	/camN.mjpg 		MJPEG stream of camera N (multipart/x-mixed-replace)
+	/camN.jpg 		latest JPEG of camera N
+	/stats.json 	per camera: preview fps, encode time, JPEG size, viewers, and
+					from the frame log frames grabbed, queue depth and frame age
+
+The camera processes only downsample each display frame into their LatestFrame
+slot, as for displayMosaic (display/mosaic.py). JPEG encoding runs in a pool of
+previewWorkers encoder processes at low priority (nice), which attach to the
+slots and read the latest frame themselves; only the JPEG comes back. Each
+camera has at most one frame being encoded, at most displayFrameRate per
+second, and only while someone is watching. All viewers of a camera share its
+latest JPEG: a slow viewer skips frames, and more viewers only cost sending
+bytes from the server threads of campy-acquire, never a camera process.
+"""
+
+import io
+import os
+import re
+import json
+import time
+import threading
+import multiprocessing as mp
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from PIL import Image # imageio's image library
+from campy.writer.framelog import FrameLogName, ReadLastRecord
+from campy.display.mosaic import AttachSlots
+
+JPEG_QUALITY = 80
+ENCODER_NICE = 10 	# encoders yield the CPU to the cameras and ffmpeg
+WANTED_SEC = 2 		# a camera is encoded until this long after its last request
+FPS_WINDOW = 30 	# frames over which preview fps and encode time are averaged
+BOUNDARY = "campyframe"
+
+PAGE = """<!DOCTYPE html>
+<html><head><title>campy preview</title>
+<style>body {{background: #222; color: #ddd; font-family: sans-serif}} figure {{display: inline-block}}</style>
+</head><body>
+{}
+<p><a href="/stats.json">stats.json</a></p>
+</body></html>
+"""
+FIGURE = '<figure><img src="/cam{0}.mjpg"><figcaption>{1}</figcaption></figure>'
+
+# Encoder processes: slot name -> (attached slot, frame buffer)
+_slots = {}
+
+def StartEncoder():
+	if hasattr(os, "nice"):
+		os.nice(ENCODER_NICE)
+
+def EncodeJpeg(frame, quality=JPEG_QUALITY):
+	f = io.BytesIO()
+	Image.fromarray(frame).save(f, format="JPEG", quality=quality)
+	return f.getvalue()
+
+def EncodeLatest(name, sequence, quality=JPEG_QUALITY):
+	# Encoder process: (sequence, JPEG, encode sec) of the frame in slot name,
+	# None if the slot has no frame newer than sequence
+	if name not in _slots:
+		slot = AttachSlots([None], [name])[0]
+		if slot is None:
+			return None # camera not open yet
+		frame = np.empty(slot.shape[:2] + ((3,) if slot.frame.ndim == 3 else ()), dtype='uint8')
+		_slots[name] = (slot, frame)
+	slot, frame = _slots[name]
+	slot.sequence = sequence # any encoder process may get the next frame of a camera
+	if not slot.Read(frame):
+		return None
+	timeStart = time.perf_counter()
+	jpeg = EncodeJpeg(frame, quality)
+	return slot.sequence, jpeg, time.perf_counter() - timeStart
+
+class Feed():
+	# Latest JPEG of one camera, shared by all of its viewers
+	def __init__(self, cam_params):
+		self.cam_params = cam_params
+		self.name = cam_params["displaySlot"]
+		self.cond = threading.Condition()
+		self.sequence = 0 	# of the slot frame last encoded
+		self.count = 0 		# JPEGs published
+		self.jpeg = None
+		self.busy = False
+		self.viewers = 0
+		self.timeWanted = 0
+		self.times = deque([], FPS_WINDOW)
+		self.encodeSec = deque([], FPS_WINDOW)
+
+	def Want(self):
+		self.timeWanted = time.perf_counter()
+
+	def Wanted(self):
+		return self.viewers > 0 or time.perf_counter() - self.timeWanted < WANTED_SEC
+
+	def Publish(self, result):
+		# Pool callback
+		if result is not None:
+			sequence, jpeg, encodeSec = result
+			with self.cond:
+				self.sequence = sequence
+				self.jpeg = jpeg
+				self.count += 1
+				self.times.append(time.perf_counter())
+				self.encodeSec.append(encodeSec)
+				self.cond.notify_all()
+		self.busy = False
+
+	def Failed(self, err):
+		print('Preview of {} failed: {!r}'.format(self.cam_params["cameraName"], err))
+		self.busy = False
+
+	def Wait(self, count, timeout):
+		# (count, JPEG) of a JPEG newer than count, else (count, None) after timeout
+		with self.cond:
+			if self.count == count:
+				self.cond.wait(timeout)
+			if self.count == count:
+				return count, None
+			return self.count, self.jpeg
+
+	def Stats(self):
+		with self.cond:
+			times = list(self.times)
+			encodeSec = list(self.encodeSec)
+			stats = {"camera": self.cam_params["cameraName"],
+					"viewers": self.viewers,
+					"previewFrames": self.count,
+					"jpegBytes": len(self.jpeg) if self.jpeg is not None else None}
+		stats["previewFps"] = round((len(times) - 1)/(times[-1] - times[0]), 2) if len(times) > 1 else None
+		stats["encodeMs"] = round(1000*sum(encodeSec)/len(encodeSec), 2) if encodeSec else None
+		try:
+			record = ReadLastRecord(FrameLogName(self.cam_params))
+		except (OSError, ValueError):
+			record = None # not recording yet, or trialStructure (one log per trial)
+		if record is not None:
+			stats["framesGrabbed"] = int(record["frameNumber"])
+			stats["queueDepth"] = int(record["queueDepth"])
+			stats["lastFrameAgeSec"] = round(time.time() - float(record["hostTimeStamp"]), 3)
+		return stats
+
+class PreviewHandler(BaseHTTPRequestHandler):
+	def log_message(self, format, *args):
+		pass # one line per request would flood the console
+
+	def do_GET(self):
+		server = self.server
+		path = self.path.split("?")[0]
+		match = re.fullmatch(r"/cam(\d+)\.(mjpg|jpg)", path)
+		if path in ("/", "/index.html"):
+			figures = "\n".join(FIGURE.format(n, feed.cam_params["cameraName"]) for n, feed in enumerate(server.feeds))
+			self.Send(PAGE.format(figures).encode(), "text/html")
+		elif path == "/stats.json":
+			self.Send(json.dumps(server.Stats(), indent=1).encode(), "application/json")
+		elif match and int(match.group(1)) < len(server.feeds):
+			feed = server.feeds[int(match.group(1))]
+			if match.group(2) == "jpg":
+				self.Snapshot(feed)
+			else:
+				self.Stream(feed)
+		else:
+			self.send_error(404)
+
+	def Send(self, body, contentType):
+		self.send_response(200)
+		self.send_header("Content-Type", contentType)
+		self.send_header("Content-Length", str(len(body)))
+		self.send_header("Cache-Control", "no-cache")
+		self.end_headers()
+		self.wfile.write(body)
+
+	def Snapshot(self, feed):
+		# The latest JPEG, or the next one if no one was watching (stale or none)
+		fresh = feed.Wanted()
+		feed.Want()
+		jpeg = feed.jpeg
+		if jpeg is None or not fresh:
+			jpeg = feed.Wait(feed.count, WANTED_SEC)[1] or jpeg
+		if jpeg is None:
+			self.send_error(503, "No frame yet")
+		else:
+			self.Send(jpeg, "image/jpeg")
+
+	def Stream(self, feed):
+		self.send_response(200)
+		self.send_header("Content-Type", "multipart/x-mixed-replace; boundary=" + BOUNDARY)
+		self.send_header("Cache-Control", "no-cache")
+		self.end_headers()
+		with feed.cond:
+			feed.viewers += 1
+		try:
+			count, jpeg = feed.count, feed.jpeg
+			while not self.server.stopping.is_set():
+				if jpeg is not None:
+					self.wfile.write(b"--" + BOUNDARY.encode() + b"\r\nContent-Type: image/jpeg\r\n"
+									+ "Content-Length: {}\r\n\r\n".format(len(jpeg)).encode() + jpeg + b"\r\n")
+				count, jpeg = feed.Wait(count, 1)
+		except (BrokenPipeError, ConnectionResetError):
+			pass # viewer left
+		finally:
+			with feed.cond:
+				feed.viewers -= 1
+
+class PreviewServer(ThreadingHTTPServer):
+	# HTTP server and encoder pool of a recording (slots assigned by AssignDisplaySlots)
+	daemon_threads = True
+	allow_reuse_address = True
+
+	def __init__(self, cam_params_list):
+		params = cam_params_list[0]
+		self.feeds = [Feed(cam_params) for cam_params in cam_params_list]
+		self.interval = 1/max(cam_params["displayFrameRate"] for cam_params in cam_params_list)
+		self.numWorkers = max(1, params["previewWorkers"])
+		self.stopping = threading.Event()
+		super().__init__((params["previewHost"], params["previewPort"]), PreviewHandler)
+		ctx = mp.get_context("spawn")
+		self.pool = ctx.Pool(processes=self.numWorkers, initializer=StartEncoder)
+		self.threads = [threading.Thread(target=self.serve_forever, daemon=True),
+						threading.Thread(target=self.Schedule, daemon=True)]
+		for thread in self.threads:
+			thread.start()
+		host, port = self.server_address[:2]
+		print('Preview on http://{}:{}/'.format(host, port))
+
+	def Schedule(self):
+		# Asks the encoders for the latest frame of each watched camera, one at a time per camera
+		timeNext = time.perf_counter()
+		while True:
+			timeNext = max(timeNext + self.interval, time.perf_counter())
+			if self.stopping.wait(timeNext - time.perf_counter()):
+				break
+			for feed in self.feeds:
+				if feed.busy or not feed.Wanted():
+					continue
+				feed.busy = True
+				self.pool.apply_async(EncodeLatest, (feed.name, feed.sequence), callback=feed.Publish,
+									error_callback=feed.Failed)
+
+	def Stats(self):
+		return {"previewFrameRate": round(1/self.interval, 2),
+				"encoderWorkers": self.numWorkers,
+				"cameras": [feed.Stats() for feed in self.feeds]}
+
+	def Stop(self):
+		self.stopping.set()
+		self.threads[1].join()
+		self.shutdown()
+		self.server_close()
+		self.pool.terminate()
+		self.pool.join()
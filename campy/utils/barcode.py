@@ -0,0 +1,68 @@
+"""
+Frame-counter barcode embedded in synthetic frames (cameraMake 'synthetic').
+
+The top left of the frame holds BITS cells of CELL x CELL pixels, row by row:
+the 32-bit counter (least significant bit first), then its bitwise complement
+as a check. A cell is LOW (0) or HIGH (1) in every channel. The levels stay
+within the video range (16-235), and 8x8 cells line up with the codec's blocks,
+so the code survives lossy encoding and the color conversions of the writer.
+Read returns None if the complement does not match (no code, or a damaged one).
+
+Stamp writes one broadcast assignment into a strided view of the frame, with no
+copy of the frame (a few microseconds per frame).
+
+The verification tool (campy-verify) reads the codes back from the videos.
+"""
+
+import numpy as np
+
+CELL = 8 		# pixels per cell side
+COUNTER_BITS = 32
+BITS = 2*COUNTER_BITS
+LOW = 16
+HIGH = 235
+THRESHOLD = (LOW + HIGH)//2
+WEIGHTS = np.left_shift(np.uint64(1), np.arange(COUNTER_BITS, dtype=np.uint64))
+
+def Layout(shape, cell=CELL):
+	# (rows, columns) of cells of the code in a frame of shape
+	cols = min(BITS, shape[1]//cell)
+	rows = -(-BITS//cols) if cols else 0
+	if cols == 0 or rows*cell > shape[0]:
+		raise ValueError('Frame of shape {} is too small for a {}-bit barcode of {} pixel cells.'.format(
+			shape, BITS, cell))
+	return rows, cols
+
+def Cells(frame, cell=CELL):
+	# Strided view of the code area: rows x cell x cols x cell (x channels)
+	rows, cols = Layout(frame.shape, cell)
+	area = frame[:rows*cell, :cols*cell]
+	return area.reshape((rows, cell, cols, cell) + frame.shape[2:])
+
+def Bits(counter):
+	counter = int(counter) & 0xFFFFFFFF
+	bits = (counter >> np.arange(COUNTER_BITS)) & 1
+	return np.concatenate([bits, 1 - bits])
+
+def Stamp(frame, counter, cell=CELL):
+	# Writes the code of counter into frame, in place
+	cells = Cells(frame, cell)
+	rows, cols = cells.shape[0], cells.shape[2]
+	levels = np.full(rows*cols, LOW, dtype=frame.dtype)
+	levels[:BITS] = np.where(Bits(counter), HIGH, LOW)
+	levels = levels.reshape(rows, 1, cols, 1, *([1]*(frame.ndim - 2)))
+	cells[...] = levels
+	return frame
+
+def Read(frame, cell=CELL):
+	# Counter in frame, or None if there is no valid code
+	cells = Cells(frame, cell)
+	if frame.ndim == 3:
+		cells = cells[..., :3] # not the padding channel of rgb0/bgr0
+	# Centers of the cells, away from edges blurred by the encoder
+	inner = slice(cell//4, cell - cell//4)
+	means = cells[:, inner, :, inner].mean(axis=(1, 3) + tuple(range(4, cells.ndim)))
+	bits = (means.ravel()[:BITS] > THRESHOLD).astype(np.uint64)
+	if np.any(bits[:COUNTER_BITS] == bits[COUNTER_BITS:]):
+		return None
+	return int(np.dot(bits[:COUNTER_BITS], WEIGHTS))
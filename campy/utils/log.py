@@ -0,0 +1,140 @@
+"""
+Logging for the grab and write hot paths.
+
+print() formats and writes to the console on the calling thread, holding the GIL,
+which stalls the grab loop at high frame rates. campy's loggers ('campy.<name>')
+hand their records to a queue instead, and a listener thread formats and writes
+them. Records are queued unformatted: message arguments are turned into text off
+the hot thread, and not at all below logLevel. Container arguments (such as
+cam_params) are copied when queued, since the caller may change them before the
+listener formats the record.
+
+Two helpers keep per-frame events from flooding the queue:
+	GetLogger(name, rateLimit=sec)	passes at most one record per message and
+									interval, and counts the suppressed ones
+	FrameIntervals 					aggregates inter-frame intervals into one
+									record per interval ("N frames, IFI min/mean/max")
+"""
+
+import sys
+import queue
+import atexit
+import logging
+import logging.handlers
+
+LOGGER_NAME = "campy"
+FORMAT = "%(asctime)s %(levelname)s [%(name)s] %(message)s"
+
+MUTABLE_ARGS = (dict, list, set)
+
+listener = None
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+	def prepare(self, record):
+		# Queued unformatted; the listener thread formats the message
+		if isinstance(record.args, dict):
+			record.args = dict(record.args)
+		elif record.args:
+			record.args = tuple(arg.copy() if isinstance(arg, MUTABLE_ARGS) else arg for arg in record.args)
+		return record
+
+def SetupLogging(level="info"):
+	# Routes the 'campy' loggers of this process through the queue (listener started once)
+	global listener
+	logger = logging.getLogger(LOGGER_NAME)
+	logger.setLevel(level.upper() if isinstance(level, str) else level)
+	if listener is None:
+		records = queue.SimpleQueue()
+		handler = logging.StreamHandler(sys.stdout)
+		handler.setFormatter(logging.Formatter(FORMAT, "%H:%M:%S"))
+		listener = logging.handlers.QueueListener(records, handler)
+		listener.start()
+		logger.addHandler(DeferredQueueHandler(records))
+		logger.propagate = False
+		atexit.register(StopLogging)
+	return logger
+
+def StopLogging():
+	# Writes out the queued records and stops the listener thread
+	global listener
+	if listener is not None:
+		listener.stop()
+		listener = None
+
+class RateLimitFilter(logging.Filter):
+	# Passes one record per message (format string) and interval
+	def __init__(self, interval=1.0):
+		super().__init__()
+		self.interval = interval
+		self.last = {}
+		self.suppressed = {}
+
+	def filter(self, record):
+		key = record.msg
+		last = self.last.get(key)
+		if last is not None and record.created - last < self.interval:
+			self.suppressed[key] = self.suppressed.get(key, 0) + 1
+			return False
+		self.last[key] = record.created
+		suppressed = self.suppressed.pop(key, 0)
+		if suppressed:
+			record.msg = '{} ({} similar messages suppressed)'.format(record.msg, suppressed)
+		return True
+
+def GetLogger(name, rateLimit=0):
+	# Logger 'campy.<name>'; with rateLimit (sec), repeated messages are rate limited
+	if listener is None:
+		SetupLogging()
+	if not rateLimit:
+		return logging.getLogger("{}.{}".format(LOGGER_NAME, name))
+	logger = logging.getLogger("{}.{}.limited".format(LOGGER_NAME, name))
+	if not logger.filters:
+		logger.addFilter(RateLimitFilter(rateLimit))
+	return logger
+
+class FrameIntervals():
+	# Aggregates inter-frame intervals (IFI) from frame timestamps and logs one
+	# summary per interval. Uses the timestamps themselves, no clock reads.
+	def __init__(self, logger, label, interval=1.0, level=logging.INFO):
+		self.logger = logger
+		self.label = label
+		self.interval = interval
+		self.level = level
+		self.lastStamp = None
+		self.Reset(None)
+
+	def Reset(self, timeStamp):
+		self.start = timeStamp
+		self.numFrames = 0
+		self.sum = 0
+		self.min = float('inf')
+		self.max = 0
+
+	def Add(self, timeStamp):
+		# timeStamp in sec
+		if self.lastStamp is not None:
+			ifi = timeStamp - self.lastStamp
+			self.numFrames += 1
+			self.sum += ifi
+			if ifi < self.min:
+				self.min = ifi
+			if ifi > self.max:
+				self.max = ifi
+		else:
+			self.Reset(timeStamp)
+		self.lastStamp = timeStamp
+		if timeStamp - self.start >= self.interval:
+			self.Emit(timeStamp)
+
+	def Break(self):
+		# Next frame starts a new series, e.g. after an intertrial interval
+		if self.numFrames:
+			self.Emit(self.lastStamp)
+		self.lastStamp = None
+
+	def Emit(self, timeStamp):
+		if self.numFrames and self.logger.isEnabledFor(self.level):
+			self.logger.log(self.level, '%s: %d frames, IFI min %.2f / mean %.2f / max %.2f ms in %.1f s',
+							self.label, self.numFrames, 1e3*self.min, 1e3*self.sum/self.numFrames,
+							1e3*self.max, timeStamp - self.start)
+		self.Reset(timeStamp)
@@ -0,0 +1,132 @@
+"""
+Recover video files cut short by a crash or power loss.
+
+Files recorded with outputContainer 'fmp4' or 'mkv' are written in fragments
+(fragmentDuration), but their index (fragmented MP4 'mfra', Matroska cues and
+duration) is only written when the file is closed. campy-recover remuxes such
+files without re-encoding: ffmpeg reads every complete fragment and writes a new
+file with a full index and the correct duration. A trailing partial fragment is
+dropped. Plain MP4 files without a 'moov' box cannot be recovered this way.
+
+In camera folders, frametimes.npy files missing after a crash are rebuilt from
+the streaming frame logs (frametimes*.log, see campy.writer.framelog).
+
+Usage:
+campy-recover <file or camera folder> [...] [--inplace]
+"""
+
+import os
+import sys
+import glob
+import struct
+import argparse
+import subprocess
+import numpy as np
+from imageio_ffmpeg import get_ffmpeg_exe
+from campy.writer.framelog import ReadFrameLog, FrameTimes
+
+VIDEO_EXTS = ('.mp4', '.mkv')
+RECOVERED_SUFFIX = '-recovered'
+
+def Mp4Boxes(full_file_name):
+	# Top-level MP4 box types, and whether the last box is cut short
+	boxes = []
+	size = os.path.getsize(full_file_name)
+	with open(full_file_name, 'rb') as f:
+		pos = 0
+		while pos + 8 <= size:
+			f.seek(pos)
+			boxSize, boxType = struct.unpack('>I4s', f.read(8))
+			if boxSize == 1:
+				boxSize = struct.unpack('>Q', f.read(8))[0]
+			elif boxSize == 0:
+				boxSize = size - pos # box extends to the end of the file
+			boxes.append(boxType.decode('latin1'))
+			if boxSize < 8:
+				return boxes, True
+			pos += boxSize
+	return boxes, pos != size
+
+def Inspect(full_file_name):
+	# Returns (recoverable, reason)
+	if full_file_name.endswith('.mkv'):
+		return True, 'Matroska'
+	boxes, truncated = Mp4Boxes(full_file_name)
+	if 'moof' in boxes:
+		return True, 'fragmented MP4' + (', truncated' if truncated else '')
+	if 'moov' in boxes and not truncated:
+		return False, 'complete MP4, nothing to recover'
+	return False, 'MP4 without index (moov); record with outputContainer fmp4 or mkv'
+
+def CountFrames(full_file_name):
+	# Frames ffmpeg can read from the file, without decoding
+	cmd = [get_ffmpeg_exe(), '-v', 'error', '-i', full_file_name, '-map', '0:v:0',
+			'-c', 'copy', '-f', 'null', '-progress', 'pipe:1', '-nostats', '-']
+	out = subprocess.run(cmd, capture_output=True, text=True).stdout
+	frames = [line.split('=')[1] for line in out.splitlines() if line.startswith('frame=')]
+	return int(frames[-1]) if frames else 0
+
+def Recover(full_file_name, inplace=False):
+	# Remuxes a fragmented file into a fully indexed one; returns its name, or None
+	recoverable, reason = Inspect(full_file_name)
+	print('{}: {}.'.format(full_file_name, reason))
+	if not recoverable:
+		return None
+
+	stem, ext = os.path.splitext(full_file_name)
+	out_file_name = stem + RECOVERED_SUFFIX + ext
+	cmd = [get_ffmpeg_exe(), '-y', '-v', 'error', '-err_detect', 'ignore_err',
+			'-i', full_file_name, '-map', '0', '-c', 'copy', out_file_name]
+	result = subprocess.run(cmd)
+	if result.returncode != 0 or not os.path.isfile(out_file_name):
+		print('Could not recover {}.'.format(full_file_name))
+		return None
+
+	print('Recovered {} frames to {}.'.format(CountFrames(out_file_name), out_file_name))
+	if inplace:
+		os.replace(out_file_name, full_file_name)
+		out_file_name = full_file_name
+	return out_file_name
+
+def RecoverFrameTimes(folder):
+	# Writes frametimes*.npy for frame logs whose trial was never saved
+	for log_file_name in sorted(glob.glob(os.path.join(folder, 'frametimes*.log'))):
+		npy_file_name = os.path.splitext(log_file_name)[0] + '.npy'
+		if os.path.isfile(npy_file_name):
+			continue
+		records = ReadFrameLog(log_file_name)
+		np.save(npy_file_name, FrameTimes(records))
+		print('Recovered {} frame times to {}.'.format(len(records), npy_file_name))
+
+def VideoFiles(paths):
+	# Files given directly, and the video files in given folders
+	files = []
+	for path in paths:
+		if os.path.isdir(path):
+			for ext in VIDEO_EXTS:
+				files += sorted(f for f in glob.glob(os.path.join(path, '*' + ext))
+								if not os.path.splitext(f)[0].endswith(RECOVERED_SUFFIX))
+		else:
+			files.append(path)
+	return files
+
+def Main():
+	parser = argparse.ArgumentParser(description="Recover campy videos cut short by a crash")
+	parser.add_argument("paths", nargs='+', help="Video files or camera folders.")
+	parser.add_argument("--inplace", action='store_true',
+						help="Replace the damaged file instead of writing <name>-recovered.<ext>.")
+	args = parser.parse_args()
+
+	for path in args.paths:
+		if os.path.isdir(path):
+			RecoverFrameTimes(path)
+
+	failed = 0
+	for full_file_name in VideoFiles(args.paths):
+		if Recover(full_file_name, args.inplace) is None and Inspect(full_file_name)[0]:
+			failed += 1
+	if failed:
+		sys.exit(1)
+
+if __name__ == '__main__':
+	Main()
@@ -0,0 +1,216 @@
+"""
+Frame integrity check of recordings with counter-stamped frames.
+
+Synthetic cameras (cameraMake 'synthetic') stamp each frame with its frame ID
+as a barcode (campy.utils.barcode). campy-verify reads the barcodes back from
+every video file of a camera, <videoFilename>-t<k>.mp4 / .mkv (continued in
+-t<k>-r<n> after an encoder restart) and raw files not transcoded yet
+(.raw.npy), and compares them per trial with the frames the grabber queued:
+
+	frametimes[-t<k>].log 	frameID of every frame (a log without trials is split
+							where frameNumberThisTrial restarts at 1)
+	frametimes[-t<k>].npy 	frame count only, if there is no log
+
+For each trial it reports
+
+	dropped 		queued frames missing from the video
+	duplicated 		extra copies of a frame in the video
+	reordered 		frames whose ID is lower than the one before
+	unexpected 		IDs in the video that were never queued
+	unreadable 		frames without a valid barcode
+	cameraSkipped 	frames the camera lost before the grabber (gaps in the
+					queued IDs, skippedFrames in metadata.csv); not a writer loss
+
+A trial is lossless when all but cameraSkipped are 0. The files are decoded
+in parallel, one per worker process; ffmpeg only passes the barcode area on,
+as gray levels.
+
+Usage:
+campy-verify <videoFolder or camera folder> [...] [--workers 4] [--json]
+"""
+
+import os
+import re
+import sys
+import glob
+import json
+import logging
+import argparse
+import multiprocessing as mp
+from collections import Counter
+import numpy as np
+from imageio_ffmpeg import read_frames
+from campy.utils import barcode
+from campy.utils.recover import RECOVERED_SUFFIX
+from campy.writer.framelog import ReadFrameLog
+from campy.writer.raw import OpenRaw, RAW_EXT
+
+TRIAL_FILE = re.compile(r"-t(?P<trial>\d+)(?:-r(?P<restart>\d+))?(?P<ext>\.mp4|\.mkv|\.raw\.npy)$")
+FRAMETIMES = re.compile(r"^frametimes(?:-t(?P<trial>\d+))?\.(?P<ext>log|npy)$")
+ERRORS = ("dropped", "duplicated", "reordered", "unexpected", "unreadable")
+
+def CropFilter(cell=barcode.CELL):
+	# ffmpeg crop to the barcode area (barcode.Layout, as ffmpeg expressions of the input width)
+	cols = "min({},floor(iw/{}))".format(barcode.BITS, cell)
+	return "crop=w='{0}*{1}':h='{0}*ceil({2}/{1})':x=0:y=0".format(cell, cols, barcode.BITS)
+
+def ReadCounters(file_name):
+	# Barcode of every frame of a video or raw file, None where there is no valid code
+	if file_name.endswith(RAW_EXT):
+		return [barcode.Read(frame) for frame in OpenRaw(file_name)]
+	# The crop makes the frames smaller than the source, as intended
+	logging.getLogger("imageio_ffmpeg").setLevel(logging.ERROR)
+	frames = read_frames(file_name, pix_fmt="gray", bits_per_pixel=8,
+						output_params=["-vsync", "0", "-vf", CropFilter()])
+	width, height = next(frames)["size"]
+	shape = (height, width)
+	counters = []
+	for data in frames:
+		counters.append(barcode.Read(np.frombuffer(data, dtype=np.uint8).reshape(shape)))
+	return counters
+
+def TrialFiles(folder):
+	# {trial: files in order}; a -recovered file (campy-recover) replaces its original
+	names = set(os.listdir(folder))
+	trials = {}
+	for file_name in names:
+		stem, ext = os.path.splitext(file_name)
+		if stem.endswith(RECOVERED_SUFFIX):
+			match = TRIAL_FILE.search(stem[:-len(RECOVERED_SUFFIX)] + ext)
+		elif stem + RECOVERED_SUFFIX + ext in names:
+			continue
+		elif file_name.endswith(RAW_EXT) and any(file_name[:-len(RAW_EXT)] + video in names for video in (".mp4", ".mkv")):
+			continue # transcoded, kept with rawKeep: the video is checked
+		else:
+			match = TRIAL_FILE.search(file_name)
+		if match is not None:
+			key = (int(match.group("restart") or 0), file_name)
+			trials.setdefault(int(match.group("trial")), []).append(key)
+	return {trial: [os.path.join(folder, f) for r, f in sorted(files)] for trial, files in trials.items()}
+
+def SplitTrials(records):
+	# Records of a log without trials, split where frameNumberThisTrial restarts
+	starts = np.flatnonzero(records["frameNumberThisTrial"] == 1)
+	if len(starts) == 0 or starts[0] != 0:
+		starts = np.concatenate([[0], starts])
+	return np.split(records, starts[1:])
+
+def ExpectedFrames(folder, trials):
+	# {trial: (frame IDs queued or None, number of frames queued, source file)}
+	logs, npys = {}, {}
+	for file_name in os.listdir(folder):
+		match = FRAMETIMES.match(file_name)
+		if match is not None:
+			trial = int(match.group("trial")) if match.group("trial") is not None else None
+			(logs if match.group("ext") == "log" else npys)[trial] = os.path.join(folder, file_name)
+
+	expected = {}
+	if None in logs:
+		# Files are numbered from 0, one per trial, as the log's trials
+		for trial, records in enumerate(SplitTrials(ReadFrameLog(logs[None]))):
+			expected[trial] = (records["frameID"], len(records), logs[None])
+	for trial in trials:
+		if trial in logs:
+			records = ReadFrameLog(logs[trial])
+			expected[trial] = (records["frameID"], len(records), logs[trial])
+		elif trial not in expected and trial in npys:
+			expected[trial] = (None, np.load(npys[trial]).shape[-1], npys[trial])
+	if None in npys and not expected and len(trials) == 1:
+		expected[min(trials)] = (None, np.load(npys[None]).shape[-1], npys[None])
+	for trial, (ids, count, source) in expected.items():
+		if ids is not None and np.all(ids < 0):
+			expected[trial] = (None, count, source) # camera without frame IDs
+	return expected
+
+def Compare(counters, ids, count):
+	# Integrity report of one trial: decoded counters against the queued frame IDs
+	read = [c for c in counters if c is not None]
+	copies = Counter(read)
+	report = {"framesInVideo": len(counters),
+			"framesQueued": count,
+			"unreadable": len(counters) - len(read),
+			"duplicated": sum(n - 1 for n in copies.values()),
+			"reordered": sum(1 for a, b in zip(read, read[1:]) if b < a)}
+	if ids is not None:
+		queued = set(int(i) for i in ids)
+		report["dropped"] = len(queued - set(copies))
+		report["unexpected"] = len(set(copies) - queued)
+		report["cameraSkipped"] = int(np.sum(np.diff(ids) - 1)) if len(ids) > 1 else 0
+	else:
+		# Frame count only: a frame missing from the video is one queued frame too few
+		report["dropped"] = max(0, count - len(copies))
+		report["unexpected"] = 0
+	report["lossless"] = all(report[key] == 0 for key in ERRORS) and len(counters) == count
+	return report
+
+def CameraFolders(paths):
+	# Camera folders given directly, or the camera folders in a videoFolder
+	folders = []
+	for path in paths:
+		if glob.glob(os.path.join(path, "frametimes*")) or TrialFiles(path):
+			folders.append(path)
+		else:
+			folders += sorted(os.path.dirname(f) for f in glob.glob(os.path.join(path, "*", "frametimes*.*"))
+							if os.path.dirname(f) not in folders)
+	return sorted(set(folders), key=folders.index)
+
+def Verify(folders, numWorkers):
+	# {folder: {trial: report}}
+	trialFiles = {folder: TrialFiles(folder) for folder in folders}
+	jobs = [f for trials in trialFiles.values() for files in trials.values() for f in files]
+	ctx = mp.get_context("spawn")
+	with ctx.Pool(processes=max(1, min(numWorkers, len(jobs)))) as pool:
+		counters = dict(zip(jobs, pool.map(ReadCounters, jobs, chunksize=1)))
+
+	results = {}
+	for folder, trials in trialFiles.items():
+		expected = ExpectedFrames(folder, trials)
+		results[folder] = {}
+		for trial in sorted(set(trials) | set(expected)):
+			files = trials.get(trial, [])
+			ids, count, source = expected.get(trial, (None, None, None))
+			decoded = [c for f in files for c in counters[f]]
+			if count is None:
+				report = {"framesInVideo": len(decoded), "lossless": False, "error": "no frame times"}
+			else:
+				report = Compare(decoded, ids, count)
+				report["frameTimes"] = os.path.basename(source)
+			report["files"] = [os.path.basename(f) for f in files]
+			results[folder][trial] = report
+	return results
+
+def PrintReport(results):
+	# One line per trial
+	for folder, trials in results.items():
+		for trial, report in trials.items():
+			if "error" in report:
+				details = report["error"]
+			else:
+				details = ", ".join("{} {}".format(key, report[key]) for key in ERRORS + ("cameraSkipped",)
+									if report.get(key))
+			print("{} trial {}: {} of {} frames{}{}".format(
+				folder, trial, report["framesInVideo"], report.get("framesQueued"),
+				", lossless" if report["lossless"] else ", NOT lossless", ": " + details if details else ""))
+
+def Main():
+	parser = argparse.ArgumentParser(description="Check recordings of counter-stamped frames for lost frames")
+	parser.add_argument("paths", nargs='+', help="Recording folders (videoFolder) or camera folders.")
+	parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Files decoded in parallel.")
+	parser.add_argument("--json", action='store_true', help="Print the full report as JSON instead of one line per trial.")
+	args = parser.parse_args()
+
+	folders = CameraFolders(args.paths)
+	if not folders:
+		parser.error("No camera folders with frame times or videos in {}.".format(", ".join(args.paths)))
+	results = Verify(folders, args.workers)
+
+	failed = sum(not report["lossless"] for trials in results.values() for report in trials.values())
+	if args.json:
+		print(json.dumps(results, indent=1))
+	else:
+		PrintReport(results)
+	if failed:
+		sys.exit(1)
+
+if __name__ == '__main__':
+	Main()
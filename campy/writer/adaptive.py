@@ -0,0 +1,118 @@
+"""
+Adaptive encoder degradation (adaptiveEncoding).
+
+WriteFrames samples the write queue backlog while a file is being written. If the
+backlog reached adaptiveThreshold (a fraction of writeBufferSize) during a file,
+the next file is encoded one level cheaper; once the peak backlog of a file stays
+below half the threshold, the encoder steps back up one level per file, until it
+is back at the configured settings. Levels are cumulative:
+
+	1: the next faster preset
+	2: also no B-frames
+	3: also QUALITY_STEP higher crf/qp (lower quality)
+
+Settings change only at file boundaries, so every trial is encoded with a single
+set of settings. A recording written to a single file (basler and synthetic
+cameras, flir without trialStructure) has no such boundaries, and
+adaptiveEncoding is rejected for it (CheckAdaptiveEncoding). With fileRotation
+'standby' the next file's encoder is already open, so a change takes effect one
+file later. Each trial's level and settings are logged to encoding.csv in the
+camera folder, with the backlog that triggered any change. The writers also
+save the level and settings each file was actually opened with in the trial's
+<video stem>.json (campipe.SaveEncoderInfo).
+"""
+
+import os
+import csv
+import time
+
+MAX_LEVEL = 3
+QUALITY_STEP = 4
+
+# Faster presets, in order, for the encoders' default presets
+FASTER_PRESETS = {"libx264": ['fast', 'faster', 'veryfast', 'superfast', 'ultrafast'],
+				"libx265": ['fast', 'faster', 'veryfast', 'superfast', 'ultrafast'],
+				"h264_nvenc": ['fast', 'llhp'],
+				"hevc_nvenc": ['fast', 'llhp'],}
+
+# Options holding the quantizer of each encoder branch
+QUALITY_OPTIONS = ('-crf', '-qp', '-qp_i', '-qp_p', '-qp_b')
+
+def SplitsFiles(cam_params):
+	# Whether the grabber of this camera starts new files while recording ('NEWFILE')
+	if cam_params["cameraMake"] == "flir":
+		return bool(cam_params.get("trialStructure", False))
+	return cam_params["cameraMake"] == "emu"
+
+def CheckAdaptiveEncoding(cam_params):
+	# Raises ValueError if adaptiveEncoding is set for a recording without file boundaries
+	if cam_params["adaptiveEncoding"] and not SplitsFiles(cam_params):
+		raise ValueError('Camera {}: adaptiveEncoding changes encoder settings between files, but this '
+						'recording is written to a single file ({} camera{}).'.format(
+						cam_params["n_cam"]+1, cam_params["cameraMake"],
+						' without trialStructure' if cam_params["cameraMake"] == "flir" else ''))
+
+def DegradeParams(codec, gpu_params, level):
+	# Encoder output options for a degradation level (0 = as configured)
+	params = list(gpu_params)
+	if level >= 1 and '-preset' in params:
+		i = params.index('-preset') + 1
+		presets = FASTER_PRESETS.get(codec, [])
+		if params[i] in presets:
+			params[i] = presets[min(presets.index(params[i]) + 1, len(presets) - 1)]
+	if level >= 2 and '-bf:v' in params:
+		params[params.index('-bf:v') + 1] = '0'
+	if level >= 3:
+		for option in QUALITY_OPTIONS:
+			if option in params:
+				i = params.index(option) + 1
+				params[i] = str(min(51, int(params[i]) + QUALITY_STEP))
+	return params
+
+class EncoderAdapter():
+	def __init__(self, cam_params):
+		self.cam_params = cam_params
+		self.threshold = cam_params["adaptiveThreshold"]*cam_params["writeBufferSize"]
+		self.level = 0
+		self.maxBacklog = 0
+		self.timeStart = time.perf_counter()
+		CheckAdaptiveEncoding(cam_params)
+		cam_params["encoderLevel"] = 0
+
+		folder_name = os.path.join(cam_params["videoFolder"], cam_params["cameraName"])
+		os.makedirs(folder_name, exist_ok=True)
+		self.csv_filename = os.path.join(folder_name, 'encoding.csv')
+		with open(self.csv_filename, 'w', newline='') as f:
+			csv.writer(f).writerow(['time', 'clockTime', 'filenum', 'encoderLevel', 'event',
+									'maxBacklog', 'outputParams'])
+		self.Log(0, 'start')
+
+	def Sample(self, backlog):
+		if backlog > self.maxBacklog:
+			self.maxBacklog = backlog
+
+	def NewFile(self, filenum):
+		# Sets the level for file filenum from the backlog during the previous file
+		event = 'keep'
+		if self.maxBacklog >= self.threshold and self.level < MAX_LEVEL:
+			self.level += 1
+			event = 'degrade'
+			print('Camera {} writer backlog reached {} frames, encoding level {} from file {}.'.format(
+				self.cam_params["n_cam"]+1, self.maxBacklog, self.level, filenum))
+		elif self.maxBacklog < self.threshold/2 and self.level > 0:
+			self.level -= 1
+			event = 'restore'
+		self.cam_params["encoderLevel"] = self.level
+		self.Log(filenum, event)
+		self.maxBacklog = 0
+
+	def Log(self, filenum, event):
+		from campy.writer.campipe import EncoderParams
+		_, _, output_params = EncoderParams(self.cam_params)
+		try:
+			with open(self.csv_filename, 'a', newline='') as f:
+				csv.writer(f).writerow([round(time.perf_counter() - self.timeStart, 3),
+										time.strftime('%Y-%m-%d %H:%M:%S'), filenum, self.level,
+										event, self.maxBacklog, ' '.join(output_params)])
+		except Exception as err:
+			print(err)
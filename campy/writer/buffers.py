@@ -0,0 +1,415 @@
+"""
+Preallocated frame buffers shared between the grabbing ('producer') and
+writing ('consumer') sides of a camera stream.
+
+FrameRing replaces the unbounded deque that used to sit between GrabFrames and
+WriteFrames. Frame slots are allocated once, in shared memory, and sized from
+frameWidth/frameHeight/pixelFormatInput. The grabber copies each frame into a
+free slot, the writer receives a numpy view of that slot (no copy) and the slot
+goes back to the free list once the writer is done with it.
+
+The ring keeps the deque interface used by the camera modules (append/popleft),
+so control messages ('STOP', 'NEWFILE') travel through it in order with frames.
+Consumers block in get() on a semaphore that is released on every append, instead
+of polling.
+
+When the writer falls behind and no slot is free, writeBufferPolicy decides what
+happens to a new frame: 'block' waits for the writer (the camera's own buffers fill
+up meanwhile), 'dropOldest' reuses the slot of the oldest queued frame, 'dropNewest'
+discards the new frame and 'spill' writes it to a SpillBuffer on disk, read back in
+order. Dropped and spilled frames are counted exactly (Stats()). With writerSpill,
+the writer adds a spill stage of its own on top of the ring (see spill.SpillStage).
+
+Each entry carries the frame's camera timestamp (seconds, append(frame, timestamp)),
+which the consumer finds in .timestamp after get/GetEntry (None if the grabber gave
+none). With frameTimestamps, the writer encodes every frame at this time.
+
+Rings can be handed to a child process as an argument to mp.Process, which
+re-attaches to the same shared memory block by name. Only the creating process
+unlinks the block.
+
+BlockingDeque is the in-process equivalent for small queues of references, such
+as the display queue: a bounded deque with a condition variable.
+
+LatestFrame is the display queue of a camera shown in the display process
+(displayMosaic): one shared-memory slot, named by the recording, that always holds
+the most recent display frame. The grabber overwrites it (append), readers in
+other processes copy it out when its sequence number has changed (Read); a frame
+overwritten while it was being read is skipped. The slot's header records the
+frame shape, so readers only need the name. The grabbers append full frames;
+the slot's downsample function (display/downsample.py) writes the reduced frame
+straight into shared memory.
+"""
+
+import threading
+import numpy as np
+import multiprocessing as mp
+from collections import deque
+from multiprocessing import shared_memory
+from campy.writer.spill import SpillBuffer, SpillFileName, SPILLED
+
+# Bytes per pixel ('channels' of uint8) for each ffmpeg input pixel format
+PIXEL_FORMAT_CHANNELS = {"gray": 1,
+						"bayer_bggr8": 1,
+						"bayer_rggb8": 1,
+						"bayer_gbrg8": 1,
+						"bayer_grbg8": 1,
+						"rgb24": 3,
+						"bgr24": 3,
+						"bgr8": 3, # FLIR 'BGR8' frames arrive as H x W x 3
+						"rgb0": 4,
+						"bgr0": 4,
+						"rgba": 4,
+						"bgra": 4,}
+
+# Control messages passed through the ring in place of frames
+MESSAGES = ('STOP', 'NEWFILE')
+
+POLICIES = ('block', 'dropOldest', 'dropNewest', 'spill')
+
+# Header layout (int64 counters)
+HEAD = 0 		# entries appended by the producer
+TAIL = 1 		# entries popped by the consumer
+FREE_HEAD = 2 	# slots released by the consumer
+FREE_TAIL = 3 	# slots taken by the producer
+DROPPED = 4 	# frames dropped by the producer
+SPILLED_COUNT = 5 # frames written to the spill buffer
+HEADER_LEN = 16
+
+# Extra entries in the message queue so control messages never wait for a slot
+MESSAGE_ENTRIES = 16
+
+def FrameShape(cam_params):
+	# Shape of one frame as delivered by the camera modules
+	channels = PIXEL_FORMAT_CHANNELS.get(cam_params["pixelFormatInput"], 3)
+	shape = (int(cam_params["frameHeight"]), int(cam_params["frameWidth"]))
+	if channels > 1:
+		shape = shape + (channels,)
+	return shape
+
+class FrameRing():
+	def __init__(self, numSlots, shape, dtype='uint8', policy='block', spill=None, name=None, sync=None):
+		if policy not in POLICIES:
+			raise ValueError('Unknown writeBufferPolicy {}. Use one of {}.'.format(policy, POLICIES))
+		if policy == 'spill' and spill is None:
+			raise ValueError("writeBufferPolicy 'spill' needs a SpillBuffer.")
+		self.numSlots = int(numSlots)
+		self.shape = tuple(shape)
+		self.dtype = np.dtype(dtype)
+		self.policy = policy
+		self.spill = spill
+		self.numEntries = self.numSlots + MESSAGE_ENTRIES
+		if spill is not None:
+			self.numEntries += spill.numFrames
+
+		slotBytes = int(np.prod(self.shape))*self.dtype.itemsize
+		self.slotBytes = slotBytes + (-slotBytes % 64) # keep slots cache-line aligned
+		headerBytes = 8*(HEADER_LEN + 2*self.numEntries + self.numSlots)
+		self.headerBytes = headerBytes + (-headerBytes % 64)
+		nbytes = self.headerBytes + self.numSlots*self.slotBytes
+
+		if name is None:
+			self.shm = shared_memory.SharedMemory(create=True, size=nbytes)
+			self.owner = True
+		else:
+			self.shm = shared_memory.SharedMemory(name=name)
+			self.owner = False
+		self.name = self.shm.name
+		self._Map()
+
+		# Semaphores count filled entries, free slots and free entries; the lock guards
+		# the consumer end of the queue, which 'dropOldest' also takes entries from.
+		# Spawn-context semaphores can be shared with both spawned and forked processes.
+		if sync is None:
+			ctx = mp.get_context("spawn")
+			sync = (ctx.Semaphore(0), ctx.Semaphore(self.numSlots), ctx.Semaphore(self.numEntries),
+					ctx.Lock())
+		self.filled, self.freeSlots, self.freeEntries, self.lock = sync
+
+		if self.owner:
+			self.header[:] = 0
+			self.free[:] = np.arange(self.numSlots)
+			self.header[FREE_HEAD] = self.numSlots
+
+	def _Map(self):
+		buf = self.shm.buf
+		self.header = np.ndarray((HEADER_LEN,), dtype=np.int64, buffer=buf, offset=0)
+		self.entries = np.ndarray((self.numEntries,), dtype=np.int64, buffer=buf,
+									offset=8*HEADER_LEN)
+		self.free = np.ndarray((self.numSlots,), dtype=np.int64, buffer=buf,
+									offset=8*(HEADER_LEN + self.numEntries))
+		self.times = np.ndarray((self.numEntries,), dtype=np.float64, buffer=buf,
+									offset=8*(HEADER_LEN + self.numEntries + self.numSlots))
+		self.slots = [np.ndarray(self.shape, dtype=self.dtype, buffer=buf,
+								offset=self.headerBytes + i*self.slotBytes)
+						for i in range(self.numSlots)]
+		self._held = None
+		self.timestamp = None
+
+	def __getstate__(self):
+		return {"numSlots": self.numSlots, "shape": self.shape,
+				"dtype": self.dtype.str, "policy": self.policy, "spill": self.spill,
+				"name": self.name,
+				"sync": (self.filled, self.freeSlots, self.freeEntries, self.lock)}
+
+	def __setstate__(self, state):
+		self.__init__(**state)
+
+	def __len__(self):
+		return int(self.header[HEAD] - self.header[TAIL])
+
+	def __bool__(self):
+		return self.__len__() > 0
+
+	def Stats(self):
+		return {"droppedFrames": int(self.header[DROPPED]),
+				"spilledFrames": int(self.header[SPILLED_COUNT])}
+
+	# -- Producer side --
+
+	def _TakeSlot(self, block=True):
+		# Returns the index of a free slot, or -1 if none is free and block is False
+		if not self.freeSlots.acquire(block):
+			return -1
+		slot = int(self.free[self.header[FREE_TAIL] % self.numSlots])
+		self.header[FREE_TAIL] += 1
+		return slot
+
+	def _DropOldest(self):
+		# Takes the slot of the oldest queued frame, or returns -1 if there is none
+		with self.lock:
+			if not self.filled.acquire(False):
+				return -1
+			tail = int(self.header[TAIL])
+			for n in range(tail, int(self.header[HEAD])):
+				slot = int(self.entries[n % self.numEntries])
+				if slot >= 0:
+					break
+			else:
+				self.filled.release()
+				return -1
+			# Messages queued ahead of the dropped frame move up by one
+			for m in range(n, tail, -1):
+				self.entries[m % self.numEntries] = self.entries[(m-1) % self.numEntries]
+				self.times[m % self.numEntries] = self.times[(m-1) % self.numEntries]
+			self.header[TAIL] += 1
+			self.header[DROPPED] += 1
+		self.freeEntries.release()
+		return slot
+
+	def _PushEntry(self, entry, timestamp=None):
+		self.freeEntries.acquire()
+		self.entries[self.header[HEAD] % self.numEntries] = entry
+		self.times[self.header[HEAD] % self.numEntries] = np.nan if timestamp is None else timestamp
+		self.header[HEAD] += 1
+		self.filled.release()
+
+	def append(self, item, timestamp=None):
+		# timestamp: the frame's camera time in seconds, if known
+		if isinstance(item, str):
+			self._PushEntry(-1 - MESSAGES.index(item))
+			return
+		item = np.asarray(item)
+		if item.size != self.slots[0].size:
+			raise ValueError('Frame of shape {} does not fit ring slots of shape {}.'.format(
+				item.shape, self.shape))
+
+		slot = self._TakeSlot(block=(self.policy == 'block'))
+		if slot < 0 and self.policy == 'dropOldest':
+			slot = self._DropOldest()
+		elif slot < 0 and self.policy == 'dropNewest':
+			self.header[DROPPED] += 1
+			return
+		elif slot < 0 and self.policy == 'spill' and not self.spill.Full():
+			self.spill.Put(item)
+			self.header[SPILLED_COUNT] += 1
+			self._PushEntry(SPILLED, timestamp)
+			return
+		if slot < 0:
+			# Nothing left to drop or spill: wait for the writer
+			slot = self._TakeSlot()
+
+		np.copyto(self.slots[slot], item.reshape(self.shape))
+		self._PushEntry(slot, timestamp)
+
+	# -- Consumer side --
+
+	def ReleaseSlot(self, slot):
+		# Return a slot handed out by GetEntry to the producer
+		if slot == SPILLED:
+			self.spill.Release()
+			return
+		with self.lock:
+			self.free[self.header[FREE_HEAD] % self.numSlots] = slot
+			self.header[FREE_HEAD] += 1
+		self.freeSlots.release()
+
+	def GetEntry(self, block=True, timeout=None):
+		# Returns (item, slot): a message string or a view of the next frame, and the slot
+		# to pass to ReleaseSlot once the frame has been written (None for messages).
+		# The frame's timestamp is left in self.timestamp.
+		# Returns (None, None) if nothing arrived within timeout.
+		if not self.filled.acquire(block, timeout):
+			return None, None
+		with self.lock:
+			entry = int(self.entries[self.header[TAIL] % self.numEntries])
+			timestamp = float(self.times[self.header[TAIL] % self.numEntries])
+			self.header[TAIL] += 1
+		self.timestamp = None if np.isnan(timestamp) else timestamp
+		self.freeEntries.release()
+		if entry == SPILLED:
+			return self.spill.Get(), SPILLED
+		elif entry < 0:
+			return MESSAGES[-1 - entry], None
+		return self.slots[entry], entry
+
+	def Release(self):
+		# Return the slot of the last frame handed out by get
+		if self._held is not None:
+			self.ReleaseSlot(self._held)
+			self._held = None
+
+	def get(self, block=True, timeout=None):
+		# Returns a message string, or a view of the next frame (valid until the next get).
+		# Returns None if nothing arrived within timeout.
+		self.Release()
+		item, self._held = self.GetEntry(block, timeout)
+		return item
+
+	def popleft(self):
+		item = self.get(block=False)
+		if item is None:
+			raise IndexError('pop from an empty FrameRing')
+		return item
+
+	# -- Cleanup --
+
+	def Close(self):
+		self.header = self.entries = self.free = self.times = None
+		self.slots = []
+		if self.spill is not None:
+			self.spill.Close()
+		try:
+			self.shm.close()
+		except Exception:
+			pass
+
+	def Unlink(self):
+		if self.owner:
+			try:
+				self.shm.unlink()
+			except FileNotFoundError:
+				pass
+
+def OpenFrameRing(cam_params):
+	# Frame ring sized for this camera stream
+	shape = FrameShape(cam_params)
+	spill = None
+	if cam_params["writeBufferPolicy"] == 'spill':
+		spill = SpillBuffer(SpillFileName(cam_params), cam_params["spillBufferSize"], shape)
+	return FrameRing(cam_params["writeBufferSize"], shape,
+					policy=cam_params["writeBufferPolicy"], spill=spill)
+
+class BlockingDeque():
+	def __init__(self, maxlen=None):
+		self.queue = deque([], maxlen)
+		self.cond = threading.Condition()
+
+	def __len__(self):
+		return len(self.queue)
+
+	def __bool__(self):
+		return len(self.queue) > 0
+
+	def append(self, item):
+		# Oldest items are discarded when maxlen is reached, as with deque
+		with self.cond:
+			self.queue.append(item)
+			self.cond.notify()
+
+	def get(self, block=True, timeout=None):
+		# Returns the oldest item, or None if nothing arrived within timeout
+		with self.cond:
+			if block and not self.queue:
+				self.cond.wait_for(lambda: self.queue, timeout)
+			if not self.queue:
+				return None
+			return self.queue.popleft()
+
+	def popleft(self):
+		with self.cond:
+			return self.queue.popleft()
+
+# LatestFrame header (int64): sequence number (odd while a frame is written), shape
+SEQUENCE = 0
+LATEST_HEADER_LEN = 4
+
+class LatestFrame():
+	def __init__(self, name, shape=None, dtype='uint8', downsample=None):
+		# Creates the slot if shape is given, else attaches to it by name.
+		# downsample(frame, out): reduces appended frames to shape, in place
+		self.downsample = downsample
+		self.owner = shape is not None
+		if self.owner:
+			shape = tuple(shape) + (1,)*(3 - len(shape))
+			nbytes = 8*LATEST_HEADER_LEN + int(np.prod(shape))*np.dtype(dtype).itemsize
+			self.shm = shared_memory.SharedMemory(name=name, create=True, size=nbytes)
+		else:
+			self.shm = shared_memory.SharedMemory(name=name)
+		self.name = name
+		self.header = np.ndarray((LATEST_HEADER_LEN,), dtype=np.int64, buffer=self.shm.buf)
+		if self.owner:
+			self.header[:] = (0,) + shape
+		height, width, channels = (int(n) for n in self.header[1:])
+		self.frame = np.ndarray((height, width, channels), dtype=dtype, buffer=self.shm.buf,
+								offset=8*LATEST_HEADER_LEN)
+		if channels == 1:
+			self.frame = self.frame[:, :, 0]
+		self.sequence = 0 # of the last frame read
+
+	@property
+	def shape(self):
+		return self.frame.shape
+
+	def append(self, frame):
+		# Same call as the display queue; replaces the latest frame
+		if self.downsample is None and frame.shape != self.frame.shape:
+			raise ValueError('Display frame of shape {} does not match the display slot of shape {}.'.format(
+				frame.shape, self.frame.shape))
+		self.header[SEQUENCE] += 1
+		if self.downsample is not None:
+			self.downsample(frame, self.frame)
+		else:
+			self.frame[...] = frame
+		self.header[SEQUENCE] += 1
+
+	def Read(self, out):
+		# Copies a new frame into out (gray frames to every color channel, extra channels
+		# dropped); returns False if there is no new complete frame
+		sequence = int(self.header[SEQUENCE])
+		if sequence == self.sequence or sequence % 2:
+			return False
+		frame = self.frame
+		if frame.ndim == 2 and out.ndim == 3:
+			frame = frame[:, :, None]
+		elif frame.ndim == 3 and frame.shape[2] > out.shape[2]:
+			frame = frame[:, :, :out.shape[2]]
+		out[...] = frame
+		if int(self.header[SEQUENCE]) != sequence:
+			return False # overwritten meanwhile; the next frame will do
+		self.sequence = sequence
+		return True
+
+	def Close(self):
+		self.header = self.frame = None
+		try:
+			self.shm.close()
+		except Exception:
+			pass
+
+	def Unlink(self):
+		if self.owner:
+			try:
+				self.shm.unlink()
+			except FileNotFoundError:
+				pass
@@ -2,17 +2,31 @@
 
 """
 
-from imageio_ffmpeg import write_frames
+from imageio_ffmpeg import write_frames, get_ffmpeg_exe
+from campy.writer import mkv
+from campy.writer.spill import SpillStage
+from campy.writer.pipewriter import OpenPipeWriter, MacroBlockParams, EncoderError, RestartFileName, MAX_RESTARTS
+from campy.writer.raw import RawWriter
+from campy.writer.adaptive import DegradeParams, EncoderAdapter
+from campy.writer.buffers import FrameShape
+from campy.utils.log import GetLogger
+import numpy as np
+import subprocess
+import queue
 import os
+import json
 import time
 import logging
 import sys
+import threading
 
 DEBUG = False
+FILENUM_TOKEN = "<filenum>"
+QUEUE_TIMEOUT = 0.5 # sec, wait for frames before checking again
+MATROSKA_INPUT = ['-f', 'matroska', '-i', '-', '-an'] # frames streamed by the mkv muxer
 
-def OpenWriter(cam_params, filenum=0):
-	n_cam = cam_params["n_cam"]
-
+def WriterFileName(cam_params, filenum=0):
+	# Video file for trial/file number filenum: <videoFilename>-t<filenum>.<ext>
 	folder_name = os.path.join(cam_params["videoFolder"], cam_params["cameraName"])
 	if cam_params["cameraMake"] == "emu":
 		fname = "emu" + cam_params["videoFilename"]
@@ -21,6 +35,8 @@ def OpenWriter(cam_params, filenum=0):
 
 	fname_str, fname_ext = os.path.splitext(fname)
 	fname_str = f"{fname_str}-t{filenum}"
+	if cam_params.get("outputContainer", "mp4") == "mkv":
+		fname_ext = ".mkv"
 
 	if DEBUG:
 		import numpy as np
@@ -30,13 +46,10 @@ def OpenWriter(cam_params, filenum=0):
 
 	full_file_name = os.path.join(folder_name, f"{fname_str}{fname_ext}")
 	# full_file_name = os.path.join(folder_name, fname)
+	return folder_name, full_file_name
 
-	if not os.path.isdir(folder_name):
-		os.makedirs(folder_name)
-		print('Made directory {}.'.format(folder_name))
-	else:
-		print('Saving to directory {}.'.format(folder_name))
-
+def EncoderParams(cam_params):
+	# ffmpeg encoder, output pixel format and output parameters for this camera stream
 	# Load defaults
 	pix_fmt_out = cam_params["pixelFormatOutput"]
 	codec = cam_params["codec"]
@@ -44,7 +57,6 @@ def OpenWriter(cam_params, filenum=0):
 
 	# CPU compression
 	if cam_params["gpuID"] == -1:
-		print('Opened: {} using CPU to compress the stream.'.format(full_file_name))
 		if pix_fmt_out == 'rgb0':
 			pix_fmt_out = 'yuv420p'
 		if cam_params["codec"] == 'h264':
@@ -62,7 +74,6 @@ def OpenWriter(cam_params, filenum=0):
 
 	# GPU compression
 	else:
-		print('Opened: {} using GPU {} to compress the stream.'.format(full_file_name, cam_params["gpuID"]))
 		if cam_params["gpuMake"] == 'nvidia':
 			if cam_params["codec"] == 'h264':
 				codec = 'h264_nvenc'
@@ -101,14 +112,157 @@ def OpenWriter(cam_params, filenum=0):
 			gpu_params = ['-r:v', str(cam_params["frameRate"]),
 						'-bf:v', '0',]
 
+	# Override the branch's preset, e.g. with one picked by campy-bench-encode
+	if cam_params["encoderPreset"] and '-preset' in gpu_params:
+		gpu_params[gpu_params.index('-preset')+1] = cam_params["encoderPreset"]
+
+	# Cheaper settings while the writer falls behind (adaptiveEncoding)
+	gpu_params = DegradeParams(codec, gpu_params, cam_params.get("encoderLevel", 0))
+
+	return codec, pix_fmt_out, gpu_params
+
+def ContainerOptions(cam_params):
+	# Muxer options for crash-safe output: fragmented MP4 or Matroska with short clusters.
+	# Everything up to the last written fragment survives a crash (see campy-recover).
+	# With frameTimestamps, MP4 edit lists are left out: ffmpeg ends them at the last
+	# frame's decode time, which cuts off the last frame of a variable frame rate stream.
+	container = cam_params.get("outputContainer", "mp4")
+	fragment = cam_params.get("fragmentDuration", 1)
+	options = []
+	if container in ("mp4", "fmp4") and cam_params.get("frameTimestamps", False):
+		options = [('use_editlist', '0')]
+	if container == "fmp4":
+		return options + [('movflags', '+empty_moov+default_base_moof'), ('frag_duration', str(int(1e6*fragment)))]
+	elif container == "mkv":
+		return [('cluster_time_limit', str(int(1e3*fragment)))]
+	elif container == "mp4":
+		return options
+	raise ValueError('Unknown outputContainer {}.'.format(container))
+
+def ContainerParams(cam_params):
+	# ffmpeg output options for ContainerOptions
+	params = []
+	for key, value in ContainerOptions(cam_params):
+		params += ['-' + key, value]
+	return params
+
+def SegmentFormatParams(cam_params):
+	# The same options for the files of the segment muxer
+	options = ContainerOptions(cam_params)
+	if not options:
+		return []
+	return ['-segment_format_options', ':'.join('{}={}'.format(key, value) for key, value in options)]
+
+def InfoFileName(full_file_name):
+	return os.path.splitext(full_file_name)[0] + '.json'
+
+def SaveTrialInfo(full_file_name, **info):
+	# Writer-side metadata of a trial (e.g. lost frames), next to its video file as
+	# <video stem>.json; updates the given keys of an existing file
+	info_file_name = InfoFileName(full_file_name)
+	try:
+		with open(info_file_name) as f:
+			info = dict(json.load(f), **info)
+	except (OSError, ValueError):
+		pass
+	with open(info_file_name, 'w') as f:
+		json.dump(info, f, indent=1)
+
+def SaveEncoderInfo(cam_params, full_file_name, output_params):
+	# With adaptiveEncoding, the level and settings a file is encoded with
+	if cam_params.get("adaptiveEncoding", False):
+		SaveTrialInfo(full_file_name, encoderLevel=cam_params.get("encoderLevel", 0),
+					encoderOutputParams=' '.join(output_params))
+
+def PassTimestampParams(gpu_params, exact=False):
+	# Output options that keep the input timestamps instead of a constant -r:v.
+	# exact: encode in the input time base (microseconds for campy's Matroska stream)
+	# instead of rounding timestamps to the frame rate.
+	output_params = list(gpu_params)
+	if '-r:v' in output_params:
+		i = output_params.index('-r:v')
+		del output_params[i:i+2]
+	if '-vsync' not in output_params:
+		output_params += ['-vsync', '0']
+	if exact:
+		output_params += ['-enc_time_base', '-1']
+	return output_params
+
+class TimestampWriter():
+	# Streams frames to ffmpeg as Matroska, each at its camera timestamp (frameTimestamps),
+	# so the video has the real presentation time of every frame (VFR). Times count from
+	# the file's first frame; a frame without a timestamp follows the previous one at
+	# the nominal frame rate.
+	def __init__(self, cam_params, full_file_name, codec, pix_fmt_out, output_params):
+		self.frameRate = cam_params["frameRate"]
+		self.firstTimestamp = None
+		self.lastTimestamp = None # us
+		self.pipe = OpenPipeWriter(cam_params, full_file_name, codec, pix_fmt_out,
+								PassTimestampParams(output_params, exact=True),
+								input_params=MATROSKA_INPUT, restart=True)
+		self.pipe.SetPreamble(mkv.StreamHeader(cam_params["frameWidth"], cam_params["frameHeight"],
+											cam_params["pixelFormatInput"], self.frameRate))
+
+	@property
+	def telemetry(self):
+		return self.pipe.telemetry
+
+	def send(self, frame, timestamp=None):
+		if timestamp is None:
+			if self.lastTimestamp is None:
+				t = 0
+			else:
+				t = self.lastTimestamp + round(1e6/self.frameRate)
+		else:
+			if self.firstTimestamp is None:
+				self.firstTimestamp = timestamp
+			t = round(1e6*(timestamp - self.firstTimestamp))
+			if self.lastTimestamp is not None:
+				t = max(t, self.lastTimestamp + 1) # never backwards
+		self.pipe.send(frame, mkv.FrameHeader(t, frame.nbytes))
+		self.lastTimestamp = t
+
+	def close(self):
+		return self.pipe.close()
+
+def OpenWriter(cam_params, filenum=0):
+	n_cam = cam_params["n_cam"]
+
+	folder_name, full_file_name = WriterFileName(cam_params, filenum)
+
+	if not os.path.isdir(folder_name):
+		os.makedirs(folder_name, exist_ok=True)
+		print('Made directory {}.'.format(folder_name))
+	else:
+		print('Saving to directory {}.'.format(folder_name))
+
+	# Raw frames, encoded after acquisition (see transcode.py)
+	if cam_params["writerBackend"] == "raw":
+		print('Opened: {} for raw frames.'.format(full_file_name))
+		return RawWriter(cam_params, full_file_name)
+
+	codec, pix_fmt_out, gpu_params = EncoderParams(cam_params)
+	SaveEncoderInfo(cam_params, full_file_name, gpu_params)
+	if cam_params["gpuID"] == -1:
+		print('Opened: {} using CPU to compress the stream.'.format(full_file_name))
+	else:
+		print('Opened: {} using GPU {} to compress the stream.'.format(full_file_name, cam_params["gpuID"]))
+
 	# Initialize writer object (imageio-ffmpeg)
 	while(True):
 		try:
 			try:
-				print("Writing")
-				print(cam_params)
-				print(gpu_params)
+				GetLogger(cam_params["cameraName"]).debug("Writer parameters: %s, output: %s", cam_params, gpu_params)
 				# assert False
+				if cam_params.get("frameTimestamps", False):
+					writer = TimestampWriter(cam_params, full_file_name, codec, pix_fmt_out,
+											MacroBlockParams(cam_params) + gpu_params + ContainerParams(cam_params))
+					break
+				if cam_params["writerBackend"] == "pipe":
+					writer = OpenPipeWriter(cam_params, full_file_name, codec, pix_fmt_out,
+											MacroBlockParams(cam_params) + gpu_params + ContainerParams(cam_params),
+											restart=True)
+					break
 				writer = write_frames(
 					full_file_name,
 					[cam_params["frameWidth"], cam_params["frameHeight"]], # size [W,H]
@@ -120,10 +274,12 @@ def OpenWriter(cam_params, filenum=0):
 					bitrate=None,
 					ffmpeg_log_level=cam_params["ffmpegLogLevel"], # 'warning', 'quiet', 'info'
 					input_params=['-an'], # '-an' no audio
-					output_params=gpu_params,
+					output_params=gpu_params + ContainerParams(cam_params),
 					)
 				writer.send(None) # Initialize the generator
 				break
+			except (KeyError, TypeError, ValueError):
+				raise # bad cam_params; retrying cannot help
 			except Exception as e:
 				print("Error (writing)")
 				logging.error('Caught exception: {}'.format(e))
@@ -134,41 +290,439 @@ def OpenWriter(cam_params, filenum=0):
 
 	return writer
 
-def WriteFrames(cam_params, writeQueue, stopQueue):
+def WriterTelemetry(writer):
+	# Progress and state of a pipe backend encoder; None for the imageio backend
+	telemetry = getattr(writer, 'telemetry', None)
+	return telemetry.Values() if telemetry is not None else None
+
+class ReopenWriters():
+	# Closes the writer and spawns a new ffmpeg on every new file
+	def __init__(self, cam_params, filenum=0):
+		self.cam_params = cam_params
+		self.filenum = filenum
+		self.writer = OpenWriter(cam_params, filenum)
+
+	def send(self, frame, *timestamp):
+		self.writer.send(frame, *timestamp)
+
+	def Telemetry(self):
+		return WriterTelemetry(self.writer)
+
+	def NewFile(self):
+		print('Closing+reopining video writer for camera {}. Please wait...'.format(self.cam_params["n_cam"]+1))
+		time.sleep(0.01)
+		self.writer.close()
+		self.filenum += 1
+		self.writer = OpenWriter(self.cam_params, self.filenum)
+
+	def close(self):
+		self.writer.close()
+
+class StandbyWriters():
+	# Keeps an initialized writer for the next file in standby, so that a new file
+	# is a pointer swap. Finished writers are closed on background threads.
+	def __init__(self, cam_params, filenum=0):
+		self.cam_params = cam_params
+		self.filenum = filenum
+		self.writer = OpenWriter(cam_params, filenum)
+		self.closing = []
+		self.StartStandby()
+
+	def StartStandby(self):
+		self.standby = None
+		self.standbyReady = threading.Event()
+		threading.Thread(
+			target=self.OpenStandby,
+			daemon=True,
+			args=(self.filenum+1,),
+			).start()
+
+	def OpenStandby(self, filenum):
+		try:
+			self.standby = OpenWriter(self.cam_params, filenum)
+		finally:
+			self.standbyReady.set()
+
+	def send(self, frame, *timestamp):
+		self.writer.send(frame, *timestamp)
+
+	def NewFile(self):
+		# The standby is normally ready long before the next trial starts
+		self.standbyReady.wait()
+		finished = self.writer
+		self.writer = self.standby
+		self.filenum += 1
+		self.CloseInBackground(finished)
+		self.StartStandby()
+
+	def Telemetry(self):
+		return WriterTelemetry(self.writer)
+
+	def CloseInBackground(self, writer):
+		thread = threading.Thread(target=writer.close)
+		thread.start()
+		self.closing.append(thread)
+
+	def close(self):
+		self.writer.close()
+		for thread in self.closing:
+			thread.join()
+
+		# Remove the unused standby file
+		self.standbyReady.wait()
+		if self.standby is not None:
+			self.standby.close()
+			_, full_file_name = WriterFileName(self.cam_params, self.filenum+1)
+			RemoveFiles([full_file_name, InfoFileName(full_file_name)])
+
+class SegmentWriters():
+	# One long-lived ffmpeg writes all trials. Frames are streamed as Matroska with
+	# trial k starting at timestamp k*trialOffset; ffmpeg forces a keyframe at each
+	# trial start and the segment muxer splits there, so trial k is written to its
+	# own <videoFilename>-t<k> file. A trial's file is finalized when the next trial
+	# starts or when recording stops. If the encoder settings change (adaptiveEncoding),
+	# ffmpeg is restarted at the next trial. If ffmpeg fails, the rest of the trial
+	# goes to <videoFilename>-t<k>-r<n> and a fresh ffmpeg takes the next trial.
+	def __init__(self, cam_params, filenum=0):
+		self.cam_params = cam_params
+		self.filenum = filenum
+		self.framenum = 0
+		self.restarts = 0
+		self.restarted = False
+		self.frameRate = cam_params["frameRate"]
+		self.trialOffset = int(cam_params["recTimeInSec"]) + 1 # sec, longer than any trial
+		self.Open()
+		SaveEncoderInfo(cam_params, WriterFileName(cam_params, self.filenum)[1], self.encoderParams[2])
+
+	def Open(self):
+		# Starts ffmpeg with the current trial as its first segment
+		cam_params = self.cam_params
+		self.firstFile = self.filenum
+		folder_name, file_pattern = WriterFileName(cam_params, FILENUM_TOKEN)
+		file_pattern = file_pattern.replace('%', '%%').replace(FILENUM_TOKEN, '%d')
+		if self.restarted:
+			file_pattern = RestartFileName(file_pattern, self.restarts)
+		if not os.path.isdir(folder_name):
+			os.makedirs(folder_name, exist_ok=True)
+			print('Made directory {}.'.format(folder_name))
+
+		# Same encoder settings as OpenWriter, with timestamps passed through
+		self.encoderParams = EncoderParams(cam_params)
+		codec, pix_fmt_out, gpu_params = self.encoderParams
+		output_params = PassTimestampParams(gpu_params, exact=cam_params["frameTimestamps"])
+
+		output_params += ['-force_key_frames', 'expr:gte(t,n_forced*{})'.format(self.trialOffset),
+				'-f', 'segment',
+				'-segment_time', str(self.trialOffset),
+				'-segment_start_number', str(self.filenum),
+				'-reset_timestamps', '1',]
+		output_params += SegmentFormatParams(cam_params)
+		print('Opened: {} segmenting writer for camera {}.'.format(file_pattern, cam_params["n_cam"]+1))
+		self.pipe = OpenPipeWriter(cam_params, file_pattern, codec, pix_fmt_out, output_params,
+								input_params=MATROSKA_INPUT)
+		self.pipe.write(mkv.StreamHeader(cam_params["frameWidth"], cam_params["frameHeight"],
+										cam_params["pixelFormatInput"], self.frameRate))
+
+	def send(self, frame, timestamp=None):
+		# Time in the trial: the camera timestamp since the trial's first frame (frameTimestamps),
+		# or the frame number at the nominal frame rate
+		if timestamp is None:
+			t = self.framenum/self.frameRate
+		else:
+			if self.framenum == 0:
+				self.trialStart = timestamp
+			t = timestamp - self.trialStart
+		trial = self.filenum - self.firstFile
+		try:
+			self.pipe.send(frame, mkv.FrameHeader(round(1e6*(trial*self.trialOffset + t)), frame.nbytes))
+		except EncoderError as err:
+			print('{} Restarting the segmenting writer.'.format(err))
+			self.pipe.close()
+			self.restarts += 1
+			self.restarted = True
+			self.Open()
+			self.pipe.send(frame, mkv.FrameHeader(round(1e6*t), frame.nbytes))
+		self.framenum += 1
+
+	def NewFile(self):
+		self.filenum += 1
+		self.framenum = 0
+		if self.restarted or EncoderParams(self.cam_params) != self.encoderParams:
+			self.pipe.close()
+			self.restarted = False
+			self.Open()
+		SaveEncoderInfo(self.cam_params, WriterFileName(self.cam_params, self.filenum)[1], self.encoderParams[2])
+
+	def Telemetry(self):
+		return self.pipe.telemetry.Values() if self.pipe.telemetry is not None else None
+
+	def close(self):
+		self.pipe.close()
+		# The segment muxer writes no file for a trial without frames
+		if self.framenum == 0:
+			RemoveFiles([InfoFileName(WriterFileName(self.cam_params, self.filenum)[1])])
+
+def RemoveFiles(file_names):
+	# Removes the files that exist
+	for file_name in file_names:
+		if os.path.isfile(file_name):
+			os.remove(file_name)
+
+class ParallelWriters():
+	# Splits each trial into contiguous blocks of encoderBlockFrames frames and hands
+	# block b to encoder b % numEncoders, so N ffmpeg processes encode in parallel.
+	# Each encoder forces a keyframe at the start of every block it receives and its
+	# segment muxer writes every block to a file of its own; when the trial ends, the
+	# blocks are concatenated in frame order (-c copy) into the trial's file.
+	# Frames are copied into preallocated block buffers (blocks are usually larger
+	# than the frame ring), numEncoders+1 of them, which bounds memory use.
+	# A failed encoder is restarted at the block it was writing. Its previous block,
+	# still open in the dead encoder's segment muxer, is then usually lost: the
+	# trial's blocks are not joined, and <video stem>.json records the lost frames.
+	def __init__(self, cam_params, filenum=0):
+		self.cam_params = cam_params
+		self.filenum = filenum
+		self.numEncoders = cam_params["numEncoders"]
+		self.blockFrames = cam_params["encoderBlockFrames"]
+		if self.blockFrames <= 0:
+			self.blockFrames = max(1, int(round(cam_params["frameRate"]/2)))
+		shape = (self.blockFrames,) + FrameShape(cam_params)
+		self.freeBlocks = queue.Queue()
+		for i in range(self.numEncoders+1):
+			self.freeBlocks.put(np.empty(shape, dtype='uint8'))
+		self.finishing = []
+		self.OpenTrial()
+
+	def OpenTrial(self):
+		folder_name, full_file_name = WriterFileName(self.cam_params, self.filenum)
+		if not os.path.isdir(folder_name):
+			os.makedirs(folder_name, exist_ok=True)
+			print('Made directory {}.'.format(folder_name))
+		self.full_file_name = full_file_name
+		self.block = self.freeBlocks.get()
+		self.blockUsed = 0
+		self.numBlocks = 0
+		self.numFrames = 0
+		self.listFiles = [] # segment lists of the trial's encoders, see OpenEncoder
+		SaveEncoderInfo(self.cam_params, full_file_name, EncoderParams(self.cam_params)[2])
+
+		# One ffmpeg per encoder, each fed by its own thread
+		self.encoders = []
+		for j in range(self.numEncoders):
+			pipe = self.OpenEncoder(full_file_name, j, 0, self.listFiles)
+			blocks = queue.Queue()
+			thread = threading.Thread(target=self.FeedEncoder, args=(pipe, blocks, full_file_name, j, self.listFiles),
+									daemon=True)
+			thread.start()
+			self.encoders.append((blocks, thread))
+		print('Opened: {} with {} parallel encoders for camera {}.'.format(
+			full_file_name, self.numEncoders, self.cam_params["n_cam"]+1))
+
+	def OpenEncoder(self, full_file_name, j, startNumber, listFiles):
+		# ffmpeg for encoder j of a trial. Its segments (blocks) are numbered from startNumber,
+		# and each completed segment is added to a segment list, which JoinBlocks checks.
+		codec, pix_fmt_out, gpu_params = EncoderParams(self.cam_params)
+		stem, ext = os.path.splitext(full_file_name)
+		blockSec = self.blockFrames/self.cam_params["frameRate"]
+		pattern = '{}-e{}-%d{}'.format(stem.replace('%', '%%'), j, ext)
+		list_file = '{}-e{}-{}.list'.format(stem, j, startNumber)
+		listFiles.append(list_file)
+		output_params = MacroBlockParams(self.cam_params) + gpu_params
+		output_params += ['-force_key_frames', 'expr:gte(n,n_forced*{})'.format(self.blockFrames),
+						'-f', 'segment',
+						'-segment_time', str(blockSec),
+						'-segment_time_delta', str(0.5/self.cam_params["frameRate"]),
+						'-segment_start_number', str(startNumber),
+						'-segment_list', list_file,
+						'-segment_list_type', 'flat',
+						'-reset_timestamps', '1',]
+		return OpenPipeWriter(self.cam_params, pattern, codec, pix_fmt_out, output_params)
+
+	def FeedEncoder(self, pipe, blocks, full_file_name, j, listFiles):
+		# If the encoder fails, a new one continues with the failed block, written again in
+		# full as the same segment number (up to MAX_RESTARTS times per encoder and trial)
+		restarts = 0
+		while True:
+			block, numFrames, b = blocks.get()
+			if block is None:
+				break
+			while True:
+				try:
+					pipe.write(block[:numFrames])
+					break
+				except OSError as err:
+					pipe.close()
+					if restarts >= MAX_RESTARTS:
+						print('Encoder {} for {} failed ({}); block {} is lost.'.format(j, full_file_name, err, b))
+						break
+					restarts += 1
+					print('Encoder {} for {} failed ({}), restarting it at block {}.'.format(j, full_file_name, err, b))
+					pipe = self.OpenEncoder(full_file_name, j, b // self.numEncoders, listFiles)
+			self.freeBlocks.put(block)
+		pipe.close()
+
+	def SendBlock(self):
+		if self.blockUsed == 0:
+			return
+		blocks, _ = self.encoders[self.numBlocks % self.numEncoders]
+		blocks.put((self.block, self.blockUsed, self.numBlocks))
+		self.numBlocks += 1
+		self.numFrames += self.blockUsed
+		self.block = self.freeBlocks.get() # waits while all encoders are busy
+		self.blockUsed = 0
+
+	def send(self, frame):
+		self.block[self.blockUsed] = frame.reshape(self.block.shape[1:])
+		self.blockUsed += 1
+		if self.blockUsed == self.blockFrames:
+			self.SendBlock()
+
+	def CloseTrial(self):
+		# Flushes the last block and joins the trial's blocks in the background
+		self.SendBlock()
+		self.freeBlocks.put(self.block)
+		for blocks, _ in self.encoders:
+			blocks.put((None, 0, -1))
+		thread = threading.Thread(target=self.JoinBlocks,
+								args=(self.encoders, self.full_file_name, self.numBlocks, self.numFrames,
+									self.listFiles))
+		thread.start()
+		self.finishing.append(thread)
+
+	def JoinBlocks(self, encoders, full_file_name, numBlocks, numFrames, listFiles):
+		for _, thread in encoders:
+			thread.join()
+		stem, ext = os.path.splitext(full_file_name)
+		# Block b is segment b // N of encoder b % N
+		block_files = ['{}-e{}-{}{}'.format(stem, b % self.numEncoders, b // self.numEncoders, ext)
+						for b in range(numBlocks)]
+
+		# Only blocks in a segment list were completed; a failed encoder may leave a
+		# truncated segment behind, or none at all
+		completed = set()
+		for list_file in listFiles:
+			if os.path.isfile(list_file):
+				with open(list_file) as f:
+					completed.update(line.strip() for line in f)
+		# Encoders that got no frames leave an empty file behind
+		for j in range(numBlocks, self.numEncoders):
+			if os.path.isfile('{}-e{}-0{}'.format(stem, j, ext)):
+				os.remove('{}-e{}-0{}'.format(stem, j, ext))
+
+		missing = [b for b in range(numBlocks) if os.path.basename(block_files[b]) not in completed]
+		if missing:
+			lostFrames = sum(min(self.blockFrames, numFrames - b*self.blockFrames) for b in missing)
+			print('Trial {} FAILED: {} of {} blocks ({} frames) were not encoded; '
+				'the other blocks are kept as {}-e*{}.'.format(full_file_name, len(missing), numBlocks,
+				lostFrames, stem, ext))
+			SaveTrialInfo(full_file_name, complete=False, lostFrames=lostFrames, lostBlocks=missing,
+						blockFrames=self.blockFrames)
+			return
+		if numBlocks == 0:
+			RemoveFiles(listFiles + [InfoFileName(full_file_name)])
+			return
+		elif numBlocks == 1:
+			os.replace(block_files[0], full_file_name)
+			RemoveFiles(listFiles)
+			return
+		list_file = stem + '-blocks.txt'
+		with open(list_file, 'w') as f:
+			for block_file in block_files:
+				f.write("file '{}'\n".format(os.path.abspath(block_file).replace("'", "'\\''")))
+		cmd = [get_ffmpeg_exe(), '-y', '-f', 'concat', '-safe', '0', '-i', list_file,
+				'-c', 'copy', '-v', self.cam_params["ffmpegLogLevel"]]
+		cmd += ContainerParams(self.cam_params) + [full_file_name]
+		if subprocess.run(cmd).returncode == 0:
+			RemoveFiles(block_files + listFiles + [list_file])
+		else:
+			print('Joining the blocks of {} failed; they are kept in {}.'.format(full_file_name, list_file))
+
+	def NewFile(self):
+		self.CloseTrial()
+		self.filenum += 1
+		self.OpenTrial()
+
+	def close(self):
+		self.CloseTrial()
+		for thread in self.finishing:
+			thread.join()
+
+def OpenWriters(cam_params, filenum=0):
+	# Writer for a series of files, one per trial, depending on fileRotation
+	if cam_params["writerBackend"] == "raw":
+		return ReopenWriters(cam_params, filenum) # opening a raw file costs nothing
+	elif cam_params["numEncoders"] > 1:
+		if cam_params["fileRotation"] != "reopen":
+			print('Camera {}: fileRotation {} is not supported with numEncoders > 1, '
+				'encoding each trial in parallel blocks instead.'.format(
+				cam_params["n_cam"]+1, cam_params["fileRotation"]))
+		return ParallelWriters(cam_params, filenum)
+	elif cam_params["fileRotation"] == "standby":
+		return StandbyWriters(cam_params, filenum)
+	elif cam_params["fileRotation"] == "segment":
+		return SegmentWriters(cam_params, filenum)
+	elif cam_params["fileRotation"] == "reopen":
+		return ReopenWriters(cam_params, filenum)
+	else:
+		raise ValueError('Unknown fileRotation {}.'.format(cam_params["fileRotation"]))
+
+def WriteFrames(cam_params, writeQueue, stopQueue, writer=None):
+	# writer: writers opened in advance (OpenWriters), e.g. by the daemon
 	n_cam = cam_params["n_cam"]
 
-	# if save mjultiple files, keep track of filenum
-	filenum = 0
+	# Optionally, spill frames to disk while the encoder lags behind
+	if cam_params["writerSpill"]:
+		writeQueue = SpillStage(cam_params, writeQueue)
 
-	# Start ffmpeg video writer 
-	writer = OpenWriter(cam_params, filenum)
+	# Optionally, encode the next file with cheaper settings while the writer falls behind
+	adapter = None
+	if cam_params["adaptiveEncoding"]:
+		adapter = EncoderAdapter(cam_params)
+
+	# Start ffmpeg video writer(s); keeps track of filenum if saving multiple files
+	if writer is None:
+		writer = OpenWriters(cam_params)
 	message = ''
 
+	# Optionally, encode every frame at its camera timestamp
+	useTimestamps = cam_params["frameTimestamps"]
+	if useTimestamps and (cam_params["writerBackend"] == "raw" or cam_params["numEncoders"] > 1):
+		print('Camera {}: frameTimestamps is not supported with raw files or numEncoders > 1, '
+			'writing at a constant frame rate.'.format(n_cam+1))
+		useTimestamps = False
+
 	# Continue writing...
 	while(True):
 		try:
-			if writeQueue:
-				message = writeQueue.popleft()
-				if not isinstance(message, str):
-					# print("[WriteFrames] saving")
+			# Block until the grabber appends a frame or message
+			message = writeQueue.get(timeout=QUEUE_TIMEOUT)
+			if message is None:
+				continue
+			if not isinstance(message, str):
+				# print("[WriteFrames] saving")
+				if useTimestamps:
+					writer.send(message, writeQueue.timestamp)
+				else:
 					writer.send(message)
-				elif message=='STOP':
-					print("STOP (done saving)")
-					break
-				elif message == 'NEWFILE':
-					# close file, reopen a new file.
-					print('Closing+reopining video writer for camera {}. Please wait...'.format(n_cam+1))
-					time.sleep(0.01)
-					writer.close()
-					filenum += 1
-					writer = OpenWriter(cam_params, filenum)
-			else:
-				time.sleep(0.0001)
+				if adapter is not None:
+					adapter.Sample(len(writeQueue))
+			elif message=='STOP':
+				print("STOP (done saving)")
+				break
+			elif message == 'NEWFILE':
+				# close file, start a new file.
+				if adapter is not None:
+					adapter.NewFile(writer.filenum+1)
+				writer.NewFile()
 		except KeyboardInterrupt:
 			print("Keyboard Interrupt writing")
 			stopQueue.append('STOP GRABBING')
 
 	# Closing up...
 	print('Closing video writer for camera {}. Please wait...'.format(n_cam+1))
+	if hasattr(writer, 'Telemetry') and writer.Telemetry() is not None:
+		print('Camera {} encoder: {}'.format(n_cam+1, writer.Telemetry()))
 	time.sleep(1)
 	writer.close()
+	if cam_params["writerSpill"]:
+		writeQueue.Close()
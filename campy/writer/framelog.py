@@ -0,0 +1,163 @@
+"""
+Streaming log of per-frame grab data.
+
+The grabbers used to collect frame numbers and timestamps in Python lists that
+were saved (frametimes.npy) only when a trial or the recording ended, so a crash
+lost all timing, and a long session held millions of boxed numbers. FrameLog is
+a growable, typed, structured array (RECORD): one 40-byte record per frame with
+
+	frameNumber 			frames since recording onset (first frame = 1)
+	frameNumberThisTrial 	frames since the trial (file) started
+	queueDepth 				frames waiting for the writer after this one was queued
+	timeStamp 				camera timestamp (sec since the first frame)
+	hostTimeStamp 			host clock when the frame was grabbed (time.time())
+	frameID 				the camera's own frame/block ID, -1 if unknown
+
+The array is a preallocated, memory-mapped file in the camera folder,
+frametimes<suffix>.log, sized for recTimeInSec*frameRate frames; a longer
+recording grows it by CHUNK_FRAMES records at a time. Records are packed straight
+into the map (struct.pack_into), so appending a frame keeps no Python objects
+alive; Records() is a numpy view of the same memory. A record takes about 4x
+less memory than the same six fields in Python lists. An Append costs somewhat
+more than the six list appends, and about as much as assigning the fields of a
+preallocated numpy array (campy.bench.grabdata).
+
+Every frameLogFlushFrames frames the record count in the header is updated.
+Records up to that count are complete and can be read by another process while
+recording (ReadFrameLog). The mapped pages belong to the kernel, so a crash of
+campy loses at most the records since the last update; Flush() also syncs the
+file to disk.
+
+frametimes<suffix>.npy is produced from the log (FrameTimes) when the trial is
+saved, and campy-recover rebuilds it from a log left behind by a crash.
+"""
+
+import os
+import mmap
+import struct
+import numpy as np
+
+MAGIC = b'CAMPYLOG'
+VERSION = 2
+HEADER_BYTES = 64
+CHUNK_FRAMES = 1 << 16 # records added each time the file grows
+RECORD = np.dtype([('frameNumber', '<i8'),
+				('frameNumberThisTrial', '<i4'),
+				('queueDepth', '<i4'),
+				('timeStamp', '<f8'),
+				('hostTimeStamp', '<f8'),
+				('frameID', '<i8')])
+PACK_RECORD = struct.Struct('<qiiddq') # same layout as RECORD
+RECORD_BYTES = RECORD.itemsize
+
+# Header: magic, version, record size, committed records
+HEADER = struct.Struct('<8sqqq')
+PACK_COUNT = struct.Struct('<q')
+COUNT_OFFSET = 24
+
+def FrameLogName(cam_params, suffix=""):
+	folder_name = os.path.join(cam_params["videoFolder"], cam_params["cameraName"])
+	return os.path.join(folder_name, "frametimes{}.log".format(suffix))
+
+def FrameTimes(records):
+	# frametimes.npy layout: row 0 frame numbers, row 1 timestamps
+	return np.array([records['frameNumber'], records['timeStamp']])
+
+class FrameLog():
+	def __init__(self, path, flushFrames=100, numFrames=0):
+		self.path = path
+		self.flushFrames = max(1, int(flushFrames))
+		self.count = 0
+		self.countAt = self.flushFrames # record count at which the header is updated next
+		self.offset = HEADER_BYTES # of the next record
+		self.end = HEADER_BYTES # of the mapped file
+		self.closed = False
+
+		folder_name = os.path.dirname(path)
+		if folder_name and not os.path.isdir(folder_name):
+			os.makedirs(folder_name, exist_ok=True)
+		self.f = open(path, 'w+b')
+		self.f.write(HEADER.pack(MAGIC, VERSION, RECORD.itemsize, 0).ljust(HEADER_BYTES, b'\0'))
+		self.f.flush()
+		self._Grow(max(int(numFrames), CHUNK_FRAMES))
+
+	def _Grow(self, numRecords=CHUNK_FRAMES):
+		# Extends the file (sparse until written) and maps it again. The previous map
+		# stays valid for views handed out by Records() until they are released.
+		# Windows cannot resize a mapped file, but extends it to the size of a new map.
+		self.end += numRecords*RECORD_BYTES
+		if os.name != 'nt':
+			self.f.truncate(self.end)
+		self.mm = mmap.mmap(self.f.fileno(), self.end)
+
+	def __len__(self):
+		return self.count
+
+	def Append(self, frameNumber, timeStamp, frameNumberThisTrial=0, hostTimeStamp=np.nan, frameID=-1,
+				queueDepth=-1):
+		# Called once per frame by the grab loop: one pack_into, no allocations
+		offset = self.offset
+		if offset == self.end:
+			self._Grow()
+		PACK_RECORD.pack_into(self.mm, offset, frameNumber, frameNumberThisTrial, queueDepth,
+							timeStamp, hostTimeStamp, frameID)
+		self.offset = offset + RECORD_BYTES
+		self.count += 1
+		if self.count == self.countAt:
+			self.countAt += self.flushFrames
+			PACK_COUNT.pack_into(self.mm, COUNT_OFFSET, self.count)
+
+	def Records(self):
+		# View of all records written so far
+		return np.ndarray((self.count,), dtype=RECORD, buffer=self.mm, offset=HEADER_BYTES)
+
+	def Last(self):
+		# Most recent record, or None
+		if self.count == 0:
+			return None
+		return self.Records()[-1]
+
+	def FrameTimes(self):
+		return FrameTimes(self.Records())
+
+	def Flush(self):
+		if self.closed:
+			return
+		PACK_COUNT.pack_into(self.mm, COUNT_OFFSET, self.count)
+		self.mm.flush()
+
+	def Close(self):
+		if self.closed:
+			return
+		self.Flush()
+		self.closed = True
+		# The map stays readable (Records, Last) until the log is garbage collected
+		try:
+			self.f.truncate(self.offset)
+		except OSError:
+			pass # still mapped (Windows)
+		self.f.close()
+
+def OpenFrameLog(cam_params, suffix=""):
+	# Preallocated for the whole recording, so the log normally never grows
+	return FrameLog(FrameLogName(cam_params, suffix), cam_params["frameLogFlushFrames"],
+					numFrames=cam_params["recTimeInSec"]*cam_params["frameRate"])
+
+def ReadFrameLog(path):
+	# Copy of the complete records of a log, also while it is being written
+	with open(path, 'rb') as f:
+		magic, version, recordBytes, count = HEADER.unpack(f.read(HEADER.size))
+	if magic != MAGIC or recordBytes != RECORD.itemsize:
+		raise ValueError('{} is not a campy frame log.'.format(path))
+	return np.fromfile(path, dtype=RECORD, count=count, offset=HEADER_BYTES)
+
+def ReadLastRecord(path):
+	# Last complete record of a log (one read, also while it is being written), or None
+	with open(path, 'rb') as f:
+		magic, version, recordBytes, count = HEADER.unpack(f.read(HEADER.size))
+		if magic != MAGIC or recordBytes != RECORD.itemsize:
+			raise ValueError('{} is not a campy frame log.'.format(path))
+		if count == 0:
+			return None
+		f.seek(HEADER_BYTES + (count - 1)*RECORD_BYTES)
+		return np.frombuffer(f.read(RECORD_BYTES), dtype=RECORD)[0]
@@ -0,0 +1,81 @@
+"""
+Minimal Matroska muxer for streaming raw frames into ffmpeg's stdin.
+
+Unlike '-f rawvideo', a Matroska stream carries a presentation timestamp for
+every frame, which lets campy place frames freely on the time axis (trial
+offsets for the segmenting writer, camera timestamps for VFR output).
+Frames are stored uncompressed ('V_UNCOMPRESSED' + pixel format fourcc), one
+cluster per frame. Headers are built here; frame data is written by the caller
+straight from the frame buffer, without copying.
+"""
+
+import struct
+
+# Raw pixel format fourccs understood by ffmpeg (libavcodec/raw.c)
+FOURCC = {"gray": b'Y800',
+		"bayer_bggr8": b'\xbaBG\x08',
+		"bayer_rggb8": b'\xbaRG\x08',
+		"bayer_gbrg8": b'\xbaGB\x08',
+		"bayer_grbg8": b'\xbaGR\x08',
+		"rgb24": b'RGB\x18',
+		"bgr24": b'BGR\x18',
+		"bgr8": b'BGR\x08',
+		"rgb0": b'RGB\x00',
+		"bgr0": b'BGR\x00',
+		"rgba": b'RGBA',
+		"bgra": b'BGRA',}
+
+TIMESTAMP_SCALE = 1000 # ns per timestamp tick, i.e. timestamps are in microseconds
+UNKNOWN_SIZE = b'\x01\xff\xff\xff\xff\xff\xff\xff'
+
+def Size(n):
+	# EBML variable-length size
+	length = 1
+	while n >= (1 << (7*length)) - 1:
+		length += 1
+	return ((1 << (7*length)) | n).to_bytes(length, 'big')
+
+def Element(id, data):
+	return id + Size(len(data)) + data
+
+def UInt(id, value):
+	value = int(value)
+	return Element(id, value.to_bytes(max(1, (value.bit_length()+7)//8), 'big'))
+
+def StreamHeader(width, height, pixelFormat, frameRate):
+	# EBML header, segment of unknown size, segment info and the video track
+	ebml = Element(b'\x1a\x45\xdf\xa3',
+				UInt(b'\x42\x86', 1) + 			# EBMLVersion
+				UInt(b'\x42\xf7', 1) + 			# EBMLReadVersion
+				UInt(b'\x42\xf2', 4) + 			# EBMLMaxIDLength
+				UInt(b'\x42\xf3', 8) + 			# EBMLMaxSizeLength
+				Element(b'\x42\x82', b'matroska') +
+				UInt(b'\x42\x87', 4) + 			# DocTypeVersion
+				UInt(b'\x42\x85', 2)) 			# DocTypeReadVersion
+	segment = b'\x18\x53\x80\x67' + UNKNOWN_SIZE
+	info = Element(b'\x15\x49\xa9\x66',
+				UInt(b'\x2a\xd7\xb1', TIMESTAMP_SCALE) +
+				Element(b'\x4d\x80', b'campy') + 	# MuxingApp
+				Element(b'\x57\x41', b'campy')) 	# WritingApp
+	video = Element(b'\xe0',
+				UInt(b'\xb0', width) +
+				UInt(b'\xba', height) +
+				Element(b'\x2e\xb5\x24', FOURCC[pixelFormat])) # ColourSpace
+	track = Element(b'\xae',
+				UInt(b'\xd7', 1) + 				# TrackNumber
+				UInt(b'\x73\xc5', 1) + 			# TrackUID
+				UInt(b'\x83', 1) + 				# TrackType: video
+				Element(b'\x86', b'V_UNCOMPRESSED') +
+				UInt(b'\x23\xe3\x83', round(1e9/frameRate)) + # DefaultDuration (ns), keeps the last frame
+				video)
+	tracks = Element(b'\x16\x54\xae\x6b', track)
+	return ebml + segment + info + tracks
+
+def FrameHeader(timestamp, nbytes):
+	# Cluster holding a single keyframe SimpleBlock; frame data (nbytes) follows.
+	# timestamp is in microseconds.
+	block = b'\x81' + struct.pack('>hB', 0, 0x80) # track 1, relative timestamp 0, keyframe
+	blockHeader = b'\xa3' + Size(len(block) + nbytes) + block
+	clusterTimestamp = UInt(b'\xe7', timestamp)
+	payload = len(clusterTimestamp) + len(blockHeader) + nbytes
+	return b'\x1f\x43\xb6\x75' + Size(payload) + clusterTimestamp + blockHeader
@@ -0,0 +1,206 @@
+"""
+ffmpeg writer that manages its own subprocess (writerBackend 'pipe').
+
+imageio_ffmpeg.write_frames wraps the ffmpeg pipe in a generator: every frame goes
+through send(), a few type checks and a conversion to bytes before it reaches the
+pipe. PipeWriter writes the frame buffer itself (a memoryview of the numpy array,
+no copy) to an unbuffered pipe. With writerBatchFrames > 1, frames are copied into
+a preallocated batch buffer and written to the pipe once per batch. This saves
+syscalls for small frames; for large frames the extra copy costs more than it saves.
+The pipe itself is enlarged (Linux) so that ffmpeg can take whole frames per read.
+
+PipeWriter has the same send()/close() interface as the imageio writer, so the
+writer series classes in campipe can use either backend. With encoderTelemetry,
+ffmpeg's progress is parsed and a watchdog detects a dead or stalled encoder
+(telemetry.py); with restart=True, PipeWriter then starts a new ffmpeg that
+continues in <name>-r<k>.<ext> instead of failing.
+"""
+
+import os
+import time
+import subprocess
+import numpy as np
+from imageio_ffmpeg import get_ffmpeg_exe
+from campy.writer.buffers import FrameShape
+from campy.writer.telemetry import EncoderTelemetry
+
+PIPE_SIZE = 1 << 20 # bytes; Linux default pipes hold only 64 kB
+MAX_RESTARTS = 10 # per writer
+
+def SetPipeSize(pipe, size):
+	# Larger pipes let ffmpeg take a whole frame per read, with fewer context switches
+	try:
+		import fcntl
+		fcntl.fcntl(pipe.fileno(), getattr(fcntl, 'F_SETPIPE_SZ', 1031), size)
+	except (ImportError, OSError):
+		pass
+
+class EncoderError(OSError):
+	# The ffmpeg process behind a PipeWriter failed and was not restarted
+	pass
+
+def RestartFileName(full_file_name, restarts):
+	# <name>.mp4 -> <name>-r<restarts>.mp4
+	stem, ext = os.path.splitext(full_file_name)
+	return '{}-r{}{}'.format(stem, restarts, ext)
+
+class PipeWriter():
+	def __init__(self, cmd, batchBytes=0, telemetry=False, stallTimeout=0, restart=False):
+		self.cmd = cmd
+		self.full_file_name = cmd[-1]
+		self.useTelemetry = telemetry
+		self.stallTimeout = stallTimeout
+		self.restartOnError = restart
+		self.restarts = 0
+		self.preamble = b'' # written again at the start of a restarted encoder
+		self.telemetry = None
+
+		# Preallocated batch buffer
+		self.batch = memoryview(bytearray(batchBytes))
+		self.batchUsed = 0
+		self.Start()
+
+	def Start(self):
+		if self.useTelemetry:
+			cmd = self.cmd[:-1] + ['-nostats', '-progress', 'pipe:1', self.cmd[-1]]
+			self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, bufsize=0)
+		else:
+			self.proc = subprocess.Popen(self.cmd, stdin=subprocess.PIPE, bufsize=0)
+		self.pipe = self.proc.stdin
+		SetPipeSize(self.pipe, PIPE_SIZE)
+		self.blockedSince = None
+		if self.useTelemetry:
+			self.telemetry = EncoderTelemetry(self.proc, self, self.stallTimeout)
+
+	def Recover(self, err):
+		# Restarts a failed encoder into a new file, or raises EncoderError
+		if not self.restartOnError or self.restarts >= MAX_RESTARTS:
+			raise EncoderError('ffmpeg encoder for {} failed: {}'.format(self.cmd[-1], err))
+		self.proc.kill()
+		self.proc.wait()
+		if self.telemetry is not None:
+			self.telemetry.Stop()
+		self.restarts += 1
+		full_file_name = RestartFileName(self.full_file_name, self.restarts)
+		print('Encoder for {} failed ({}), continuing in {}.'.format(self.cmd[-1], err, full_file_name))
+		self.cmd = self.cmd[:-1] + [full_file_name]
+		self.Start()
+
+	def SetPreamble(self, preamble):
+		# Writes the container header that every (restarted) encoder starts with
+		self.preamble = b''
+		self._Write(preamble)
+		self.preamble = preamble
+
+	def _Write(self, *buffers):
+		# Writes the buffers completely, in one writev if there are several. Unbuffered pipes
+		# may accept part of a write; if the encoder fails meanwhile, it is restarted and the
+		# buffers are written again from the start, after the preamble, so the new file
+		# begins with whole frames. Recover raises EncoderError after MAX_RESTARTS.
+		pending = buffers
+		while True:
+			self.blockedSince = time.perf_counter()
+			try:
+				n = 0
+				if len(pending) > 1 and hasattr(os, 'writev'): # no writev on Windows
+					n = os.writev(self.pipe.fileno(), pending)
+				for data in pending:
+					if n >= len(data):
+						n -= len(data)
+						continue
+					data = memoryview(data)
+					while n < len(data):
+						n += self.pipe.write(data[n:])
+					n = 0
+				break
+			except (OSError, ValueError) as err:
+				# Broken pipe: the encoder has exited (or was stopped by the watchdog)
+				self.blockedSince = None
+				self.Recover(err)
+				pending = ((self.preamble,) if self.preamble else ()) + buffers
+		self.blockedSince = None
+
+	def write(self, data):
+		# Writes raw bytes or any contiguous buffer, batched if a batch buffer is set
+		data = memoryview(data).cast('B')
+		nbytes = len(data)
+		if self.batchUsed + nbytes > len(self.batch):
+			self.flush()
+		if nbytes >= len(self.batch):
+			self._Write(data)
+		else:
+			self.batch[self.batchUsed:self.batchUsed+nbytes] = data
+			self.batchUsed += nbytes
+
+	def send(self, frame, header=b''):
+		# Writes a frame, optionally preceded by a (container) header. Header and frame
+		# always go to the same encoder: together in one batch, or in one _Write
+		if not frame.flags.c_contiguous:
+			frame = np.ascontiguousarray(frame)
+		data = memoryview(frame).cast('B')
+		nbytes = len(header) + len(data)
+		if self.batchUsed + nbytes > len(self.batch):
+			self.flush()
+		if nbytes >= len(self.batch):
+			self._Write(*((header, data) if header else (data,)))
+		else:
+			if header:
+				self.write(header)
+			self.write(data)
+
+	def flush(self):
+		if self.batchUsed:
+			self._Write(self.batch[:self.batchUsed])
+			self.batchUsed = 0
+
+	def close(self):
+		try:
+			self.flush()
+			self.pipe.close()
+		except (EncoderError, BrokenPipeError):
+			pass
+		returncode = self.proc.wait()
+		if self.telemetry is not None:
+			self.telemetry.Stop()
+		if returncode != 0:
+			print('ffmpeg exited with code {}: {}'.format(returncode, ' '.join(self.cmd)))
+		return returncode
+
+def RawInputParams(cam_params):
+	# ffmpeg input options for raw frames of this camera stream on stdin
+	return ['-f', 'rawvideo', '-vcodec', 'rawvideo',
+			'-s', '{}x{}'.format(cam_params["frameWidth"], cam_params["frameHeight"]),
+			'-pix_fmt', cam_params["pixelFormatInput"],
+			'-r', '{:.02f}'.format(cam_params["frameRate"]),
+			'-i', '-', '-an']
+
+def MacroBlockParams(cam_params, macro_block_size=16):
+	# Pads the output size to whole macro blocks, as imageio_ffmpeg does
+	w, h = int(cam_params["frameWidth"]), int(cam_params["frameHeight"])
+	if w % macro_block_size == 0 and h % macro_block_size == 0:
+		return []
+	w += -w % macro_block_size
+	h += -h % macro_block_size
+	return ['-vf', 'scale={}:{}'.format(w, h)]
+
+def OpenPipeWriter(cam_params, full_file_name, codec, pix_fmt_out, output_params, input_params=None,
+					restart=False):
+	# Same command line as imageio_ffmpeg.write_frames, without the generator in between
+	if input_params is None:
+		input_params = RawInputParams(cam_params)
+	cmd = [get_ffmpeg_exe(), '-y'] + input_params
+	cmd += ['-vcodec', codec, '-pix_fmt', pix_fmt_out]
+	cmd += ['-v', cam_params["ffmpegLogLevel"]]
+	cmd += output_params
+	cmd.append(full_file_name)
+
+	return PipeWriter(cmd, BatchBytes(cam_params),
+					telemetry=cam_params.get("encoderTelemetry", False),
+					stallTimeout=cam_params.get("encoderStallTimeout", 0) if restart else 0,
+					restart=restart)
+
+def BatchBytes(cam_params):
+	# Batch buffer size for writerBatchFrames frames, 0 = write every frame directly
+	if cam_params["writerBatchFrames"] <= 1:
+		return 0
+	return int(cam_params["writerBatchFrames"]*np.prod(FrameShape(cam_params)))
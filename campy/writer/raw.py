@@ -0,0 +1,97 @@
+"""
+Raw frame files (writerBackend 'raw').
+
+For short high-speed bursts the writer can skip real-time compression and dump
+frames as they arrive (raw Bayer frames stay Bayer) to <videoFilename>-t<k>.raw.npy
+in the camera folder, next to frametimes.npy. The file is a standard .npy array of
+shape (frames, height, width[, channels]) that np.load(..., mmap_mode='r') maps
+without reading it. The header has a fixed size and is rewritten with the frame
+count when the file is closed; OpenRaw also works on files that were never closed,
+by counting whole frames from the file size.
+
+On close, the camera parameters needed to encode the file later (pixel formats,
+frame rate, codec, quality, ...) are saved to <videoFilename>-t<k>.raw.json. The
+sidecar marks the raw file as complete for the transcoder (see transcode.py).
+"""
+
+import os
+import ast
+import json
+import numpy as np
+from campy.writer.buffers import FrameShape
+
+RAW_EXT = ".raw.npy"
+SIDECAR_EXT = ".raw.json"
+HEADER_BYTES = 256 # fixed .npy header size, keeps frames 64-byte aligned
+MAGIC = b'\x93NUMPY\x01\x00'
+
+# Parameters saved with each raw file, for encoding it later
+SIDECAR_KEYS = ("cameraName", "n_cam", "frameWidth", "frameHeight", "frameRate",
+				"pixelFormatInput", "pixelFormatOutput", "codec", "quality", "gpuID",
+				"gpuMake", "encoderPreset", "ffmpegLogLevel", "rawKeep", "outputContainer",
+				"fragmentDuration")
+
+def RawFileName(full_file_name):
+	# <name>-t<k>.mp4 -> <name>-t<k>.raw.npy
+	return os.path.splitext(full_file_name)[0] + RAW_EXT
+
+def NpyHeader(numFrames, shape, dtype='uint8'):
+	# .npy version 1.0 header padded to HEADER_BYTES
+	header = "{{'descr': '{}', 'fortran_order': False, 'shape': {}, }}".format(
+		np.dtype(dtype).str, repr((int(numFrames),) + tuple(shape)))
+	header = header.ljust(HEADER_BYTES - len(MAGIC) - 2 - 1) + '\n'
+	if len(header) + len(MAGIC) + 2 != HEADER_BYTES:
+		raise ValueError('Frame shape {} does not fit the raw file header.'.format(shape))
+	return MAGIC + len(header).to_bytes(2, 'little') + header.encode('latin1')
+
+class RawWriter():
+	# Same send()/close() interface as the ffmpeg writers
+	def __init__(self, cam_params, full_file_name):
+		# full_file_name is the video file the frames are meant for
+		self.cam_params = cam_params
+		self.videoExt = os.path.splitext(full_file_name)[1]
+		self.full_file_name = RawFileName(full_file_name)
+		self.shape = FrameShape(cam_params)
+		self.frameBytes = int(np.prod(self.shape))
+		self.numFrames = 0
+		self.f = open(self.full_file_name, 'wb', buffering=0)
+		self.f.write(NpyHeader(0, self.shape))
+
+	def send(self, frame):
+		if frame.size != self.frameBytes:
+			raise ValueError('Frame of shape {} does not match raw file frames of shape {}.'.format(
+				frame.shape, self.shape))
+		if not frame.flags.c_contiguous:
+			frame = np.ascontiguousarray(frame)
+		data = memoryview(frame).cast('B')
+		n = self.f.write(data)
+		while n < len(data):
+			n += self.f.write(data[n:])
+		self.numFrames += 1
+
+	def close(self):
+		self.f.seek(0)
+		self.f.write(NpyHeader(self.numFrames, self.shape))
+		self.f.close()
+
+		sidecar = {key: self.cam_params[key] for key in SIDECAR_KEYS if key in self.cam_params}
+		sidecar["numFrames"] = self.numFrames
+		sidecar["videoExt"] = self.videoExt
+		with open(self.full_file_name[:-len(RAW_EXT)] + SIDECAR_EXT, 'w') as f:
+			json.dump(sidecar, f, indent=1)
+
+def OpenRaw(raw_file_name):
+	# Memory-maps a raw file; the frame count comes from the file size
+	with open(raw_file_name, 'rb') as f:
+		header = f.read(HEADER_BYTES)
+	if header[:len(MAGIC)] != MAGIC:
+		raise ValueError('{} is not a campy raw file.'.format(raw_file_name))
+	info = ast.literal_eval(header[len(MAGIC)+2:].decode('latin1').strip())
+	shape = info['shape'][1:]
+	dtype = np.dtype(info['descr'])
+	frameBytes = int(np.prod(shape))*dtype.itemsize
+	numFrames = (os.path.getsize(raw_file_name) - HEADER_BYTES)//frameBytes
+	if numFrames == 0:
+		return np.zeros((0,) + tuple(shape), dtype=dtype)
+	return np.memmap(raw_file_name, dtype=dtype, mode='r', offset=HEADER_BYTES,
+					shape=(numFrames,) + tuple(shape))
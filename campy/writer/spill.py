@@ -0,0 +1,224 @@
+"""
+Disk spill buffer for frames the writer cannot take yet.
+
+SpillBuffer is a first-in, first-out queue of frames in a memory-mapped scratch
+file. Frames are copied into the map and read back as views of it, so the kernel
+decides when pages go to disk. Put the file on fast local storage (spillFolder).
+The read/write counters live in the file header, so a producer and a consumer in
+different processes can share one spill file.
+
+SpillStage is the writer-side pipeline stage: grabber -> RAM ring -> mmap spill
+-> ffmpeg. A thread takes every entry off the frame ring as soon as it arrives.
+While the encoder keeps up, frames stay in their ring slots and are handed to the
+encoder as they are. Once more than writerSpillThreshold frames wait in the ring,
+new frames are copied to the spill file and their slots go straight back to the
+grabber. The encoder drains ring and spill frames in their original order, each
+with its timestamp (.timestamp after get, as with FrameRing).
+"""
+
+import os
+import csv
+import time
+import threading
+import numpy as np
+from collections import deque
+
+SPILLED = -100 # frame ring entry for a frame held in a SpillBuffer
+
+# Header layout (int64 counters)
+HEAD = 0 	# frames written
+READ = 1 	# frames handed out to the reader
+TAIL = 2 	# frames released by the reader
+HEADER_BYTES = 64
+
+def SpillFileName(cam_params, suffix=""):
+	folder_name = cam_params["spillFolder"]
+	if not folder_name:
+		folder_name = os.path.join(cam_params["videoFolder"], cam_params["cameraName"])
+	return os.path.join(folder_name, "spill{}.raw".format(suffix))
+
+class SpillBuffer():
+	def __init__(self, path, numFrames, shape, dtype='uint8', create=True):
+		self.path = path
+		self.numFrames = int(numFrames)
+		self.shape = tuple(shape)
+		self.dtype = np.dtype(dtype)
+		self.owner = create
+
+		if create:
+			folder_name = os.path.dirname(path)
+			if folder_name and not os.path.isdir(folder_name):
+				os.makedirs(folder_name, exist_ok=True)
+			frameBytes = int(np.prod(self.shape))*self.dtype.itemsize
+			with open(path, 'wb') as f:
+				f.truncate(HEADER_BYTES + self.numFrames*frameBytes) # sparse until written
+		self.header = np.memmap(path, dtype=np.int64, mode='r+', shape=(HEADER_BYTES//8,))
+		self.frames = np.memmap(path, dtype=self.dtype, mode='r+', offset=HEADER_BYTES,
+								shape=(self.numFrames,) + self.shape)
+		if create:
+			self.header[:] = 0
+
+	def __getstate__(self):
+		return {"path": self.path, "numFrames": self.numFrames, "shape": self.shape,
+				"dtype": self.dtype.str, "create": False}
+
+	def __setstate__(self, state):
+		self.__init__(**state)
+
+	def __len__(self):
+		# Frames written but not read yet
+		return int(self.header[HEAD] - self.header[READ])
+
+	def Full(self):
+		return self.header[HEAD] - self.header[TAIL] >= self.numFrames
+
+	def Put(self, frame):
+		# Caller checks Full() first
+		np.copyto(self.frames[self.header[HEAD] % self.numFrames], frame.reshape(self.shape))
+		self.header[HEAD] += 1
+
+	def Get(self):
+		# View of the oldest unread frame, valid until it is released
+		frame = self.frames[self.header[READ] % self.numFrames]
+		self.header[READ] += 1
+		return frame
+
+	def Release(self):
+		# Frames are released in the order they were read
+		self.header[TAIL] += 1
+
+	def Close(self):
+		self.header = self.frames = None
+		if self.owner:
+			try:
+				os.remove(self.path)
+			except OSError:
+				pass
+
+class SpillStage():
+	def __init__(self, cam_params, ring):
+		self.cam_params = cam_params
+		self.ring = ring
+		self.spill = SpillBuffer(SpillFileName(cam_params, "-writer"),
+								cam_params["spillBufferSize"], ring.shape, ring.dtype)
+		self.threshold = cam_params["writerSpillThreshold"]
+		if self.threshold <= 0:
+			self.threshold = max(1, ring.numSlots//2)
+
+		self.pending = deque() # (item, slot, timestamp) in grab order; slot is None for spilled frames and messages
+		self.cond = threading.Condition()
+		self.inRing = 0 # frames waiting for the encoder in ring slots
+		self.held = None
+		self.timestamp = None
+
+		# Metrics
+		self.spilled = 0
+		self.drained = 0
+		self.maxDepth = 0
+		self.samples = []
+
+		self.thread = threading.Thread(target=self.Run, daemon=True)
+		self.thread.start()
+
+	def Run(self):
+		timeStart = lastSample = time.perf_counter()
+		lastDrained = 0
+		while True:
+			item, slot = self.ring.GetEntry(timeout=0.5)
+			timestamp = self.ring.timestamp
+			if item is not None:
+				if isinstance(item, str):
+					self.Push(item, None, None)
+				else:
+					with self.cond:
+						# Frames the grabber already spilled are read back in order, never copied again
+						passThrough = slot == SPILLED or self.inRing < self.threshold
+						if passThrough and slot != SPILLED:
+							self.inRing += 1
+						else:
+							# Wait for the encoder to make room in the spill file
+							self.cond.wait_for(lambda: not self.spill.Full())
+					if passThrough:
+						self.Push(item, slot, timestamp)
+					else:
+						self.spill.Put(item)
+						self.ring.ReleaseSlot(slot)
+						self.spilled += 1
+						self.Push(None, None, timestamp)
+
+			# Sample spill depth and drain rate once per second
+			now = time.perf_counter()
+			if now - lastSample >= 1:
+				depth = len(self.spill)
+				drainRate = (self.drained - lastDrained)/(now - lastSample)
+				self.samples.append((round(now - timeStart, 3), depth, self.spilled, self.drained,
+									round(drainRate, 1)))
+				if depth > 0:
+					print('Camera {} spill depth {} frames, draining at {:.0f} fps.'.format(
+						self.cam_params["n_cam"]+1, depth, drainRate))
+				lastSample, lastDrained = now, self.drained
+
+			if isinstance(item, str) and item == 'STOP':
+				break
+
+	def __len__(self):
+		# Entries waiting for the encoder, in RAM or spilled
+		return len(self.pending)
+
+	def Push(self, item, slot, timestamp):
+		with self.cond:
+			self.pending.append((item, slot, timestamp))
+			self.maxDepth = max(self.maxDepth, len(self.spill))
+			self.cond.notify_all()
+
+	def Release(self):
+		# Return the frame handed out by the last get to the ring or the spill file
+		if self.held is None:
+			return
+		source, slot = self.held
+		self.held = None
+		if source == 'spill':
+			self.spill.Release()
+		else:
+			self.ring.ReleaseSlot(slot)
+		with self.cond:
+			if source == 'ring' and slot != SPILLED:
+				self.inRing -= 1
+			self.cond.notify_all()
+
+	def get(self, timeout=None):
+		# Same interface as FrameRing.get
+		self.Release()
+		with self.cond:
+			if not self.cond.wait_for(lambda: self.pending, timeout):
+				return None
+			item, slot, self.timestamp = self.pending.popleft()
+		if item is None:
+			self.held = ('spill', None)
+			self.drained += 1
+			return self.spill.Get()
+		elif slot is not None:
+			self.held = ('ring', slot)
+		return item
+
+	def Metrics(self):
+		return {"spillDepth": len(self.spill),
+				"spillMaxDepth": self.maxDepth,
+				"spilledFrames": self.spilled,
+				"drainedFrames": self.drained,}
+
+	def Close(self):
+		self.Release()
+		self.thread.join(timeout=1)
+		print('Camera {} writer spill: {}'.format(self.cam_params["n_cam"]+1, self.Metrics()))
+
+		# Spill depth and drain rate over the recording
+		folder_name = os.path.join(self.cam_params["videoFolder"], self.cam_params["cameraName"])
+		try:
+			with open(os.path.join(folder_name, 'spillstats.csv'), 'w', newline='') as f:
+				w = csv.writer(f)
+				w.writerow(['time', 'spillDepth', 'spilledFrames', 'drainedFrames', 'drainRate'])
+				w.writerows(self.samples)
+		except Exception as err:
+			print(err)
+		self.spill.Close()
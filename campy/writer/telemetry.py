@@ -0,0 +1,119 @@
+"""
+Encoder telemetry for ffmpeg processes started by PipeWriter.
+
+ffmpeg is run with '-progress pipe:1', which makes it print key=value blocks
+(frame=, fps=, bitrate=, speed=, ...) to stdout about twice a second. A reader
+thread parses them into Values(), available in process while recording.
+
+A watchdog thread checks the process ten times a second. It reports an encoder
+that exited with an error, and stops an encoder that has stalled: the writer has
+been blocked on the full pipe for longer than encoderStallTimeout (and at least
+MISSED_PROGRESS progress periods), and ffmpeg has not reported progress in that
+time. A slow encoder on a busy machine still reports progress now and then, and
+is left alone. Only encoders that PipeWriter restarts are stopped this way; for
+the others (parallel and segmenting writers) the timeout is 0 and stalls are not
+acted on. At recording rates the pipe fills within a frame or two of a stall, so
+the blocked writer is what reveals it; an idle writer is never taken for a
+stalled encoder. A stalled encoder is asked to stop first (SIGTERM, on which
+ffmpeg finishes the file, e.g. writes the MP4 moov atom) and killed only if it
+has not exited after STOP_GRACE. Either way the writer's next write fails and
+PipeWriter restarts the encoder into a new file.
+"""
+
+import time
+import threading
+import subprocess
+
+CHECK_INTERVAL = 0.1 # sec
+PROGRESS_PERIOD = 0.5 # sec between ffmpeg progress blocks
+MISSED_PROGRESS = 4 # progress periods without a block before an encoder can be stalled
+STOP_GRACE = 1.0 # sec a stalled encoder gets to finish its file before it is killed
+
+def ParseProgress(progress):
+	# Numbers from an ffmpeg progress block; unparsable values are kept as strings
+	values = {}
+	for key, value in progress.items():
+		value = value.strip()
+		try:
+			if key == 'bitrate':
+				values['bitrateKbps'] = float(value.replace('kbits/s', ''))
+			elif key == 'speed':
+				values['speed'] = float(value.rstrip('x'))
+			elif key in ('frame', 'total_size', 'out_time_us', 'out_time_ms', 'drop_frames', 'dup_frames'):
+				values[key] = int(value)
+			elif key == 'fps':
+				values['fps'] = float(value)
+			else:
+				values[key] = value
+		except ValueError:
+			values[key] = value
+	return values
+
+class EncoderTelemetry():
+	def __init__(self, proc, writer, stallTimeout=0):
+		self.proc = proc
+		self.writer = writer
+		self.stallTimeout = max(stallTimeout, MISSED_PROGRESS*PROGRESS_PERIOD) if stallTimeout > 0 else 0
+		self.values = {}
+		self.state = 'running'
+		self.lastUpdate = time.perf_counter()
+		self.stop = threading.Event()
+
+		self.reader = threading.Thread(target=self.ReadProgress, daemon=True)
+		self.reader.start()
+		self.watchdog = threading.Thread(target=self.Watch, daemon=True)
+		self.watchdog.start()
+
+	def ReadProgress(self):
+		progress = {}
+		for line in iter(self.proc.stdout.readline, b''):
+			key, _, value = line.decode('utf-8', 'replace').strip().partition('=')
+			progress[key] = value
+			if key == 'progress':
+				self.values = ParseProgress(progress)
+				self.lastUpdate = time.perf_counter()
+				if value == 'end':
+					self.state = 'finished'
+				progress = {}
+
+	def Watch(self):
+		while not self.stop.wait(CHECK_INTERVAL):
+			returncode = self.proc.poll()
+			if returncode is not None:
+				if returncode != 0 and self.state == 'running':
+					self.state = 'exited'
+					print('Encoder exited with code {} after {} frames: {}'.format(
+						returncode, self.values.get('frame', 0), self.writer.cmd[-1]))
+				break
+
+			# Blocked on a full pipe without any progress: the encoder is stuck
+			now = time.perf_counter()
+			blockedSince = self.writer.blockedSince
+			if (self.stallTimeout > 0 and blockedSince is not None
+					and now - blockedSince > self.stallTimeout
+					and now - self.lastUpdate > self.stallTimeout):
+				self.state = 'stalled'
+				print('Encoder stalled for {:.1f} s after {} frames, stopping it: {}'.format(
+					now - self.lastUpdate, self.values.get('frame', 0), self.writer.cmd[-1]))
+				self.StopStalled()
+				break
+
+	def StopStalled(self):
+		# Lets ffmpeg close the file if it still can (on Windows, terminate() kills at once)
+		self.proc.terminate()
+		try:
+			self.proc.wait(STOP_GRACE)
+		except subprocess.TimeoutExpired:
+			self.proc.kill()
+
+	def Values(self):
+		# Latest progress (frame, fps, bitrateKbps, speed, ...), encoder state and age
+		values = dict(self.values)
+		values['state'] = self.state
+		values['secondsSinceUpdate'] = round(time.perf_counter() - self.lastUpdate, 2)
+		return values
+
+	def Stop(self):
+		self.stop.set()
+		self.watchdog.join()
+		self.reader.join(timeout=1)
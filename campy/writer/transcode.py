@@ -0,0 +1,160 @@
+"""
+Deferred transcoding of raw frame files (writerBackend 'raw').
+
+A pool of worker processes encodes finished raw files (those with a .raw.json
+sidecar) into the video file the camera would have written, with the same
+EncoderParams as real-time recording. The raw file is removed after a
+successful encode unless rawKeep is set; a kept file's sidecar is renamed to
+.transcoded.json, so later scans do not encode it again.
+
+During acquisition, Transcoder scans the raw camera folders and hands files to
+the pool only while the system load (1 min load average, or psutil CPU use where
+there is no load average) is below transcodeMaxLoad, as a fraction of all cores.
+Without a load measure, files wait until acquisition ends. Finish() transcodes
+everything left and waits for the pool.
+
+Raw files left over from earlier sessions can be transcoded with
+campy-transcode <folder> [<folder> ...]
+"""
+
+import os
+import sys
+import glob
+import json
+import argparse
+import threading
+import multiprocessing as mp
+from campy.writer import campipe
+from campy.writer.raw import OpenRaw, RAW_EXT, SIDECAR_EXT
+from campy.writer.pipewriter import OpenPipeWriter, MacroBlockParams
+
+try:
+	import psutil
+except ImportError:
+	psutil = None
+
+SCAN_INTERVAL = 2 # sec between scans for finished raw files
+VIDEO_EXT = ".mp4"
+DONE_EXT = ".transcoded.json" # sidecar of a kept raw file that has been transcoded
+
+def LoadFraction():
+	# Current system load as a fraction of all cores, or None if unknown
+	if hasattr(os, 'getloadavg'):
+		return os.getloadavg()[0]/os.cpu_count()
+	if psutil is not None:
+		return psutil.cpu_percent(interval=None)/100
+	return None
+
+def FinishedRawFiles(folders):
+	# Raw files whose writer has closed them, oldest first
+	files = []
+	for folder in folders:
+		for sidecar in glob.glob(os.path.join(folder, "*" + SIDECAR_EXT)):
+			raw_file_name = sidecar[:-len(SIDECAR_EXT)] + RAW_EXT
+			if os.path.isfile(raw_file_name):
+				files.append(raw_file_name)
+	return sorted(files, key=os.path.getmtime)
+
+def TranscodeFile(raw_file_name):
+	# Encodes one raw file; returns the video file name, or None on failure
+	stem = raw_file_name[:-len(RAW_EXT)]
+	with open(stem + SIDECAR_EXT) as f:
+		cam_params = json.load(f)
+	cam_params["writerBatchFrames"] = 1
+	cam_params.setdefault("encoderPreset", "")
+	video_file_name = stem + cam_params.get("videoExt", VIDEO_EXT)
+
+	frames = OpenRaw(raw_file_name)
+	codec, pix_fmt_out, gpu_params = campipe.EncoderParams(cam_params)
+	writer = OpenPipeWriter(cam_params, video_file_name, codec, pix_fmt_out,
+							MacroBlockParams(cam_params) + gpu_params + campipe.ContainerParams(cam_params))
+	try:
+		for frame in frames:
+			writer.send(frame)
+	except OSError as err:
+		print('Transcoding {} failed: {}'.format(raw_file_name, err))
+	del frames
+	if writer.close() != 0:
+		return None
+
+	print('Transcoded {} frames to {}.'.format(cam_params.get("numFrames", "?"), video_file_name))
+	if cam_params.get("rawKeep", False):
+		os.replace(stem + SIDECAR_EXT, stem + DONE_EXT)
+	else:
+		os.remove(raw_file_name)
+		os.remove(stem + SIDECAR_EXT)
+	return video_file_name
+
+class Transcoder():
+	def __init__(self, folders, numWorkers=2, maxLoad=0.5):
+		self.folders = folders
+		self.maxLoad = maxLoad
+		self.submitted = set()
+		self.results = []
+		ctx = mp.get_context("spawn")
+		self.pool = ctx.Pool(processes=numWorkers)
+		self.stop = threading.Event()
+		self.thread = threading.Thread(target=self.Run, daemon=True)
+		self.thread.start()
+
+	def Submit(self, raw_file_name):
+		self.submitted.add(raw_file_name)
+		self.results.append(self.pool.apply_async(TranscodeFile, (raw_file_name,)))
+
+	def Run(self):
+		# Submits finished files while acquisition leaves cores idle
+		while not self.stop.wait(SCAN_INTERVAL):
+			load = LoadFraction()
+			if load is None or load >= self.maxLoad:
+				continue
+			for raw_file_name in FinishedRawFiles(self.folders):
+				if raw_file_name not in self.submitted:
+					self.Submit(raw_file_name)
+					break # one file per scan, then check the load again
+
+	def Finish(self):
+		self.stop.set()
+		self.thread.join()
+		for raw_file_name in FinishedRawFiles(self.folders):
+			if raw_file_name not in self.submitted:
+				self.Submit(raw_file_name)
+		self.pool.close()
+		self.pool.join()
+		return [result.get() for result in self.results]
+
+def RawFolders(params):
+	# Camera folders of the cameras recording with writerBackend 'raw'
+	folders = []
+	backends = params.get("writerBackend", "imageio")
+	for n_cam in range(params["numCams"]):
+		backend = backends[n_cam] if isinstance(backends, list) else backends
+		if backend == "raw":
+			folders.append(os.path.join(params["videoFolder"], params["cameraNames"][n_cam]))
+	return folders
+
+def StartTranscoder(params):
+	# Transcoder for the raw cameras of this recording, or None if there are none
+	folders = RawFolders(params)
+	if not folders:
+		return None
+	return Transcoder(folders,
+					numWorkers=params.get("transcodeWorkers", 2),
+					maxLoad=params.get("transcodeMaxLoad", 0.5))
+
+def Main():
+	parser = argparse.ArgumentParser(description="Transcode campy raw frame files")
+	parser.add_argument("folders", nargs='+', help="Camera folders with .raw.npy files.")
+	parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Parallel ffmpeg processes.")
+	args = parser.parse_args()
+
+	files = FinishedRawFiles(args.folders)
+	ctx = mp.get_context("spawn")
+	with ctx.Pool(processes=args.workers) as pool:
+		results = pool.map(TranscodeFile, files)
+	failed = [f for f, r in zip(files, results) if r is None]
+	print('Transcoded {} of {} raw files.'.format(len(files) - len(failed), len(files)))
+	if failed:
+		sys.exit(1)
+
+if __name__ == '__main__':
+	Main()
@@ -13,7 +13,13 @@
 					],
     entry_points={
         "console_scripts": [
-            "campy-acquire = campy.campy:Main"
+            "campy-acquire = campy.campy:Main",
+            "campy-bench-encode = campy.bench.encode:Main",
+            "campy-transcode = campy.writer.transcode:Main",
+            "campy-recover = campy.utils.recover:Main",
+            "campy-daemon = campy.daemon:Main",
+            "campy-control = campy.daemon:ControlMain",
+            "campy-verify = campy.utils.verify:Main",
         ]
     }
 )
\ No newline at end of file